@@ -0,0 +1,162 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+PLATFORMS = ['K64F', 'NUCLEO_F401RE', 'NRF51_DK', 'K22F']
+# target_id prefix of each platform, the rest of the 48 characters is the board serial
+PLATFORM_CODES = {'K64F': '0240', 'NUCLEO_F401RE': '0720', 'NRF51_DK': '1100', 'K22F': '0231'}
+MOUNT_ROOT = '/media/bench'
+
+
+def target_id(index, platform_name):
+    """
+    :return: 48 character target_id of synthetic board index
+    """
+    return '%s0000%08x4e45%028x' % (PLATFORM_CODES[platform_name], index, index)
+
+
+def disk_name(index):
+    """
+    :return: block device name like sdb, sdz, sdab for board index
+    """
+    letters = ''
+    number = index + 1
+    while number:
+        number, rest = divmod(number - 1, 26)
+        letters = chr(ord('a') + rest) + letters
+    return 'sd' + letters
+
+
+def make_devices(count):
+    """
+    :param count: amount of boards
+    :return: device table like mbed-ls reports, platforms interleaved
+    """
+    devices = []
+    for index in range(count):
+        platform_name = PLATFORMS[index % len(PLATFORMS)]
+        tid = target_id(index, platform_name)
+        devices.append({'target_id': tid,
+                        'target_id_usb_id': tid,
+                        'target_id_mbed_htm': tid,
+                        'platform_name': platform_name,
+                        'platform_name_unique': '%s[%i]' % (platform_name, index),
+                        'mount_point': '%s/DAPLINK%i' % (MOUNT_ROOT, index),
+                        'serial_port': '/dev/ttyACM%i' % index,
+                        'daplink_version': '0244'})
+    return devices
+
+
+class SyntheticFlasher(object):
+    """
+    Flasher class reporting a fixed device table, given to DeviceCache
+    """
+    devices = []
+
+    @classmethod
+    def get_available_devices(cls):
+        """
+        :return: copy of the device table as mbed-ls would create on every call
+        """
+        return [dict(device) for device in cls.devices]
+
+
+class FakeRoot(object):
+    """
+    Directory tree with dev/serial/by-id, dev/disk/by-id and proc/self/mountinfo
+    of the given devices, used as MountVerifier root
+    """
+    def __init__(self, devices):
+        self.path = tempfile.mkdtemp(prefix='mbedflash-bench-')
+        serial_dir = os.path.join(self.path, 'dev', 'serial', 'by-id')
+        disk_dir = os.path.join(self.path, 'dev', 'disk', 'by-id')
+        for directory in (serial_dir, disk_dir, os.path.join(self.path, 'proc', 'self')):
+            os.makedirs(directory)
+        lines = ["25 1 8:1 / / rw,relatime shared:1 - ext4 /dev/nvme0n1p1 rw\n"]
+        for index, device in enumerate(devices):
+            tid = device['target_id']
+            disk = disk_name(index + 1)
+            os.symlink('../../ttyACM%i' % index, os.path.join(
+                serial_dir, 'usb-ARM_DAPLink_CMSIS-DAP_%s-if01' % tid))
+            os.symlink('../../%s' % disk, os.path.join(disk_dir, 'usb-MBED_VFS_%s-0:0' % tid))
+            lines.append("%i 25 8:%i / %s rw,nosuid shared:%i - vfat /dev/%s rw,fmask=0022\n"
+                         % (100 + index, 16 * (index + 1), device['mount_point'],
+                            20 + index, disk))
+        with open(os.path.join(self.path, 'proc', 'self', 'mountinfo'), 'w') as mountinfo:
+            mountinfo.writelines(lines)
+
+    def close(self):
+        """
+        Remove the tree
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def tmpfs_dir():
+    """
+    :return: new directory on tmpfs, /dev/shm if usable, otherwise a temporary directory
+    """
+    base = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) \
+        else None
+    return tempfile.mkdtemp(prefix='mbedflash-bench-', dir=base)
+
+
+class VfatImage(object):
+    """
+    Loop mounted vfat image like the mass storage of an interface chip.
+    Requires root, mkfs.vfat and mount.
+    """
+    def __init__(self, size_mb=64):
+        self.directory = tempfile.mkdtemp(prefix='mbedflash-bench-')
+        self.image = os.path.join(self.directory, 'vfat.img')
+        self.mount_point = os.path.join(self.directory, 'DAPLINK')
+        self.mounted = False
+        os.mkdir(self.mount_point)
+        try:
+            with open(self.image, 'wb') as image:
+                image.truncate(size_mb * 1024 * 1024)
+            subprocess.check_call(['mkfs.vfat', self.image], stdout=open(os.devnull, 'w'))
+            subprocess.check_call(['mount', '-o', 'loop,sync', self.image, self.mount_point])
+            self.mounted = True
+        except (OSError, subprocess.CalledProcessError):
+            self.close()
+            raise
+
+    @staticmethod
+    def unavailable():
+        """
+        :return: reason why a vfat image can not be mounted, None if it can
+        """
+        if not hasattr(os, 'geteuid') or os.geteuid() != 0:
+            return 'requires root'
+        for tool in ('mkfs.vfat', 'mount'):
+            if not any(os.access(os.path.join(path, tool), os.X_OK)
+                       for path in os.environ.get('PATH', '').split(os.pathsep)):
+                return '%s not found' % tool
+        return None
+
+    def close(self):
+        """
+        Unmount and remove the image
+        """
+        if self.mounted:
+            subprocess.call(['umount', self.mount_point])
+            self.mounted = False
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmarks of mbed-flasher itself on a synthetic device table, no boards needed.
+
+    python benchmark/run.py --output results.json
+    python benchmark/run.py --compare base.json results.json
+"""
+
+# python 3 compatibility
+# pylint: disable=superfluous-parens
+
+from __future__ import print_function
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from timeit import default_timer
+
+import suites
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+EXIT_CODE_SUCCESS = 0
+EXIT_CODE_REGRESSION = 1
+
+DEFAULT_DEVICES = '1,10,100,1000'
+DEFAULT_SIZES = '64,512,2048'
+DEFAULT_REPEAT = 5
+# each sample calls the function until at least this many seconds have passed
+MIN_SAMPLE_TIME = 0.05
+
+
+def median(values):
+    """
+    :return: median of values
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def calibrate(func):
+    """
+    :return: number of calls per sample so that a sample takes MIN_SAMPLE_TIME
+    """
+    number = 1
+    while True:
+        start = default_timer()
+        for _ in range(number):
+            func()
+        if default_timer() - start >= MIN_SAMPLE_TIME or number >= 1 << 20:
+            return number
+        number *= 2
+
+
+def peak_memory(func):
+    """
+    :return: peak bytes allocated by python during one call, None without tracemalloc
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(case, repeat):
+    """
+    :param case: suites.Case
+    :param repeat: amount of samples
+    :return: result dictionary
+    """
+    result = {'name': case.name, 'devices': case.devices, 'size': case.size}
+    if case.skipped:
+        result['skipped'] = case.skipped
+        return result
+    case.func()
+    number = calibrate(case.func)
+    samples = []
+    for _ in range(repeat):
+        start = default_timer()
+        for _ in range(number):
+            case.func()
+        samples.append((default_timer() - start) / number)
+    result.update({'number': number,
+                   'repeat': repeat,
+                   'min': min(samples),
+                   'median': median(samples),
+                   'mean': sum(samples) / len(samples),
+                   'peak_memory': peak_memory(case.func)})
+    if case.size:
+        result['mb_per_s'] = case.size / result['median'] / (1024 * 1024)
+    return result
+
+
+def generate_cases(args):
+    """
+    :return: cases of the selected suites
+    """
+    devices = [int(count) for count in args.devices.split(',')]
+    sizes = [int(size) * 1024 for size in args.sizes.split(',')]
+    for suite in args.suites.split(','):
+        if suite == 'copy':
+            for case in suites.copy(sizes, vfat=args.vfat):
+                yield case
+            continue
+        generator = {'enumeration': suites.enumeration,
+                     'resolve': suites.resolution,
+                     'mount': suites.mount_verification,
+                     'virtual': suites.virtual_flash}[suite]
+        for count in devices:
+            for case in generator(count):
+                yield case
+
+
+def git_commit():
+    """
+    :return: commit of the working tree, None if not known
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """
+    Run benchmarks and write results to args.output
+    """
+    import mbed_flasher
+    results = []
+    for case in generate_cases(args):
+        result = measure(case, args.repeat)
+        results.append(result)
+        print(format_result(result))
+    report = {'commit': git_commit(),
+              'version': mbed_flasher.__version__,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                            if resource else None,
+              'results': results}
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print("results written to %s" % args.output)
+    return EXIT_CODE_SUCCESS
+
+
+def _key(result):
+    return result['name'], result['devices'], result['size']
+
+
+def _label(result):
+    name, devices, size = _key(result)
+    if devices is not None:
+        return '%s[%i devices]' % (name, devices)
+    if size is not None:
+        return '%s[%i KiB]' % (name, size // 1024)
+    return name
+
+
+def format_result(result):
+    """
+    :return: one line description of result
+    """
+    if 'skipped' in result:
+        return '%-48s skipped: %s' % (_label(result), result['skipped'])
+    line = '%-48s %12.1f us' % (_label(result), result['median'] * 1e6)
+    if 'mb_per_s' in result:
+        line += ' %9.1f MiB/s' % result['mb_per_s']
+    if result.get('peak_memory') is not None:
+        line += ' %9.1f KiB peak' % (result['peak_memory'] / 1024.0)
+    return line
+
+
+def compare(args):
+    """
+    Print median change of every benchmark between two result files
+    :return: EXIT_CODE_REGRESSION if a benchmark got slower than threshold
+    """
+    with open(args.compare[0]) as base_file, open(args.compare[1]) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+    print("%s -> %s" % (base.get('commit'), new.get('commit')))
+    base_results = dict((_key(result), result) for result in base['results'])
+    regressions = 0
+    for result in new['results']:
+        old = base_results.get(_key(result))
+        if not old or 'median' not in old or 'median' not in result:
+            continue
+        change = result['median'] / old['median'] - 1
+        regressed = change > args.threshold
+        regressions += regressed
+        print('%-48s %12.1f -> %12.1f us %+7.1f%%%s' % (
+            _label(result), old['median'] * 1e6, result['median'] * 1e6, change * 100,
+            ' REGRESSION' if regressed else ''))
+    return EXIT_CODE_REGRESSION if regressions else EXIT_CODE_SUCCESS
+
+
+def main(sysargs=None):
+    """
+    benchmark entry point
+    """
+    parser = argparse.ArgumentParser('benchmark/run.py', description=__doc__.split('\n\n')[1])
+    parser.add_argument('--suites', default=','.join(suites.SUITES),
+                        help='Comma separated suites to run, default %(default)s')
+    parser.add_argument('--devices', default=DEFAULT_DEVICES,
+                        help='Comma separated sizes of the device table, '
+                             'default %(default)s')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='Comma separated image sizes in KiB for copy, '
+                             'default %(default)s')
+    parser.add_argument('--repeat', default=DEFAULT_REPEAT, type=int,
+                        help='Samples per benchmark, default %(default)s')
+    parser.add_argument('--vfat', action='store_true',
+                        help='Also copy to a loop mounted vfat image, requires root')
+    parser.add_argument('-o', '--output', default='benchmark-results.json',
+                        help='JSON result file, default %(default)s')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='Compare two result files instead of running benchmarks')
+    parser.add_argument('--threshold', default=0.1, type=float,
+                        help='Relative slowdown reported as regression, default %(default)s')
+    args = parser.parse_args(sysargs)
+    if args.compare:
+        return compare(args)
+    # benchmarks measure the code, not the log handlers
+    logging.disable(logging.CRITICAL)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
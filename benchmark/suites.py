@@ -0,0 +1,203 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import os
+import platform
+import shutil
+import tempfile
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from mbed_flasher.common import MountVerifier
+from mbed_flasher.devices import DeviceCache, DeviceIndex
+from mbed_flasher.erase import Erase
+from mbed_flasher.flash import Flash, EXIT_CODE_FILE_DOES_NOT_EXIST
+from mbed_flasher.flashers.FlasherMbed import FlasherMbed
+from mbed_flasher.flashers.FlasherVirtual import FlasherVirtual, VirtualFarm
+from mbed_flasher.main import FlasherCLI
+from mbed_flasher.reset import Reset
+
+from fixtures import SyntheticFlasher, FakeRoot, VfatImage, make_devices, tmpfs_dir
+
+
+class Case(object):
+    """
+    One measured function
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, name, func, devices=None, size=None, skipped=None):
+        """
+        :param name: benchmark name, e.g. enumeration.get_devices
+        :param func: function called without arguments
+        :param devices: amount of devices in the device table
+        :param size: bytes handled by one call, throughput is reported if given
+        :param skipped: reason why the case can not be run here
+        """
+        self.name = name
+        self.func = func
+        self.devices = devices
+        self.size = size
+        self.skipped = skipped
+
+
+def enumeration(count):
+    """
+    Device table consumers: every scan, cached scans and the lookup index
+    """
+    devices = make_devices(count)
+    SyntheticFlasher.devices = devices
+    uncached = DeviceCache(ttl=0, flashers=[SyntheticFlasher])
+    cached = DeviceCache(ttl=3600, flashers=[SyntheticFlasher])
+    cached.get_index()
+    flasher = Flash(device_cache=cached)
+    yield Case('enumeration.scan', uncached.get_devices, count)
+    yield Case('enumeration.scan_index', lambda: uncached.get_index(refresh=True), count)
+    yield Case('enumeration.cached_devices', cached.get_devices, count)
+    yield Case('enumeration.cached_index', cached.get_index, count)
+    yield Case('enumeration.flash_device_mapping', flasher.get_available_device_mapping, count)
+
+
+def resolution(count):
+    """
+    Mapping of target_ids, prefixes and platforms to devices as main, Flash,
+    Erase and Reset do it
+    """
+    devices = make_devices(count)
+    SyntheticFlasher.devices = devices
+    cache = DeviceCache(ttl=3600, flashers=[SyntheticFlasher])
+    index = cache.get_index()
+    every_other = [device['target_id'] for device in devices[::2]]
+    prefix = devices[-1]['target_id'][:4]
+    flasher = Flash(device_cache=cache)
+    missing = os.path.join(tempfile.gettempdir(), 'mbedflash-bench-missing.bin')
+    # flash_multiple maps the devices and stops at the missing image
+    assert flasher.flash_multiple(missing, 'K64F', target_ids_or_prefix=every_other) \
+        == EXIT_CODE_FILE_DOES_NOT_EXIST
+
+    yield Case('resolve.main_prefix',
+               lambda: FlasherCLI.prepare_platforms_and_targets(index, prefix, []), count)
+    yield Case('resolve.main_target_ids',
+               lambda: FlasherCLI.prepare_platforms_and_targets(index, every_other, []), count)
+    yield Case('resolve.flash_target_ids',
+               lambda: flasher.flash_multiple(missing, 'K64F', target_ids_or_prefix=every_other),
+               count)
+    yield Case('resolve.flash_platform',
+               lambda: flasher.flash_multiple(missing, 'K64F'), count)
+    yield Case('resolve.erase_target_ids',
+               lambda: Erase.prepare_target_to_erase(every_other, index), count)
+    yield Case('resolve.reset_all',
+               lambda: Reset.prepare_target_to_reset('all', index), count)
+    yield Case('resolve.index_build', lambda: DeviceIndex(devices), count)
+
+
+def mount_verification(count):
+    """
+    MountVerifier against a fake /dev and /proc tree where every device
+    got a new serial port and disk after remount
+    """
+    if platform.system() != 'Linux':
+        yield Case('mount.check_targets', None, count, skipped='Linux only')
+        return
+    devices = make_devices(count)
+    root = FakeRoot(devices)
+    try:
+        verifier = MountVerifier(logging.getLogger('mbed-flasher'), root=root.path)
+        targets = [dict(device, serial_port='/dev/ttyUSB%i' % i)
+                   for i, device in enumerate(devices)]
+        results = verifier.check_targets(targets)
+        assert all(isinstance(result, dict) for result in results), results
+        yield Case('mount.read_links', verifier.read_links, count)
+        yield Case('mount.read_mounts', verifier.read_mounts, count)
+        yield Case('mount.check_targets', lambda: verifier.check_targets(targets), count)
+        yield Case('mount.check_points_unchanged',
+                   lambda: verifier.check_points_unchanged(targets[-1]), count)
+    finally:
+        root.close()
+
+
+def virtual_flash(count):
+    """
+    Flash of every board of a virtual farm at once, remount handling and
+    concurrency of the whole flash state machine
+    """
+    if not hasattr(os, 'openpty'):
+        yield Case('virtual.flash_all', None, count, skipped='requires pty')
+        return
+    # pty pair and the port opened by the flash per device
+    if resource and resource.getrlimit(resource.RLIMIT_NOFILE)[0] < 3 * count + 64:
+        yield Case('virtual.flash_all', None, count, skipped='open file limit')
+        return
+    image = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'test', 'helloworld.bin')
+    with VirtualFarm(count=count, remount_time=0.05):
+        flasher = Flash(device_cache=DeviceCache(ttl=0, flashers=[FlasherVirtual]))
+        assert flasher.flash_multiple(image, 'K64F', max_workers=count) == 0
+        yield Case('virtual.flash_all',
+                   lambda: flasher.flash_multiple(image, 'K64F', max_workers=count), count)
+        yield Case('virtual.flash_pipeline',
+                   lambda: flasher.flash_multiple(image, 'K64F', max_workers=count,
+                                                  pipeline=8), count)
+
+
+def _copy_cases(name, directory, sizes):
+    """
+    :param directory: destination directory
+    :param sizes: image sizes in bytes
+    """
+    source_dir = tempfile.mkdtemp(prefix='mbedflash-bench-')
+    try:
+        flasher = FlasherMbed()
+        for size in sizes:
+            source = os.path.join(source_dir, 'image_%i.bin' % size)
+            with open(source, 'wb') as image:
+                image.write(os.urandom(size))
+            destination = os.path.join(directory, 'image.bin')
+            yield Case(name, lambda src=source: flasher.copy_file(src, destination), size=size)
+    finally:
+        shutil.rmtree(source_dir, ignore_errors=True)
+
+
+def copy(sizes, vfat=False):
+    """
+    copy_file throughput into tmpfs and optionally into a loop mounted vfat image
+    """
+    directory = tmpfs_dir()
+    try:
+        for case in _copy_cases('copy.tmpfs', directory, sizes):
+            yield case
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if not vfat:
+        return
+    reason = VfatImage.unavailable()
+    if reason:
+        for size in sizes:
+            yield Case('copy.vfat', None, size=size, skipped=reason)
+        return
+    image = VfatImage(size_mb=max(sizes) * 2 // (1024 * 1024) + 16)
+    try:
+        for case in _copy_cases('copy.vfat', image.mount_point, sizes):
+            yield case
+    finally:
+        image.close()
+
+
+SUITES = ['enumeration', 'resolve', 'mount', 'copy', 'virtual']
@@ -15,4 +15,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from .main import mbedflash_main
+__version__ = '0.5.0'
+
+
+def mbedflash_main():
+    """
+    Console entry point, imports CLI only when invoked
+    """
+    from mbed_flasher.main import mbedflash_main as main
+    return main()
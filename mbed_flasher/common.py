@@ -14,13 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import json
 import logging
+import os
 import platform
-from time import sleep
-from subprocess import check_output
-import six
-
-import mbed_lstools
+import tempfile
+from threading import Event, Lock, Thread
+from time import sleep, time
+from six.moves import queue
+from mbed_flasher.metrics import get_metrics, MOUNT_VERIFIER_ROUNDS
 
 
 # pylint: disable=too-few-public-methods
@@ -40,48 +42,428 @@ class Logger(object):
         return self.logger
 
 
+class Future(object):
+    """
+    Result of an operation which is completed in another thread
+    """
+    def __init__(self):
+        self._event = Event()
+        self._lock = Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """
+        :return: True if result is available
+        """
+        return self._event.is_set()
+
+    def set_result(self, result):
+        """
+        :param result: result of the operation
+        """
+        self._complete(result, None)
+
+    def set_exception(self, exception):
+        """
+        :param exception: exception raised by the operation
+        """
+        self._complete(None, exception)
+
+    def _complete(self, result, exception):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """
+        :param callback: called with the future once it is done
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def result(self, timeout=None):
+        """
+        Wait for the result, waiting in slices lets KeyboardInterrupt reach the caller
+        :param timeout: maximum time to wait in seconds, None waits forever
+        :return: result of the operation
+        """
+        deadline = None if timeout is None else time() + timeout
+        while not self._event.is_set():
+            wait = 0.5 if deadline is None else min(0.5, deadline - time())
+            if wait <= 0:
+                raise RuntimeError("Result not available in %s seconds" % timeout)
+            self._event.wait(wait)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+def run_parallel(function, items, max_workers=None):
+    """
+    Run function for every item using a bounded pool of worker threads
+    :param function: callable taking a single item
+    :param items: items to process
+    :param max_workers: maximum amount of concurrently running workers,
+                        None or 1 runs items sequentially in the calling thread
+    :return: list of results in the same order as items
+    """
+    items = list(items)
+    if not max_workers or max_workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    results = [None] * len(items)
+    errors = []
+    work = queue.Queue()
+    for index, item in enumerate(items):
+        work.put((index, item))
+
+    def worker():
+        """
+        Process items until the work queue is empty
+        """
+        while True:
+            try:
+                index, item = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = function(item)
+            # errors are re-raised in the calling thread
+            # pylint: disable=broad-except
+            except Exception as err:
+                errors.append(err)
+
+    threads = [Thread(target=worker) for _ in range(min(max_workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+
+    if errors:
+        raise errors[0]
+    return results
+
+
+def get_cache_dir():
+    """
+    Directory for state kept between runs, created if missing.
+    MBED_FLASHER_CACHE_DIR environment variable overrides the default location.
+    :return: path of the cache directory
+    """
+    cache_dir = os.environ.get('MBED_FLASHER_CACHE_DIR')
+    if not cache_dir:
+        if platform.system() == 'Windows':
+            base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'),
+                                                                 '.cache'))
+        cache_dir = os.path.join(base, 'mbed-flasher')
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+    return cache_dir
+
+
+def write_json_atomic(path, data):
+    """
+    Write data as json so that readers see either the old or the new file
+    :param path: path of the file
+    :param data: json serializable data
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(handle, 'w') as tmp_file:
+            json.dump(data, tmp_file, indent=1, sort_keys=True)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, path)
+        else:
+            if platform.system() == 'Windows' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _unescape_mountinfo(field):
+    """
+    :return: field of mountinfo with octal escapes such as \\040 decoded
+    """
+    parts = field.split('\\')
+    decoded = [parts[0]]
+    for part in parts[1:]:
+        if len(part) >= 3 and part[:3].isdigit():
+            decoded.append(chr(int(part[:3], 8)) + part[3:])
+        else:
+            decoded.append('\\' + part)
+    return ''.join(decoded)
+
+
+def parse_mountinfo(text):
+    """
+    :param text: contents of /proc/self/mountinfo
+    :return: list of (source, mount point, file system type) tuples
+    """
+    mounts = []
+    for line in text.splitlines():
+        fields = line.split()
+        # optional fields end at the separator, source follows the file system type
+        try:
+            separator = fields.index('-', 6)
+            mounts.append((_unescape_mountinfo(fields[separator + 2]),
+                           _unescape_mountinfo(fields[4]),
+                           fields[separator + 1]))
+        except (ValueError, IndexError):
+            continue
+    return mounts
+
+
+class _VerificationRounds(object):
+    """
+    Pending verifications of one root, resolved in shared polling rounds by
+    one thread. Each round reads the by-id links once for the verifications
+    which arrived since the previous round and the mount table once for all
+    which still wait for their mount point.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._incoming = []
+        self._running = False
+        self.rounds = 0
+
+    def submit(self, verifier, targets):
+        """
+        :param verifier: MountVerifier which logs the outcome of its targets
+        :param targets: list of targets
+        :return: list of futures of the verifications
+        """
+        entries = [(verifier, target, Future()) for target in targets]
+        with self._lock:
+            self._incoming.extend(entries)
+            if not self._running:
+                self._running = True
+                thread = Thread(target=self._run, args=(verifier,))
+                thread.daemon = True
+                thread.start()
+        return [future for _, _, future in entries]
+
+    def _run(self, reader):
+        """
+        Poll until no verification is pending
+        :param reader: MountVerifier of the root used to read links and mounts
+        """
+        pending = []
+        while True:
+            with self._lock:
+                incoming, self._incoming = self._incoming, []
+                if not incoming and not pending:
+                    self._running = False
+                    return
+            self.rounds += 1
+            get_metrics().increment(MOUNT_VERIFIER_ROUNDS)
+            try:
+                if incoming:
+                    links = reader.read_links()
+                    for verifier, target, future in incoming:
+                        new_target = {}
+                        result = verifier.resolve_links(target, new_target, links)
+                        if result is None:
+                            deadline = time() + MountVerifier.MOUNT_POINT_TIMEOUT
+                            pending.append((verifier, target, future, new_target, deadline))
+                        else:
+                            future.set_result(result)
+                if pending:
+                    mounts = {}
+                    for source, mount_point, fstype in reader.read_mounts():
+                        # DAPLink disks are vfat, a later mount of the source is a bind
+                        if fstype == MountVerifier.MOUNT_FSTYPE:
+                            mounts.setdefault(source, mount_point)
+                    pending = [entry for entry in pending if not self._retire(entry, mounts)]
+            # verifications must not wait forever for a crashed poller
+            # pylint: disable=broad-except
+            except Exception as err:
+                for entry in pending + incoming:
+                    if not entry[2].done():
+                        entry[2].set_exception(err)
+                pending = []
+                continue
+            if pending:
+                sleep(MountVerifier.MOUNT_POINT_POLL_INTERVAL)
+
+    @staticmethod
+    def _retire(entry, mounts):
+        """
+        Complete verification if its mount point has appeared or its time is up
+        :return: True if verification is complete
+        """
+        verifier, target, future, new_target, deadline = entry
+        mount_point = mounts.get(new_target['dev_point'])
+        if mount_point is not None:
+            new_target['mount_point'] = mount_point
+            future.set_result(verifier.get_target(new_target, target))
+            return True
+        if time() >= deadline:
+            verifier.logger.error(
+                "vfat mount point for %s did not re-appear in the system in %i seconds",
+                target['target_id'], MountVerifier.MOUNT_POINT_TIMEOUT)
+            future.set_result(-12)
+            return True
+        return False
+
+
+_ROUNDS_LOCK = Lock()
+_ROUNDS = {}
+
+
+def _get_rounds(root):
+    """
+    :return: process wide verification rounds of root
+    """
+    with _ROUNDS_LOCK:
+        return _ROUNDS.setdefault(os.path.abspath(root), _VerificationRounds())
+
+
 class MountVerifier(object):
     """
     Verifier class used to verify that device returns to operational state
-    after flash or erase.
+    after flash or erase. On Linux the links of /dev/serial/by-id and
+    /dev/disk/by-id and the mount table in /proc/self/mountinfo are read
+    directly, relative to root so that tests can use a fake file system.
+    Verifications running concurrently in the process share one scan per
+    polling round.
     """
     MOUNT_POINT_TIMEOUT = 20
+    MOUNT_FSTYPE = 'vfat'
+    MOUNT_POINT_POLL_INTERVAL = 0.25
 
-    def __init__(self, logger):
+    def __init__(self, logger, root='/'):
+        """
+        :param logger: logger to use
+        :param root: directory holding dev and proc, default the real root
+        """
         self.logger = logger
+        self.root = root
+
+    def _path(self, *parts):
+        """
+        :return: path below root
+        """
+        return os.path.join(self.root, *parts)
+
+    def _read_link_dir(self, directory):
+        """
+        :param directory: directory of links, e.g. dev/serial/by-id
+        :return: list of (link name, /dev/ path of link target) tuples, sorted by name
+        """
+        path = self._path(directory)
+        try:
+            names = sorted(entry.name for entry in os.scandir(path)) \
+                if hasattr(os, 'scandir') else sorted(os.listdir(path))
+        except (IOError, OSError):
+            return []
+        links = []
+        for name in names:
+            try:
+                target = os.readlink(os.path.join(path, name))
+            except (IOError, OSError):
+                continue
+            links.append((name, '/dev/' + target.split('/')[-1]))
+        return links
+
+    def read_links(self):
+        """
+        :return: dictionary of serial and disk links, see _read_link_dir
+        """
+        return {'serial': self._read_link_dir(os.path.join('dev', 'serial', 'by-id')),
+                'disk': self._read_link_dir(os.path.join('dev', 'disk', 'by-id'))}
+
+    def read_mounts(self):
+        """
+        :return: parsed mount table, empty if it can not be read
+        """
+        try:
+            with open(self._path('proc', 'self', 'mountinfo'), 'r') as mountinfo:
+                return parse_mountinfo(mountinfo.read())
+        except (IOError, OSError) as err:
+            self.logger.debug("Could not read mount table: %s", err)
+            return []
 
     def check_points_unchanged(self, target):
         """
         Check if points are unchanged
         """
-        new_target = {}
-        if platform.system() == 'Windows':
-            mbeds = mbed_lstools.create()
-            if target['serial_port'] != mbeds.get_mbed_com_port(target['target_id']):
-                new_target['serial_port'] = mbeds.get_mbed_com_port(target['target_id'])
+        return self.check_targets([target])[0]
 
-            return self._get_target(new_target=new_target, target=target)
+    def check_targets(self, targets):
+        """
+        Check points of many targets, each target is done as soon as its
+        mount point appears
+        :param targets: list of targets
+        :return: list of new targets or error codes in order of targets
+        """
+        if platform.system() == 'Windows':
+            import mbed_lstools
+            # one scan for all targets
+            ports = dict((mbed['target_id'], mbed.get('serial_port'))
+                         for mbed in mbed_lstools.create().list_mbeds())
+            results = []
+            for target in targets:
+                new_target = {}
+                serial_port = ports.get(target['target_id'])
+                if target['serial_port'] != serial_port:
+                    new_target['serial_port'] = serial_port
+                results.append(self.get_target(new_target=new_target, target=target))
+            return results
 
         if platform.system() == 'Darwin':
-            return self._get_target(new_target, target)
+            return [self.get_target({}, target) for target in targets]
 
-        return_code = self._check_serial_point_duplicates(target=target,
-                                                          new_target=new_target)
-        if return_code:
-            return return_code
+        futures = _get_rounds(self.root).submit(self, targets)
+        return [future.result() for future in futures]
 
-        return_code = self._check_device_point_duplicates(target=target,
-                                                          new_target=new_target)
+    def resolve_links(self, target, new_target, links):
+        """
+        :param target: old target
+        :param new_target: collects changed points of target
+        :param links: links from read_links
+        :return: target or error code if done, None if mount point has to be waited for
+        """
+        return_code = self._check_serial_point_duplicates(target, new_target, links['serial'])
         if return_code:
             return return_code
 
-        return_code = self._verify_mount_point(target=target, new_target=new_target)
+        return_code = self._check_device_point_duplicates(target, new_target, links['disk'])
         if return_code:
             return return_code
 
-        return self._get_target(new_target, target)
+        if not new_target:
+            return self.get_target(new_target, target)
 
-    def _get_target(self, new_target, target):
+        if 'dev_point' not in new_target:
+            self.logger.error("Target %s is missing /dev/disk/by-id/ point",
+                              target['target_id'])
+            return -12
+        return None
+
+    def get_target(self, new_target, target):
         """
         get target
         """
@@ -103,74 +485,40 @@ class MountVerifier(object):
 
         return target
 
-    def _check_serial_point_duplicates(self, target, new_target):
+    def _check_serial_point_duplicates(self, target, new_target, links):
         """
         Verify that target is not listed multiple times in /dev/serial/by-id
         :param target: old target
         :param new_target: new target
+        :param links: links of /dev/serial/by-id
         :return: if all is well None, otherwise error code
         """
-        lines = check_output(["ls", "-oA", "/dev/serial/by-id/"]).splitlines()
-        for line in lines:
-            if six.PY3:
-                line = line.decode('utf-8')
-            if line.find(target['target_id']) != -1 \
-                    and target['serial_port'].split('/')[-1] != line.split('/')[-1]:
+        old_port = target['serial_port'].split('/')[-1]
+        for name, serial_port in links:
+            if name.find(target['target_id']) != -1 \
+                    and serial_port.split('/')[-1] != old_port:
                 if 'serial_port' not in new_target:
-                    new_target['serial_port'] = '/dev/' + line.split('/')[-1]
+                    new_target['serial_port'] = serial_port
                 else:
                     self.logger.error('target_id %s has more than 1 '
                                       'serial port in the system',
                                       target['target_id'])
                     return -10
 
-    def _check_device_point_duplicates(self, target, new_target):
+    def _check_device_point_duplicates(self, target, new_target, links):
         """
         Verify that target is not listed multiple times in /dev/disk/by-id
         :param target: old target
         :param new_target: new target
+        :param links: links of /dev/disk/by-id
         :return: if all is well None, otherwise error code
         """
-        lines = check_output(["ls", "-oA", "/dev/disk/by-id/"]).splitlines()
-        for dev_line in lines:
-            if six.PY3:
-                dev_line = dev_line.decode('utf-8')
-            if dev_line.find(target['target_id']) != -1:
+        for name, dev_point in links:
+            if name.find(target['target_id']) != -1:
                 if 'dev_point' not in new_target:
-                    new_target['dev_point'] = '/dev/' + dev_line.split('/')[-1]
+                    new_target['dev_point'] = dev_point
                 else:
                     self.logger.error("target_id %s has more than 1 "
                                       "device point in the system",
                                       target['target_id'])
                     return -11
-
-    def _verify_mount_point(self, target, new_target):
-        """
-        Verify that if target has changed points a mount point can still be found for it
-        :param target: old target
-        :param new_target: new target
-        :return: if all is well None, otherwise error code
-        """
-        if not new_target:
-            return
-
-        if 'dev_point' not in new_target:
-            self.logger.error("Target %s is missing /dev/disk/by-id/ point",
-                              target['target_id'])
-            return -12
-
-        for _ in range(MountVerifier.MOUNT_POINT_TIMEOUT):
-            mounts = check_output(["mount", "|", "grep", "vfat"], shell=True).splitlines()
-            for mount in mounts:
-                if six.PY3:
-                    mount = mount.decode('utf-8')
-                if mount.find(new_target['dev_point']) != -1:
-                    new_target['mount_point'] = \
-                        mount.split('on')[1].split('type')[0].strip()
-                    return
-            sleep(1)
-
-        self.logger.error(
-            "vfat mount point for %s did not re-appear in the system in %i seconds",
-            target['target_id'], MountVerifier.MOUNT_POINT_TIMEOUT)
-        return -12
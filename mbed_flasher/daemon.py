@@ -0,0 +1,333 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import os
+from os.path import isfile
+import socket
+from six.moves import socketserver
+
+from mbed_flasher.common import get_cache_dir
+from mbed_flasher.daplink_details import get_details_cache
+from mbed_flasher.devices import get_device_cache
+from mbed_flasher.metrics import get_metrics
+from mbed_flasher.platforms import get_platform_database
+from mbed_flasher.scheduler import Job, Scheduler
+
+EXIT_CODE_SUCCESS = 0
+EXIT_CODE_FILE_MISSING = 5
+EXIT_CODE_NOT_SUPPORTED_PLATFORM = 10
+EXIT_CODE_NO_TARGET_ID = 15
+EXIT_CODE_DEVICES_MISSING = 20
+EXIT_CODE_COULD_NOT_MAP_DEVICE = 25
+EXIT_CODE_PLATFORM_REQUIRED = 40
+EXIT_CODE_DAEMON_UNAVAILABLE = 70
+EXIT_CODE_INVALID_REQUEST = 71
+EXIT_CODE_REQUEST_FAILED = 72
+
+SOCKET_FILE = 'mbedflash.sock'
+
+
+def get_socket_path():
+    """
+    :return: default daemon socket, MBED_FLASHER_SOCKET environment variable overrides it
+    """
+    return os.environ.get('MBED_FLASHER_SOCKET') or os.path.join(get_cache_dir(), SOCKET_FILE)
+
+
+class FlashDaemon(object):
+    """
+    Executes flash, erase and reset requests with warm device and platform tables.
+    Requests are split to one job per device and run by a Scheduler.
+    """
+    def __init__(self, device_cache=None, platform_db=None, scheduler=None, logger=None,
+                 metrics_file=None):
+        """
+        :param device_cache: DeviceCache, default process wide cache
+        :param platform_db: PlatformDatabase, default process wide database
+        :param scheduler: Scheduler running the jobs
+        :param logger: logger to use
+        :param metrics_file: prometheus textfile rewritten after each request
+        """
+        self.metrics_file = metrics_file
+        self.device_cache = device_cache if device_cache else get_device_cache()
+        self.platform_db = platform_db if platform_db else get_platform_database()
+        self.logger = logger if logger else logging.getLogger('mbed-flasher')
+        self.scheduler = scheduler if scheduler else Scheduler(device_cache=self.device_cache,
+                                                               logger=self.logger)
+        self._handlers = {'ping': self._ping,
+                          'stats': self._stats,
+                          'flash': self._flash,
+                          'erase': self._erase,
+                          'reset': self._reset}
+
+    def warm_up(self):
+        """
+        Load platform database, device table and modules used by requests
+        """
+        # pylint: disable=unused-import
+        from mbed_flasher.flash import Flash
+        from mbed_flasher.erase import Erase
+        from mbed_flasher.reset import Reset
+        self.platform_db.load()
+        self.device_cache.get_index()
+
+    def handle(self, request):
+        """
+        :param request: request dictionary with command and its arguments
+        :return: response dictionary with retcode and optional message and results
+        """
+        if not isinstance(request, dict) or request.get('command') not in self._handlers:
+            return {'retcode': EXIT_CODE_INVALID_REQUEST, 'message': 'Invalid request'}
+        self.logger.info("request: %s", request)
+        try:
+            return self._handlers[request['command']](request)
+        # errors are reported to the client instead of stopping the daemon
+        # pylint: disable=broad-except
+        except Exception as err:
+            self.logger.exception("request failed")
+            return {'retcode': EXIT_CODE_REQUEST_FAILED, 'message': str(err)}
+        finally:
+            self.write_metrics()
+
+    def write_metrics(self):
+        """
+        Write metrics to metrics_file if one is given
+        """
+        if not self.metrics_file:
+            return
+        try:
+            get_metrics().write_textfile(self.metrics_file)
+        except (IOError, OSError) as err:
+            self.logger.warning("could not write metrics to %s: %s", self.metrics_file, err)
+
+    @staticmethod
+    def _ping(_):
+        return {'retcode': EXIT_CODE_SUCCESS}
+
+    def _stats(self, _):
+        return {'retcode': EXIT_CODE_SUCCESS,
+                'results': {'devices': self.device_cache.stats(),
+                            'details': get_details_cache().stats(),
+                            'scheduler': self.scheduler.stats(),
+                            'metrics': get_metrics().snapshot()}}
+
+    def _resolve(self, request, platform_name=None):
+        """
+        :return: tuple of matching devices and error response, one of them is None
+        """
+        tid = request.get('tid')
+        if not tid:
+            return None, {'retcode': EXIT_CODE_NO_TARGET_ID, 'message': 'Target_id is missing'}
+        index = self.device_cache.get_index()
+        if not index:
+            return None, {'retcode': EXIT_CODE_DEVICES_MISSING,
+                          'message': 'Could not find any connected device'}
+        if 'all' in tid:
+            devices = list(index.devices)
+            if platform_name:
+                devices = index.by_platform(platform_name)
+        else:
+            devices = index.match(tid, platform_name=platform_name, prefix=True)
+        if not devices:
+            return None, {'retcode': EXIT_CODE_COULD_NOT_MAP_DEVICE,
+                          'message': 'Could not find given target_id from attached devices, '
+                                     'available target_ids: %s' % index.target_ids}
+        return devices, None
+
+    def _flash(self, request):
+        from mbed_flasher.image import PreparedImage
+        if request.get('manifest'):
+            return self._flash_manifest(request)
+        build = request.get('input')
+        if not build or not isfile(build):
+            return {'retcode': EXIT_CODE_FILE_MISSING,
+                    'message': 'Could not find given file: %s' % build}
+        platform_name = request.get('platform_name')
+        if platform_name and not self.platform_db.is_supported(platform_name):
+            return {'retcode': EXIT_CODE_NOT_SUPPORTED_PLATFORM,
+                    'message': 'Not supported platform: %s' % platform_name}
+        devices, error = self._resolve(request, platform_name)
+        if error:
+            return error
+        platforms = sorted(set(device['platform_name'] for device in devices))
+        if len(platforms) > 1:
+            return {'retcode': EXIT_CODE_PLATFORM_REQUIRED,
+                    'message': 'More than one platform detected for given target_id: %s'
+                               % platforms}
+        with PreparedImage(build) as image:
+            return self._run_jobs(request, devices, build=image,
+                                  platform_name=platforms[0],
+                                  no_reset=request.get('no_reset'),
+                                  timing_profile=request.get('timing_profile'),
+                                  skip_unchanged=request.get('skip_unchanged', False))
+
+    def _flash_manifest(self, request):
+        from mbed_flasher.manifest import Manifest, ManifestError, flash_manifest, \
+            EXIT_CODE_INVALID_MANIFEST
+        try:
+            manifest = Manifest.load(request['manifest'],
+                                     method=request.get('method', 'simple'))
+            retcode, results = flash_manifest(manifest,
+                                              device_cache=self.device_cache,
+                                              scheduler=self.scheduler,
+                                              max_workers=request.get('parallel'),
+                                              timing_profile=request.get('timing_profile'),
+                                              skip_unchanged=request.get('skip_unchanged',
+                                                                         False),
+                                              priority=request.get('priority', 0),
+                                              logger=self.logger)
+        except ManifestError as err:
+            return {'retcode': EXIT_CODE_INVALID_MANIFEST, 'message': str(err)}
+        return {'retcode': retcode, 'results': results}
+
+    def _erase(self, request):
+        devices, error = self._resolve(request)
+        if error:
+            return error
+        return self._run_jobs(request, devices, no_reset=request.get('no_reset'))
+
+    def _reset(self, request):
+        devices, error = self._resolve(request)
+        if error:
+            return error
+        return self._run_jobs(request, devices)
+
+    def _run_jobs(self, request, devices, build=None, **options):
+        """
+        Run request as one job per device, at most parallel devices at once
+        when the request limits it, and wait for all of them
+        :return: response with return code of first failed device and results per device
+        """
+        jobs = self.scheduler.submit_all(
+            [Job(request['command'], device['target_id'], build=build,
+                 priority=request.get('priority', 0),
+                 method=request.get('method', 'simple'), **options)
+             for device in devices],
+            max_running=request.get('parallel'))
+        results = OrderedDict()
+        for job in jobs:
+            # wait for every job, flash jobs share the image which is closed afterwards
+            try:
+                results[job.target_id] = job.result()
+            # pylint: disable=broad-except
+            except Exception:
+                results[job.target_id] = EXIT_CODE_REQUEST_FAILED
+        failed = [retcode for retcode in results.values() if retcode]
+        return {'retcode': failed[0] if failed else EXIT_CODE_SUCCESS, 'results': results}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one json request per line and writes one json response per line
+    """
+    def handle(self):
+        for line in iter(self.rfile.readline, b''):
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError:
+                response = {'retcode': EXIT_CODE_INVALID_REQUEST, 'message': 'Invalid request'}
+            else:
+                response = self.server.flash_daemon.handle(request)
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server handling each connection in its own thread
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, flash_daemon):
+        """
+        :param socket_path: path of the unix socket, stale socket file is replaced
+        :param flash_daemon: FlashDaemon executing requests
+        """
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.flash_daemon = flash_daemon
+        socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def serve(socket_path=None, flash_daemon=None, logger=None, metrics_file=None):
+    """
+    Serve requests until interrupted
+    :param socket_path: path of the unix socket, default get_socket_path()
+    :param flash_daemon: FlashDaemon executing requests
+    :param logger: logger to use
+    :param metrics_file: prometheus textfile rewritten after each request
+    :return: exit code
+    """
+    logger = logger if logger else logging.getLogger('mbed-flasher')
+    if not hasattr(socket, 'AF_UNIX'):
+        logger.error("mbedflash serve requires unix domain sockets")
+        return EXIT_CODE_DAEMON_UNAVAILABLE
+    socket_path = socket_path if socket_path else get_socket_path()
+    flash_daemon = flash_daemon if flash_daemon else FlashDaemon(logger=logger,
+                                                                 metrics_file=metrics_file)
+    flash_daemon.warm_up()
+    server = DaemonServer(socket_path, flash_daemon)
+    logger.info("serving on %s", socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("stopped by user")
+    finally:
+        server.server_close()
+        flash_daemon.scheduler.shutdown(wait=False)
+    return EXIT_CODE_SUCCESS
+
+
+def send_request(request, socket_path=None, timeout=None):
+    """
+    Send request to a running daemon
+    :param request: request dictionary
+    :param socket_path: path of the unix socket, default get_socket_path()
+    :param timeout: socket timeout in seconds, None waits until request completes
+    :return: response dictionary
+    """
+    socket_path = socket_path if socket_path else get_socket_path()
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(timeout)
+        client.connect(socket_path)
+    except (AttributeError, socket.error) as err:
+        return {'retcode': EXIT_CODE_DAEMON_UNAVAILABLE,
+                'message': 'Could not connect to mbedflash daemon at %s: %s'
+                           % (socket_path, err)}
+    try:
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        response = b''
+        while not response.endswith(b'\n'):
+            data = client.recv(4096)
+            if not data:
+                break
+            response += data
+    finally:
+        client.close()
+    try:
+        return json.loads(response.decode('utf-8'))
+    except ValueError:
+        return {'retcode': EXIT_CODE_DAEMON_UNAVAILABLE,
+                'message': 'Daemon closed connection without response'}
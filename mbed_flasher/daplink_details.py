@@ -0,0 +1,207 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import os
+from threading import Lock
+
+DETAILS_FILE = 'DETAILS.TXT'
+# first interface version which erases the target when ERASE.ACT is written
+ERASE_SUPPORT_VERSION = 243
+
+MODE_INTERFACE = 'interface'
+MODE_BOOTLOADER = 'bootloader'
+
+
+def _flag(value):
+    """
+    :return: True or False of a 0/1 field, None if field is something else
+    """
+    if value == '1':
+        return True
+    if value == '0':
+        return False
+    return None
+
+
+def _version(value):
+    """
+    :return: version number of a field like 0244, None if field is not a number
+    """
+    try:
+        return int(value.split()[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class DaplinkDetails(object):
+    """
+    Contents of DETAILS.TXT of a DAPLink interface. Fields missing from the
+    file, e.g. with older interface firmware, are None.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, fields):
+        """
+        :param fields: dictionary of lower case field names to values of DETAILS.TXT
+        """
+        self.fields = fields
+        self.unique_id = fields.get('unique id')
+        self.hic_id = fields.get('hic id')
+        # firmware before 0.2xx reports only "Version"
+        self.interface_version = _version(fields.get('interface version',
+                                                     fields.get('version')))
+        self.bootloader_version = _version(fields.get('bootloader version'))
+        self.automation_allowed = bool(_flag(fields.get('automation allowed')))
+        self.auto_reset = _flag(fields.get('auto reset'))
+        self.overflow_detection = _flag(fields.get('overflow detection'))
+        mode = fields.get('daplink mode')
+        self.mode = mode.lower() if mode else None
+        self.remount_count = _version(fields.get('remount count'))
+        interfaces = fields.get('usb interfaces')
+        self.usb_interfaces = [interface.strip().upper() for interface in
+                               interfaces.split(',')] if interfaces else None
+
+    @staticmethod
+    def parse(data):
+        """
+        :param data: contents of DETAILS.TXT, bytes or text
+        :return: DaplinkDetails
+        """
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        fields = {}
+        for line in data.splitlines():
+            if line.startswith('#') or ':' not in line:
+                continue
+            key, value = line.split(':', 1)
+            fields.setdefault(key.strip().lower(), value.strip())
+        return DaplinkDetails(fields)
+
+    @staticmethod
+    def read(path):
+        """
+        :param path: path of DETAILS.TXT
+        :return: DaplinkDetails
+        :raises IOError, OSError: if file can not be read
+        """
+        with open(path, 'rb') as details_file:
+            return DaplinkDetails.parse(details_file.read())
+
+    @property
+    def in_bootloader(self):
+        """
+        :return: True if interface runs its bootloader, which updates the
+                 interface firmware instead of programming the target
+        """
+        return self.mode == MODE_BOOTLOADER
+
+    @property
+    def supports_erase(self):
+        """
+        :return: True if target can be erased by writing ERASE.ACT
+        """
+        return self.automation_allowed and self.interface_version is not None and \
+            self.interface_version >= ERASE_SUPPORT_VERSION
+
+    @property
+    def supports_serial_reset(self):
+        """
+        :return: False if interface reports that it has no serial port
+        """
+        if self.usb_interfaces is None:
+            return True
+        return 'CDC' in self.usb_interfaces
+
+    def __repr__(self):
+        return "DaplinkDetails(interface_version=%s, mode=%s)" % (
+            self.interface_version, self.mode)
+
+
+class DetailsCache(object):
+    """
+    Parsed DETAILS.TXT of each device, keyed by target_id. An entry is reused
+    while mount point, modification time and size of the file are unchanged,
+    so one stat replaces reading and parsing the file. Operations which
+    remount the device drop its entry with invalidate.
+    """
+    def __init__(self, logger=None):
+        """
+        :param logger: logger to use
+        """
+        self.logger = logger if logger else logging.getLogger('mbed-flasher')
+        self._lock = Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, target):
+        """
+        :param target: device dictionary with target_id and mount_point
+        :return: DaplinkDetails, None if device has no readable DETAILS.TXT
+        """
+        target_id = target.get('target_id')
+        mount_point = target.get('mount_point')
+        if not mount_point:
+            return None
+        path = os.path.join(mount_point, DETAILS_FILE)
+        try:
+            stat = os.stat(path)
+        except (IOError, OSError):
+            self.invalidate(target_id)
+            return None
+        key = (mount_point, stat.st_mtime, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(target_id)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        try:
+            details = DaplinkDetails.read(path)
+        except (IOError, OSError) as err:
+            self.logger.debug("Could not read %s: %s", path, err)
+            self.invalidate(target_id)
+            return None
+        with self._lock:
+            self._entries[target_id] = (key, details)
+        return details
+
+    def invalidate(self, target_id=None):
+        """
+        Drop cached details
+        :param target_id: target_id of the device, None drops all devices
+        """
+        with self._lock:
+            if target_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(target_id, None)
+
+    def stats(self):
+        """
+        :return: dictionary of cache hits and misses
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+_DETAILS_CACHE = DetailsCache()
+
+
+def get_details_cache():
+    """
+    :return: process wide details cache
+    """
+    return _DETAILS_CACHE
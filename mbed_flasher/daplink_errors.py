@@ -20,6 +20,14 @@ EXIT_CODE_USER_ERROR = 3
 EXIT_CODE_TARGET_ERROR = 4
 EXIT_CODE_INTERFACE_ERROR = 5
 
+DAPLINK_ERROR_CLASSES = {
+    EXIT_CODE_DAPLINK_SOFTWARE_ERROR: 'software',
+    EXIT_CODE_TRANSIENT_ERROR: 'transient',
+    EXIT_CODE_USER_ERROR: 'user',
+    EXIT_CODE_TARGET_ERROR: 'target',
+    EXIT_CODE_INTERFACE_ERROR: 'interface',
+}
+
 # pylint: disable=line-too-long
 DAPLINK_ERRORS = {
     # DAPLink software error
@@ -0,0 +1,262 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bisect import bisect_left
+import logging
+import os
+from threading import Lock
+from time import time
+
+from mbed_flasher.metrics import get_metrics, ENUMERATIONS, PHASE_ENUMERATION
+
+DEFAULT_DEVICE_CACHE_TTL = 5.0
+
+
+class DeviceIndex(object):
+    """
+    Lookup structure for one enumeration of devices: exact target_id lookup
+    by hash, prefix lookup by bisecting sorted target_ids, and devices grouped
+    by platform. Matches are returned without duplicates, exact target_ids in
+    the order given and prefix matches in enumeration order.
+    """
+    def __init__(self, devices):
+        """
+        :param devices: list of device dictionaries with target_id and platform_name
+        """
+        self.devices = list(devices)
+        self._positions = {}
+        self._platforms = {}
+        for position, device in enumerate(self.devices):
+            target_id = device['target_id']
+            if target_id in self._positions:
+                continue
+            self._positions[target_id] = position
+            self._platforms.setdefault(device.get('platform_name'), []).append(position)
+        self._sorted_ids = sorted(self._positions)
+
+    def __len__(self):
+        return len(self.devices)
+
+    @property
+    def target_ids(self):
+        """
+        :return: list of target_ids in enumeration order
+        """
+        return [device['target_id'] for device in self.devices]
+
+    @property
+    def platforms(self):
+        """
+        :return: list of platform names in enumeration order
+        """
+        return [platform_name for platform_name in
+                sorted(self._platforms, key=lambda name: self._platforms[name][0])]
+
+    def get(self, target_id):
+        """
+        :param target_id: full target_id
+        :return: device or None if not found
+        """
+        position = self._positions.get(target_id)
+        return None if position is None else self.devices[position]
+
+    def _prefix_positions(self, prefix):
+        """
+        :return: enumeration positions of devices whose target_id starts with prefix
+        """
+        positions = []
+        start = bisect_left(self._sorted_ids, prefix)
+        for target_id in self._sorted_ids[start:]:
+            if not target_id.startswith(prefix):
+                break
+            positions.append(self._positions[target_id])
+        return positions
+
+    def with_prefix(self, prefix):
+        """
+        :param prefix: target_id prefix
+        :return: list of devices whose target_id starts with prefix
+        """
+        return [self.devices[position] for position in sorted(self._prefix_positions(prefix))]
+
+    def by_platform(self, platform_name):
+        """
+        :param platform_name: platform name
+        :return: list of devices of platform
+        """
+        return [self.devices[position] for position in self._platforms.get(platform_name, [])]
+
+    def match(self, target_ids, platform_name=None, prefix=False):
+        """
+        :param target_ids: target_id or list of them
+        :param platform_name: only match devices of this platform if given
+        :param prefix: match target_ids as prefixes, otherwise exact target_ids
+        :return: list of matching devices, prefix matches in enumeration order
+                 and exact matches in the order of target_ids
+        """
+        if not isinstance(target_ids, (list, tuple, set)):
+            target_ids = [target_ids]
+        if prefix:
+            positions = set()
+            for target_id in target_ids:
+                positions.update(self._prefix_positions(str(target_id)))
+            positions = sorted(positions)
+        else:
+            positions = []
+            for target_id in target_ids:
+                position = self._positions.get(str(target_id))
+                if position is not None and position not in positions:
+                    positions.append(position)
+        devices = [self.devices[position] for position in positions]
+        if platform_name:
+            devices = [device for device in devices
+                       if device.get('platform_name') == platform_name]
+        return devices
+
+    def select(self, target_id):
+        """
+        Devices selected by target_id argument of erase and reset
+        :param target_id: list of target ids, 'all', or target id prefix
+        :return: list of matching devices, a list of target ids keeps its order
+        """
+        if isinstance(target_id, list):
+            return self.match(target_id)
+        if target_id == 'all':
+            return list(self.devices)
+        if len(target_id) <= 48:
+            return self.match(target_id, prefix=True)
+        return []
+
+
+class DeviceCache(object):
+    """
+    Enumeration of connected devices shared by every entry point of the process.
+    A scan is reused until ttl expires or the cache is invalidated after an
+    operation which remounts devices. Concurrent callers wait for the scan in
+    progress instead of starting their own.
+    """
+    def __init__(self, ttl=None, flashers=None, logger=None):
+        """
+        :param ttl: seconds a scan is reused, default from MBED_FLASHER_DEVICE_CACHE_TTL
+                    environment variable or DEFAULT_DEVICE_CACHE_TTL, 0 disables caching
+        :param flashers: flashers to enumerate, default AvailableFlashers
+        :param logger: logger to use
+        """
+        if ttl is None:
+            ttl = float(os.environ.get('MBED_FLASHER_DEVICE_CACHE_TTL',
+                                       DEFAULT_DEVICE_CACHE_TTL))
+        self.ttl = ttl
+        self._flashers = flashers
+        self.logger = logger if logger else logging.getLogger('mbed-flasher')
+        self._lock = Lock()
+        self._devices = None
+        self._index = None
+        self._owners = {}
+        self._timestamp = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def flashers(self):
+        """
+        :return: flashers used for enumeration
+        """
+        if self._flashers is None:
+            from mbed_flasher.flashers import AvailableFlashers
+            self._flashers = AvailableFlashers
+        return self._flashers
+
+    def _scan(self):
+        """
+        :return: list of devices reported by all flashers
+        """
+        devices = []
+        owners = {}
+        metrics = get_metrics()
+        with metrics.phase(PHASE_ENUMERATION):
+            for flasher in self.flashers:
+                found = flasher.get_available_devices()
+                for device in found:
+                    owners[device.get('target_id')] = flasher
+                devices.extend(found)
+        metrics.increment(ENUMERATIONS)
+        self._owners = owners
+        return devices
+
+    def _get(self, refresh):
+        """
+        Scan if needed, must be called with lock held
+        """
+        if refresh or self._devices is None or time() - self._timestamp >= self.ttl:
+            self.misses += 1
+            self._devices = self._scan()
+            self._index = None
+            self._timestamp = time()
+            self.logger.debug("device scan found %i devices", len(self._devices))
+        else:
+            self.hits += 1
+
+    def get_devices(self, refresh=False):
+        """
+        :param refresh: scan even if cached devices are still valid
+        :return: list of available devices, copies which the caller may modify
+        """
+        with self._lock:
+            self._get(refresh)
+            return [dict(device) for device in self._devices]
+
+    def get_index(self, refresh=False):
+        """
+        :param refresh: scan even if cached devices are still valid
+        :return: DeviceIndex of available devices, built once per scan
+        """
+        with self._lock:
+            self._get(refresh)
+            if self._index is None:
+                self._index = DeviceIndex([dict(device) for device in self._devices])
+            return self._index
+
+    def get_flasher(self, target_id):
+        """
+        :param target_id: full target_id
+        :return: flasher which reported target_id in the latest scan, None if unknown
+        """
+        with self._lock:
+            return self._owners.get(target_id)
+
+    def invalidate(self):
+        """
+        Drop cached devices, next get_devices scans again
+        """
+        with self._lock:
+            self._devices = None
+            self._index = None
+
+    def stats(self):
+        """
+        :return: dictionary of cache hits and misses
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+_DEVICE_CACHE = DeviceCache()
+
+
+def get_device_cache():
+    """
+    :return: process wide device cache
+    """
+    return _DEVICE_CACHE
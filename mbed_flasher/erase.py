@@ -17,13 +17,18 @@ limitations under the License.
 # python 3 compatibility
 # pylint: disable=superfluous-parens
 
-from time import sleep, time
-from os.path import join, isfile
-from threading import Thread
-import platform
-from subprocess import PIPE, Popen
-import six
-from mbed_flasher.common import Logger, MountVerifier
+from collections import OrderedDict
+from os.path import isfile, join
+from mbed_flasher.common import Logger, MountVerifier, run_parallel
+from mbed_flasher.daplink_errors import DAPLINK_ERRORS, DAPLINK_ERROR_CLASSES
+from mbed_flasher.daplink_details import get_details_cache, ERASE_SUPPORT_VERSION
+from mbed_flasher.devices import DeviceIndex, get_device_cache
+from mbed_flasher.fingerprints import FingerprintStore
+from mbed_flasher.metrics import clock, get_metrics, PHASE_REMOUNT, PHASE_VERIFY, \
+    PHASE_POST_RESET, DAPLINK_ERRORS as METRIC_DAPLINK_ERRORS
+from mbed_flasher.results import make_record, make_request_records, new_report
+from mbed_flasher.serial_reset import SerialResetter
+from mbed_flasher.watcher import FileRemoved, MountVanished, WATCH_FAILED, wait_for
 
 EXIT_CODE_SUCCESS = 0
 EXIT_CODE_RESET_FAILED_PORT_OPEN = 11
@@ -35,29 +40,37 @@ EXIT_CODE_NONSUPPORTED_METHOD_FOR_ERASE = 29
 EXIT_CODE_IMPLEMENTATION_MISSING = 31
 EXIT_CODE_ERASE_FAILED_NOT_SUPPORTED = 33
 EXIT_CODE_TARGET_ID_MISSING = 34
+EXIT_CODE_ERASE_FAILED = 37
 ERASE_REMOUNT_TIMEOUT = 10
 ERASE_VERIFICATION_TIMEOUT = 30
-ERASE_DAPLINK_SUPPORT_VERSION = 243
+ERASE_DAPLINK_SUPPORT_VERSION = ERASE_SUPPORT_VERSION
 
 
 class Erase(object):
     """ Erase object, which manages erasing for given devices
     """
 
-    def __init__(self):
+    def __init__(self, device_cache=None, details_cache=None, result_writer=None):
+        """
+        :param device_cache: DeviceCache to enumerate devices, default process wide cache
+        :param details_cache: DetailsCache of DETAILS.TXT, default process wide cache
+        :param result_writer: ResultWriter which receives a record of every erased device
+        """
         logger = Logger('mbed-flasher')
         self.logger = logger.logger
         self.flashers = self.__get_flashers()
+        self.device_cache = device_cache if device_cache else get_device_cache()
+        self.details_cache = details_cache if details_cache else get_details_cache()
+        self.result_writer = result_writer
+        self.results = OrderedDict()
+        self.timings = OrderedDict()
+        self.records = OrderedDict()
 
     def get_available_device_mapping(self):
         """
         :return: list of available devices
         """
-        available_devices = []
-        for flasher in self.flashers:
-            devices = flasher.get_available_devices()
-            available_devices.extend(devices)
-        return available_devices
+        return self.device_cache.get_devices()
 
     @staticmethod
     def __get_flashers():
@@ -72,138 +85,97 @@ class Erase(object):
         :param serial_port: board serial port
         :return: return exit code based on if successfully reset a board
         """
-        from mbed_flasher.flashers.enhancedserial import EnhancedSerial
-        from serial.serialutil import SerialException
-        try:
-            port = EnhancedSerial(serial_port)
-        except SerialException as err:
-            self.logger.info("reset could not be sent")
-            self.logger.error(err)
-            # SerialException.message is type "string", it has 'find'
-            #  pylint: disable=no-member
-            if err.message.find('could not open port') != -1:
-                print('Reset could not be given. Close your Serial connection to device.')
-            return EXIT_CODE_RESET_FAILED_PORT_OPEN
-        port.baudrate = 115200
-        port.timeout = 1
-        port.xonxoff = False
-        port.rtscts = False
-        port.flushInput()
-        port.flushOutput()
-        if port:
-            self.logger.info("sendBreak to device to reboot")
-            result = port.safe_send_break()
-            if result:
-                self.logger.info("reset completed")
-            else:
-                self.logger.error("reset failed")
-                return EXIT_CODE_SERIAL_RESET_FAILED
-        port.close()
-        return EXIT_CODE_SUCCESS
+        return SerialResetter(self.logger).reset(serial_port)
 
     def wait_to_disappear(self, mount_point):
         """
         :param mount_point: mount_point to watch disappear
+        :return: WATCH_DONE or None if timed out
         """
-        start_time = time()
-        while True:
-            sleep(0.1)
-            if platform.system() == 'Windows':
-                proc = Popen(["dir", mount_point], stdin=PIPE, stdout=PIPE, stderr=PIPE, shell=True)
-            else:
-                proc = Popen(["ls", mount_point], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            err = proc.stderr.read()
-            proc.communicate()
-
-            if err:
-                self.logger.debug("Remount due to erase")
-                break
-
-            if time() - start_time > ERASE_REMOUNT_TIMEOUT:
-                self.logger.debug("Didn't notice device to disappear for remount")
-                break
+        result = wait_for(MountVanished(mount_point), ERASE_REMOUNT_TIMEOUT)
+        if result is None:
+            self.logger.debug("Didn't notice device to disappear for remount")
+        else:
+            self.logger.debug("Remount due to erase")
+        return result
 
     def runner(self, mount_point, filename):
         """
         :param mount_point: mount_point to check for
         :param filename: erase command filename
+        :return: WATCH_DONE, WATCH_FAILED or None if timed out
         """
-        start_time = time()
-        while True:
-            sleep(0.3)
-            if platform.system() == 'Windows':
-                proc = Popen(["dir", mount_point], stdin=PIPE, stdout=PIPE, stderr=PIPE, shell=True)
-            else:
-                proc = Popen(["ls", mount_point], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            out = proc.stdout.read()
-            proc.communicate()
-            if out.find(b'.HTM') != -1:
-                if out.find(filename.encode()) == -1:
-                    break
-
-            if time() - start_time > ERASE_VERIFICATION_TIMEOUT:
-                self.logger.debug("erase check timed out for %s", mount_point)
-                break
+        result = wait_for(FileRemoved(mount_point, filename), ERASE_VERIFICATION_TIMEOUT)
+        if result is None:
+            self.logger.debug("erase check timed out for %s", mount_point)
+        elif result == WATCH_FAILED:
+            self.logger.debug("fault file appeared in %s", mount_point)
+        return result
 
     # pylint: disable=too-many-return-statements, too-many-branches
-    def erase_board(self, target, no_reset):
+    def erase_board(self, target, no_reset, report=None):
         """
         :param target: target to which perform the erase
         :param no_reset: erase with/without reset
+        :param report: dictionary from results.new_report to fill with phase durations,
+                       fault text and remounted target
         :return: exit code
         """
-        automation_activated = False
-        daplink_version = 0
-        if not isfile(join(target["mount_point"], 'DETAILS.TXT')):
+        report = report if report is not None else new_report()
+        details = self.details_cache.get(target)
+        if details is None:
             self.logger.error("No DETAILS.TXT found")
             return EXIT_CODE_IMPLEMENTATION_MISSING
 
-        self.logger.error(join(target["mount_point"], 'DETAILS.TXT'))
-        with open(join(target["mount_point"], 'DETAILS.TXT'), 'rb') as new_file:
-            for line in new_file:
-                if line.find(b"Automation allowed: 1") != -1:
-                    automation_activated = True
-                if line.find(b"Interface Version") != -1:
-                    try:
-                        if six.PY2:
-                            daplink_version = int(line.split(' ')[-1])
-                        else:
-                            daplink_version = int(line.decode('utf-8').split(' ')[-1])
-                    except (IndexError, ValueError):
-                        self.logger.error("Failed to parse DAPLINK version from DETAILS.TXT")
-                        return EXIT_CODE_IMPLEMENTATION_MISSING
-
-        if not automation_activated:
+        if not details.automation_allowed:
             self.logger.error("Selected device does not support erasing through DAPLINK")
             return EXIT_CODE_IMPLEMENTATION_MISSING
 
-        if daplink_version < ERASE_DAPLINK_SUPPORT_VERSION:
+        if details.interface_version is None:
+            self.logger.error("Failed to parse DAPLINK version from DETAILS.TXT")
+            return EXIT_CODE_IMPLEMENTATION_MISSING
+
+        if not details.supports_erase:
             msg = "Selected device has Daplink version %s," \
                   "erasing supported from version %s onwards"
-            self.logger.error(msg, daplink_version, ERASE_DAPLINK_SUPPORT_VERSION)
+            self.logger.error(msg, details.interface_version, ERASE_DAPLINK_SUPPORT_VERSION)
             return EXIT_CODE_IMPLEMENTATION_MISSING
 
         with open(join(target["mount_point"], 'ERASE.ACT'), 'wb'):
             pass
 
-        auto_thread = Thread(target=self.wait_to_disappear,
-                             args=(target["mount_point"],))
-        auto_thread.start()
-        while auto_thread.is_alive():
-            auto_thread.join(0.5)
-
-        new_target = MountVerifier(self.logger).check_points_unchanged(target)
+        self.details_cache.invalidate(target['target_id'])
+        metrics = get_metrics()
+        platform_name = target.get('platform_name')
+        with metrics.phase(PHASE_REMOUNT, platform_name, operation='erase') as timer:
+            self.wait_to_disappear(target["mount_point"])
+            new_target = MountVerifier(self.logger).check_points_unchanged(target)
+        report['phases'][PHASE_REMOUNT] = timer.elapsed
         if isinstance(new_target, int):
             return new_target
-
-        auto_thread = Thread(target=self.runner,
-                             args=(new_target["mount_point"], 'ERASE.ACT'))
-        auto_thread.start()
-        while auto_thread.is_alive():
-            auto_thread.join(0.5)
+        report['new_target'] = new_target
+
+        with metrics.phase(PHASE_VERIFY, platform_name, operation='erase') as timer:
+            result = self.runner(new_target["mount_point"], 'ERASE.ACT')
+        report['phases'][PHASE_VERIFY] = timer.elapsed
+        if result is None:
+            self.logger.error("erase failed: ERASE.ACT was not consumed. tid=%s",
+                              target['target_id'])
+            return EXIT_CODE_ERASE_FAILED
+        if result == WATCH_FAILED:
+            fault = self.read_fault(new_target["mount_point"])
+            report['fault'] = fault
+            self.logger.error("erase failed: %s. tid=%s", fault, target['target_id'])
+            retcode = DAPLINK_ERRORS.get(fault)
+            metrics.increment(METRIC_DAPLINK_ERRORS,
+                              error=DAPLINK_ERROR_CLASSES.get(retcode, 'unknown'),
+                              platform=platform_name)
+            return retcode if retcode is not None else EXIT_CODE_ERASE_FAILED
 
         if not no_reset:
-            success = self.reset_board(target["serial_port"])
+            with metrics.phase(PHASE_POST_RESET, platform_name, operation='erase') as timer:
+                success = self.reset_board(target["serial_port"])
+            report['phases'][PHASE_POST_RESET] = timer.elapsed
             if success != 0:
                 self.logger.error("erase failed")
                 return success
@@ -211,15 +183,38 @@ class Erase(object):
         self.logger.info("erase completed")
         return EXIT_CODE_SUCCESS
 
-    def erase(self, target_id=None, no_reset=None, method=None):
+    def read_fault(self, mount_point):
+        """
+        :param mount_point: mount point of the device
+        :return: content of FAIL.TXT, None if it could not be read
+        """
+        path = join(mount_point, 'FAIL.TXT')
+        try:
+            if isfile(path):
+                with open(path, 'r') as fault:
+                    return fault.read().strip()
+        except (IOError, OSError) as err:
+            self.logger.warning("Could not read %s: %s", path, err)
+        return None
+
+    def erase(self, target_id=None, no_reset=None, method=None, max_workers=None):
         """
         Erase (mbed) device
         :param target_id: target_id
+        :param no_reset: do not reset device after erase
         :param method: method for erase i.e. simple, pyocd or edbg
+        :param max_workers: amount of devices erased concurrently, None erases one by one
+        :return: 0 if all devices were erased, otherwise return code of first failed device.
+                 Return codes of each device are stored to self.results,
+                 erase durations in seconds to self.timings and
+                 result records to self.records
         """
         self.logger.info("Starting erase for given target_id %s", target_id)
         self.logger.info("method used for reset: %s", method)
-        available_devices = self.get_available_device_mapping()
+        self.results = OrderedDict()
+        self.timings = OrderedDict()
+        self.records = OrderedDict()
+        available_devices = self.device_cache.get_index()
 
         if target_id is None:
             return EXIT_CODE_TARGET_ID_MISSING
@@ -228,61 +223,132 @@ class Erase(object):
 
         if len(targets_to_erase) <= 0:
             print("Could not map given target_id(s) to available devices")
+            self._store_failed(make_request_records('erase', target_id, None, method,
+                                                    EXIT_CODE_COULD_NOT_MAP_TO_DEVICE))
             return EXIT_CODE_COULD_NOT_MAP_TO_DEVICE
 
-        for item in targets_to_erase:
-            if item['platform_name'] != 'K64F':
-                print("Only mbed devices supported")
-                return EXIT_CODE_IMPLEMENTATION_MISSING
-
-            if method == 'simple' and 'mount_point' in item and 'serial_port' in item:
-                self.erase_board(target=item, no_reset=no_reset)
-            elif method == 'pyocd':
-                try:
-                    from pyOCD.board import MbedBoard
-                    from pyOCD.pyDAPAccess import DAPAccessIntf
-                except ImportError:
-                    print('pyOCD missing, install it\n')
-                    return EXIT_CODE_PYOCD_MISSING
-                board = MbedBoard.chooseBoard(board_id=item["target_id"])
-                self.logger.info("erasing device")
-                ocd_target = board.target
-                flash = ocd_target.flash
-                try:
-                    flash.eraseAll()
-                    if not no_reset:
-                        ocd_target.reset()
-                except DAPAccessIntf.TransferFaultError:
-                    pass
-                self.logger.info("erase completed")
-            elif method == 'edbg':
-                print("Not supported yet")
-            else:
-                print("Selected method %s not supported" % method)
-                return EXIT_CODE_NONSUPPORTED_METHOD_FOR_ERASE
+        if method not in ['simple', 'pyocd', 'edbg']:
+            print("Selected method %s not supported" % method)
+            self._store_failed([make_record('erase', item, method,
+                                            EXIT_CODE_NONSUPPORTED_METHOD_FOR_ERASE, 0)
+                                for item in targets_to_erase])
+            return EXIT_CODE_NONSUPPORTED_METHOD_FOR_ERASE
+        if method == 'edbg':
+            print("Not supported yet")
+            return EXIT_CODE_SUCCESS
+
+        def erase_device(item):
+            """
+            Erase single device and measure the time it took
+            """
+            start = clock()
+            report = new_report()
+            retcode = self.erase_device(item, no_reset, method, report)
+            elapsed = clock() - start
+            get_metrics().operation('erase', item.get('platform_name'), elapsed, retcode)
+            record = make_record('erase', item, method, retcode, elapsed, report)
+            if self.result_writer:
+                self.result_writer.write(record)
+            return retcode, elapsed, record
+
+        outcomes = run_parallel(erase_device, targets_to_erase, max_workers=max_workers)
+        for item, (retcode, elapsed, record) in zip(targets_to_erase, outcomes):
+            self.results[item['target_id']] = retcode
+            self.timings[item['target_id']] = elapsed
+            self.records[item['target_id']] = record
+            self.logger.debug("%s -> %s in %.2fs", item['target_id'],
+                              'SUCCESS' if retcode == EXIT_CODE_SUCCESS else 'FAIL', elapsed)
+
+        for retcode in self.results.values():
+            if retcode != EXIT_CODE_SUCCESS:
+                return retcode
+        return EXIT_CODE_SUCCESS
+
+    def erase_device(self, item, no_reset, method, report=None):
+        """
+        :param item: device to erase
+        :param no_reset: do not reset device after erase
+        :param method: simple or pyocd
+        :param report: dictionary from results.new_report to fill, see erase_board
+        :return: exit code
+        """
+        if item['platform_name'] != 'K64F':
+            print("Only mbed devices supported")
+            return EXIT_CODE_IMPLEMENTATION_MISSING
+
+        self.forget_fingerprint(item['target_id'])
 
+        if method == 'pyocd':
+            return self.erase_pyocd(item, no_reset)
+
+        if 'mount_point' not in item or 'serial_port' not in item:
+            self.logger.error("%s has no mount point or serial port", item['target_id'])
+            return EXIT_CODE_COULD_NOT_MAP_TO_DEVICE
+        try:
+            return self.erase_board(target=item, no_reset=no_reset, report=report)
+        finally:
+            # device remounts and may change its mount point or serial port
+            self.device_cache.invalidate()
+
+    def erase_pyocd(self, item, no_reset):
+        """
+        :param item: device to erase
+        :param no_reset: do not reset device after erase
+        :return: exit code
+        """
+        try:
+            from pyOCD.board import MbedBoard
+            from pyOCD.pyDAPAccess import DAPAccessIntf
+        except ImportError:
+            print('pyOCD missing, install it\n')
+            return EXIT_CODE_PYOCD_MISSING
+        try:
+            board = MbedBoard.chooseBoard(board_id=item["target_id"])
+            self.logger.info("erasing device")
+            ocd_target = board.target
+            flash = ocd_target.flash
+            try:
+                flash.eraseAll()
+                if not no_reset:
+                    ocd_target.reset()
+            except DAPAccessIntf.TransferFaultError:
+                pass
+        except AttributeError as err:
+            self.logger.error("erase failed: %s.", err)
+            self.logger.error("tid=%s", item["target_id"])
+            return EXIT_CODE_PYOCD_ERASE_FAILED
+        self.logger.info("erase completed")
         return EXIT_CODE_SUCCESS
 
+    def forget_fingerprint(self, target_id):
+        """
+        Forget image last flashed to the device, so skip_unchanged flashes it again
+        :param target_id: target id
+        """
+        try:
+            FingerprintStore(logger=self.logger).forget(target_id)
+        except (IOError, OSError) as err:
+            self.logger.warning("Could not update fingerprint store: %s", err)
+
+    def _store_failed(self, records):
+        """
+        Store records of requested devices which failed before they were erased
+        :param records: records of failed devices
+        """
+        for record in records:
+            self.results[record['target_id']] = record['retcode']
+            self.records[record['target_id']] = record
+            if self.result_writer:
+                self.result_writer.write(record)
+
     @staticmethod
     def prepare_target_to_erase(target_id, available_devices):
         """
         prepare target to erase
+        :param target_id: list of target ids, 'all', or target id prefix
+        :param available_devices: DeviceIndex or list of available devices
+        :return: list of matching devices
         """
-        targets_to_erase = []
-        if isinstance(target_id, list):
-            for target in target_id:
-                for device in available_devices:
-                    if target == device['target_id']:
-                        if device not in targets_to_erase:
-                            targets_to_erase.append(device)
-        else:
-            if target_id == 'all':
-                targets_to_erase = available_devices
-            elif len(target_id) <= 48:
-                for device in available_devices:
-                    if target_id == device['target_id'] \
-                            or device['target_id'].startswith(target_id):
-                        if device not in targets_to_erase:
-                            targets_to_erase.append(device)
-
-        return targets_to_erase
+        if not isinstance(available_devices, DeviceIndex):
+            available_devices = DeviceIndex(available_devices)
+        return available_devices.select(target_id)
@@ -0,0 +1,163 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+import os
+import platform
+from threading import Lock
+from time import time
+
+from mbed_flasher.common import get_cache_dir, write_json_atomic
+
+FINGERPRINTS_FILE = 'fingerprints.json'
+
+
+class _FileLock(object):
+    """
+    Exclusive lock between processes, held on a separate lock file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a+')
+        if platform.system() == 'Windows':
+            import msvcrt
+            self._file.seek(0)
+            # LK_LOCK retries for 10 seconds before raising
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except (IOError, OSError):
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if platform.system() == 'Windows':
+            import msvcrt
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+class FingerprintStore(object):
+    """
+    Image digests last flashed to each device, keyed by target_id.
+    Stored as json in the cache directory, every update is done under
+    a file lock and replaces the file atomically, so concurrent
+    mbedflash processes can share the store.
+    """
+    def __init__(self, path=None, logger=None):
+        """
+        :param path: path of the store, default fingerprints.json in the cache directory
+        :param logger: logger to use
+        """
+        self.path = path if path else os.path.join(get_cache_dir(), FINGERPRINTS_FILE)
+        self.logger = logger if logger else logging.getLogger('mbed-flasher')
+        self._lock = Lock()
+        # (mtime, size, fingerprints) of the last unlocked read
+        self._snapshot = None
+
+    def _read(self):
+        """
+        :return: dictionary of fingerprints, empty if store is missing or corrupted
+        """
+        try:
+            with open(self.path, 'r') as store:
+                fingerprints = json.load(store)
+        except (IOError, OSError):
+            return {}
+        except ValueError:
+            self.logger.warning("Ignoring corrupted fingerprint store %s", self.path)
+            return {}
+        return fingerprints if isinstance(fingerprints, dict) else {}
+
+    def _read_cached(self):
+        """
+        Read without the file lock, the file is read again only when it has changed
+        :return: dictionary of fingerprints
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return {}
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[:2] != (stat.st_mtime, stat.st_size):
+            snapshot = (stat.st_mtime, stat.st_size, self._read())
+            self._snapshot = snapshot
+        return snapshot[2]
+
+    def _update(self, target_id, fingerprint):
+        """
+        Read-modify-write the store under lock
+        :param target_id: target id
+        :param fingerprint: new fingerprint, None removes the target
+        """
+        with self._lock, _FileLock(self.path + '.lock'):
+            fingerprints = self._read()
+            if fingerprint is None:
+                if fingerprints.pop(target_id, None) is None:
+                    return
+            else:
+                fingerprints[target_id] = fingerprint
+            write_json_atomic(self.path, fingerprints)
+
+    def get(self, target_id):
+        """
+        :param target_id: target id
+        :return: fingerprint dictionary with sha1, method and timestamp or None
+        """
+        return self._read().get(target_id)
+
+    def record(self, target_id, sha1, method):
+        """
+        Record successfully flashed image
+        :param target_id: target id
+        :param sha1: SHA1 hex digest of the image
+        :param method: method used for flashing
+        """
+        self._update(target_id, {'sha1': sha1, 'method': method, 'timestamp': time()})
+
+    def forget(self, target_id):
+        """
+        Forget the image of target, used when content of the device is unknown.
+        Locks and rewrites the store only if it has a fingerprint of target.
+        :param target_id: target id
+        """
+        if target_id in self._read_cached():
+            self._update(target_id, None)
+
+    def is_unchanged(self, target_id, sha1, method):
+        """
+        :param target_id: target id
+        :param sha1: SHA1 hex digest of the image to be flashed
+        :param method: method used for flashing
+        :return: True if the same image was last flashed with the same method
+        """
+        fingerprint = self.get(target_id)
+        if not fingerprint:
+            return False
+        return fingerprint.get('sha1') == sha1 and fingerprint.get('method') == method
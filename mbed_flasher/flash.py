@@ -14,9 +14,17 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from collections import OrderedDict
 from os.path import isfile
-from mbed_flasher.common import Logger
+from threading import BoundedSemaphore
+from mbed_flasher.common import Logger, run_parallel
+from mbed_flasher.devices import DeviceIndex, get_device_cache
 from mbed_flasher.flashers import AvailableFlashers
+from mbed_flasher.fingerprints import FingerprintStore
+from mbed_flasher.image import ImageWriter, PreparedImage
+from mbed_flasher.metrics import clock, get_metrics
+from mbed_flasher.platforms import get_platform_database
+from mbed_flasher.results import make_record, make_request_records
 
 EXIT_CODE_NO_PLATFORM_GIVEN = 35
 EXIT_CODE_COULD_NOT_MAP_TARGET_ID_TO_DEVICE = 40
@@ -31,15 +39,43 @@ class Flash(object):
     """ Flash object, which manage flashing single device
     """
     _flashers = []
-    supported_targets = {}
 
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, timing_profile=None, device_cache=None,
+                 result_writer=None):
+        """
+        :param logger: logger to use, default mbed-flasher logger if not given
+        :param timing_profile: flasher timing profile, 'probe' or 'conservative'
+        :param device_cache: DeviceCache to enumerate devices, default process wide cache
+        :param result_writer: ResultWriter which receives a record of every flashed device
+        """
         if logger is None:
             logger = Logger('mbed-flasher')
             logger = logger.logger
         self.logger = logger
+        self.timing_profile = timing_profile
+        self.device_cache = device_cache if device_cache else get_device_cache()
         self._flashers = self.__get_flashers()
-        self.supported_targets = self.__update_supported_targets()
+        self.platform_db = get_platform_database()
+        self.result_writer = result_writer
+        self.results = OrderedDict()
+        self.records = OrderedDict()
+        self._fingerprints = None
+
+    @property
+    def fingerprints(self):
+        """
+        :return: FingerprintStore used by skip_unchanged, created on first use
+        """
+        if self._fingerprints is None:
+            self._fingerprints = FingerprintStore(logger=self.logger)
+        return self._fingerprints
+
+    @property
+    def supported_targets(self):
+        """
+        :return: list of supported targets, loaded from platform database on first use
+        """
+        return self.platform_db.platforms
 
     def get_supported_targets(self):
         """
@@ -47,6 +83,13 @@ class Flash(object):
         """
         return self.supported_targets
 
+    def is_supported_target(self, platform_name):
+        """
+        :param platform_name: platform name
+        :return: True if platform can be flashed
+        """
+        return self.platform_db.is_supported(platform_name)
+
     def get_supported_flashers(self):
         """
         :return: supported flashers
@@ -56,16 +99,6 @@ class Flash(object):
             available_flashers.append(flasher.name)
         return available_flashers
 
-    def __update_supported_targets(self):
-        """
-        :return: list of all supported targets
-        """
-        all_supported_targets = []
-        for flasher in self._flashers:
-            supported_targets = flasher.get_supported_targets()
-            all_supported_targets.extend(supported_targets)
-        return all_supported_targets
-
     @staticmethod
     def __get_flashers():
         """
@@ -89,22 +122,32 @@ class Flash(object):
         """
         :return: list of available devices
         """
-        available_devices = []
-        for flasher in self._flashers:
-            devices = flasher.get_available_devices()
-            available_devices.extend(devices)
-        return available_devices
+        return self.device_cache.get_devices()
 
-    def __get_flasher(self, platform_name):
+    def get_device_index(self):
+        """
+        :return: DeviceIndex of available devices
+        """
+        return self.device_cache.get_index()
+
+    def __get_flasher(self, platform_name, target_id=None, copy_slots=None):
         """
         :param platform_name: platform name
+        :param target_id: target_id of the device, flashed by the flasher which listed it
+        :param copy_slots: semaphore shared by the pipelined flashes of one call
         :return:
         """
-        if platform_name not in self.supported_targets:
+        if not self.is_supported_target(platform_name):
             raise NotImplementedError("Flashing %s is not supported" % platform_name)
 
+        owner = self.device_cache.get_flasher(target_id)
+        if owner in self._flashers:
+            return owner(logger=self.logger, timing_profile=self.timing_profile,
+                         copy_slots=copy_slots)
+
         for flasher in self._flashers:
-            return flasher(logger=self.logger)
+            return flasher(logger=self.logger, timing_profile=self.timing_profile,
+                           copy_slots=copy_slots)
 
         raise Exception("oh nou")
 
@@ -145,44 +188,55 @@ class Flash(object):
                                   ' -t <platform>.')
                 return EXIT_CODE_NO_PLATFORM_GIVEN
 
-    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-arguments, too-many-statements
     def flash_multiple(self, build, platform_name,
-                       method='simple', target_ids_or_prefix='', no_reset=None):
+                       method='simple', target_ids_or_prefix='', no_reset=None,
+                       max_workers=None, skip_unchanged=False, pipeline=None):
         """
-        :param build: build
+        :param build: path of the build or PreparedImage, a path is read once for all devices
         :param platform_name: platform name
         :param method: method
         :param target_ids_or_prefix: target ids or prefix
         :param no_reset: with/without reset
-        :return:
-        """
+        :param max_workers: amount of devices flashed concurrently, None flashes one by one
+        :param skip_unchanged: skip devices which already have the same image
+        :param pipeline: amount of devices which may be reset and copied to at once, while
+                         other devices remount and are verified. max(pipeline, max_workers)
+                         devices are in flight concurrently.
+        :return: 0 if all devices were flashed, otherwise return code of first failed device.
+                 Return codes of each device are stored to self.results and
+                 result records to self.records
+        """
+        self.records = OrderedDict()
         device_mapping_table = self.get_available_device_mapping()
 
         if not platform_name:
             return_code = self._verify_platform_coherence(device_mapping_table)
             if return_code:
+                self._record_requested(target_ids_or_prefix or None, platform_name, method,
+                                       return_code)
                 return return_code
 
+        device_index = DeviceIndex(device_mapping_table)
         if isinstance(target_ids_or_prefix, list):
-            aux_device_mapping_table = Flash._map_by_target_id(
-                device_mapping_table=device_mapping_table,
-                platform_name=platform_name,
-                target_ids=target_ids_or_prefix)
+            aux_device_mapping_table = device_index.match(target_ids_or_prefix,
+                                                          platform_name=platform_name)
         elif target_ids_or_prefix:
-            aux_device_mapping_table = Flash._map_by_prefix(
-                device_mapping_table=device_mapping_table,
-                platform_name=platform_name,
-                prefix=target_ids_or_prefix)
+            aux_device_mapping_table = device_index.match(target_ids_or_prefix,
+                                                          platform_name=platform_name,
+                                                          prefix=True)
+        elif platform_name:
+            aux_device_mapping_table = device_index.by_platform(platform_name)
         else:
-            aux_device_mapping_table = Flash._map_by_platform(
-                device_mapping_table=device_mapping_table,
-                platform_name=platform_name)
+            aux_device_mapping_table = []
 
         if aux_device_mapping_table:
             device_mapping_table = aux_device_mapping_table
 
         if not device_mapping_table:
             self.logger.error('no devices to flash')
+            self._record_requested(target_ids_or_prefix or None, platform_name, method,
+                                   EXIT_CODE_COULD_NOT_MAP_TARGET_ID_TO_DEVICE)
             return EXIT_CODE_COULD_NOT_MAP_TARGET_ID_TO_DEVICE
 
         self.logger.debug(device_mapping_table)
@@ -191,33 +245,82 @@ class Flash(object):
         for item in device_mapping_table:
             self.logger.info(item['target_id'])
 
-        ret_codes = 0
-        i = 1
-        for device in device_mapping_table:
-            ret = self.flash(build=build,
+        if isinstance(build, PreparedImage):
+            image = build
+        else:
+            try:
+                image = PreparedImage(build)
+            except (IOError, OSError) as err:
+                self.logger.error("Given file could not be read: %s", err)
+                for device in device_mapping_table:
+                    self._record(device, method, EXIT_CODE_FILE_DOES_NOT_EXIST, 0)
+                return EXIT_CODE_FILE_DOES_NOT_EXIST
+        self.logger.debug(image)
+
+        copy_slots = BoundedSemaphore(pipeline) if pipeline else None
+        if pipeline:
+            max_workers = max(pipeline, max_workers if max_workers else 0)
+
+        def flash_device(indexed_device):
+            """
+            Flash single device of device mapping table
+            """
+            i, device = indexed_device
+            ret = self.flash(build=image,
                              target_id=device['target_id'],
                              platform_name=None,
-                             device_mapping_table=device_mapping_table,
+                             device_mapping_table=[device],
                              method=method,
-                             no_reset=no_reset)
+                             no_reset=no_reset,
+                             skip_unchanged=skip_unchanged,
+                             copy_slots=copy_slots)
             if ret == 0:
                 self.logger.debug("dev#%i -> SUCCESS", i)
             else:
                 self.logger.warning("dev#%i -> FAIL", i)
-            ret_codes += ret
-            i += 1
+            return ret
+
+        try:
+            ret_codes = run_parallel(flash_device,
+                                     enumerate(device_mapping_table, 1),
+                                     max_workers=max_workers)
+        finally:
+            if image is not build:
+                image.close()
+
+        self.results = OrderedDict()
+        for device, ret in zip(device_mapping_table, ret_codes):
+            self.results[device['target_id']] = ret
+        # records were stored in order of completion
+        completed, self.records = self.records, OrderedDict()
+        for device in device_mapping_table:
+            if device['target_id'] in completed:
+                self.records[device['target_id']] = completed[device['target_id']]
 
-        return ret_codes
+        for ret in ret_codes:
+            if ret != 0:
+                return ret
+        return 0
 
-    # pylint: disable=too-many-return-statements
+    # pylint: disable=too-many-return-statements, too-many-statements
     def flash(self, build, target_id=None, platform_name=None,
-              device_mapping_table=None, method='simple', no_reset=None):
+              device_mapping_table=None, method='simple', no_reset=None,
+              max_workers=None, skip_unchanged=False, pipeline=None, copy_slots=None):
         """Flash (mbed) device
-        :param build:  Build -object or string (file-path)
+        :param build:  Build -object, string (file-path) or PreparedImage
         :param target_id: target_id
         :param platform_name: platform_name, to flash multiple devices of same type
         :param device_mapping_table: individual devices mapping table
         :param method: method for flashing i.e. simple, pyocd or edbg
+        :param no_reset: do not reset device before or after flashing
+        :param max_workers: amount of devices flashed concurrently when flashing
+                            multiple devices, None flashes one by one
+        :param skip_unchanged: do not copy the image to devices on which the same image
+                               was last flashed successfully, devices are still reset
+        :param pipeline: when flashing multiple devices, amount of devices reset and
+                         copied to at once while other devices remount
+        :param copy_slots: semaphore held during reset and copy, shared by the devices
+                           of one pipelined flash_multiple call
         """
 
         k64f_target_id_length = 48
@@ -225,27 +328,38 @@ class Flash(object):
         if target_id is None and platform_name is None:
             raise SyntaxError("target_id or target_name is required")
 
-        if not isfile(build):
+        if not isinstance(build, PreparedImage) and not isfile(build):
             self.logger.error("Given file does not exist")
+            self._record_requested(target_id, platform_name, method,
+                                   EXIT_CODE_FILE_DOES_NOT_EXIST)
             return EXIT_CODE_FILE_DOES_NOT_EXIST
         if isinstance(target_id, list):
             return self.flash_multiple(build=build,
                                        platform_name=platform_name,
                                        method=method,
                                        target_ids_or_prefix=target_id,
-                                       no_reset=no_reset)
+                                       no_reset=no_reset,
+                                       max_workers=max_workers,
+                                       skip_unchanged=skip_unchanged,
+                                       pipeline=pipeline)
         else:
             if target_id.lower() == 'all':
                 return self.flash_multiple(build=build,
                                            platform_name=platform_name,
                                            method=method,
-                                           no_reset=no_reset)
+                                           no_reset=no_reset,
+                                           max_workers=max_workers,
+                                           skip_unchanged=skip_unchanged,
+                                           pipeline=pipeline)
             elif len(target_id) < k64f_target_id_length and device_mapping_table is None:
                 return self.flash_multiple(build=build,
                                            platform_name=platform_name,
                                            method=method,
                                            target_ids_or_prefix=target_id,
-                                           no_reset=no_reset)
+                                           no_reset=no_reset,
+                                           max_workers=max_workers,
+                                           skip_unchanged=skip_unchanged,
+                                           pipeline=pipeline)
 
         device_mapping_table = self._refine__device_mapping_table(device_mapping_table)
 
@@ -257,13 +371,25 @@ class Flash(object):
                                                            device_mapping_table)
         except KeyError as err:
             self.logger.error(err)
+            self._record_requested(target_id, platform_name, method,
+                                   EXIT_CODE_TARGET_ID_COULD_NOT_BE_MAPPED_TO_DEVICE)
             return EXIT_CODE_TARGET_ID_COULD_NOT_BE_MAPPED_TO_DEVICE
 
         platform_name = self._get_platform_name(platform_name, target_mbed)
 
         self.logger.debug("Flashing: %s", target_mbed["target_id"])
 
-        flasher = self.__get_flasher(platform_name)
+        flasher = self.__get_flasher(platform_name, target_mbed['target_id'], copy_slots)
+        sha1 = None
+        if skip_unchanged:
+            sha1 = build.sha1 if isinstance(build, PreparedImage) else \
+                ImageWriter.hash_file(build)
+            if self.fingerprints.is_unchanged(target_mbed['target_id'], sha1, method):
+                start = clock()
+                retcode = self._skip_flash(flasher, target_mbed, no_reset)
+                self._record(target_mbed, method, retcode, clock() - start, skipped=True)
+                return retcode
+        start = clock()
         try:
             retcode = flasher.flash(source=build,
                                     target=target_mbed,
@@ -271,17 +397,103 @@ class Flash(object):
                                     no_reset=no_reset)
         except KeyboardInterrupt:
             self.logger.error("Aborted by user")
+            self._record(target_mbed, method, EXIT_CODE_KEYBOARD_INTERRUPT, clock() - start,
+                         getattr(flasher, 'report', None))
+            self._update_fingerprint(target_mbed['target_id'], None, method,
+                                     EXIT_CODE_KEYBOARD_INTERRUPT)
             return EXIT_CODE_KEYBOARD_INTERRUPT
         except SystemExit:
             self.logger.error("Aborted by SystemExit event")
+            self._record(target_mbed, method, EXIT_CODE_SYSTEM_INTERRUPT, clock() - start,
+                         getattr(flasher, 'report', None))
+            self._update_fingerprint(target_mbed['target_id'], None, method,
+                                     EXIT_CODE_SYSTEM_INTERRUPT)
             return EXIT_CODE_SYSTEM_INTERRUPT
+        finally:
+            # device remounts and may change its mount point or serial port
+            self.device_cache.invalidate()
 
+        elapsed = clock() - start
+        get_metrics().operation('flash', platform_name, elapsed, retcode)
+        self._record(target_mbed, method, retcode, elapsed, getattr(flasher, 'report', None))
         if retcode == 0:
             self.logger.info("flash ready")
         else:
             self.logger.info("flash fails")
+        self._update_fingerprint(target_mbed['target_id'], sha1, method, retcode)
         return retcode
 
+    def _skip_flash(self, flasher, target_mbed, no_reset):
+        """
+        Reset device instead of flashing the image it already has
+        :param flasher: flasher of the device
+        :param target_mbed: device to skip
+        :param no_reset: do not reset device
+        :return: 0, or return code of the reset if it failed
+        """
+        self.logger.info("%s already has the image, skipping flash", target_mbed['target_id'])
+        if not no_reset and target_mbed.get('serial_port'):
+            retcode = flasher.reset_board(target_mbed['serial_port'])
+            if retcode != 0:
+                self.logger.error("reset of skipped flash failed")
+                return retcode
+        return 0
+
+    # pylint: disable=too-many-arguments
+    def _record(self, target_mbed, method, retcode, duration, report=None, skipped=False):
+        """
+        Store result record of flashed device and pass it to the result writer
+        :param target_mbed: flashed device
+        :param method: flash method
+        :param retcode: return code of flash
+        :param duration: duration of flash in seconds
+        :param report: report of the flasher with phase durations and fault
+        :param skipped: device already had the image and was not flashed
+        """
+        record = make_record('flash', target_mbed, method, retcode, duration, report)
+        self._store_record(record, skipped)
+
+    def _record_requested(self, target_ids, platform_name, method, retcode):
+        """
+        Store records of requested devices which failed before they were flashed
+        :param target_ids: requested target_id or list of them
+        :param platform_name: requested platform name
+        :param method: flash method
+        :param retcode: return code of flash
+        """
+        for record in make_request_records('flash', target_ids, platform_name, method,
+                                           retcode):
+            self._store_record(record)
+
+    def _store_record(self, record, skipped=False):
+        """
+        :param record: record of one device
+        :param skipped: device already had the image and was not flashed
+        """
+        record['skipped'] = skipped
+        self.records[record['target_id']] = record
+        if self.result_writer:
+            self.result_writer.write(record)
+
+    def _update_fingerprint(self, target_id, sha1, method, retcode):
+        """
+        Record flashed image, or forget it when content of the device is unknown.
+        Called after every flash attempt, so a fingerprint never outlives the image.
+        Without skip_unchanged sha1 is None and the store is only locked and
+        rewritten if it has a fingerprint of the target.
+        :param target_id: target id
+        :param sha1: SHA1 of the flashed image, None if not computed
+        :param method: flash method
+        :param retcode: return code of the flash
+        """
+        try:
+            if retcode == 0 and sha1:
+                self.fingerprints.record(target_id, sha1, method)
+            else:
+                self.fingerprints.forget(target_id)
+        except (IOError, OSError) as err:
+            self.logger.warning("Could not update fingerprint store: %s", err)
+
     def _refine__device_mapping_table(self, device_mapping_table):
         """
         get device mapping table if it's None.
@@ -309,68 +521,8 @@ class Flash(object):
         if not platform_name:
             platform_name = target_mbed['platform_name']
 
-        if platform_name not in self.supported_targets:
+        if not self.is_supported_target(platform_name):
             raise NotImplementedError("Platform '%s' is not supported by mbed-flasher"
                                       % platform_name)
 
         return platform_name
-
-    @staticmethod
-    def _map_by_target_id(device_mapping_table, platform_name, target_ids):
-        """
-        Map available devices to required devices by target id
-        :param device_mapping_table: available devices
-        :param platform_name: platform
-        :param target_ids: list of target ids
-        :return: list of targets which matched the requirements
-        """
-        aux_device_mapping_table = []
-        for tid in target_ids:
-            for item in device_mapping_table:
-                if platform_name:
-                    if item['platform_name'] != platform_name:
-                        # skipping boards that do not match with specified platform
-                        continue
-
-                if item['target_id'] == tid:
-                    aux_device_mapping_table.append(item)
-
-        return aux_device_mapping_table
-
-    @staticmethod
-    def _map_by_prefix(device_mapping_table, platform_name, prefix):
-        """
-        Map available devices to required devices by prefix
-        :param device_mapping_table: available devices
-        :param platform_name: platform
-        :param prefix: prefix with to find
-        :return: list of targets which matched the requirements
-        """
-        aux_device_mapping_table = []
-        for item in device_mapping_table:
-            if platform_name:
-                if item['platform_name'] != platform_name:
-                    # skipping boards that do not match
-                    # with specified platform
-                    continue
-
-            if item['target_id'].startswith(str(prefix)):
-                aux_device_mapping_table.append(item)
-
-        return aux_device_mapping_table
-
-    @staticmethod
-    def _map_by_platform(device_mapping_table, platform_name):
-        """
-        Map available devices to required devices by platform
-        :param device_mapping_table: available devices
-        :param platform_name: platform
-        :return: list of targets which matched the requirements
-        """
-        aux_device_mapping_table = []
-        for item in device_mapping_table:
-            if platform_name:
-                if item['platform_name'] == platform_name:
-                    aux_device_mapping_table.append(item)
-
-        return aux_device_mapping_table
@@ -20,6 +20,8 @@ import subprocess
 import logging
 import tempfile
 
+from mbed_flasher.metrics import get_metrics, SUBPROCESSES
+
 
 class FlasherAtmelAt(object):
     """
@@ -83,6 +85,7 @@ class FlasherAtmelAt(object):
             return []
         FlasherAtmelAt.set_atprogram_exe(FlasherAtmelAt.exe)
         cmd = FlasherAtmelAt.exe + " list"
+        get_metrics().increment(SUBPROCESSES, command='atprogram')
         proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         stdout, _ = proc.communicate()
         connected_devices = []
@@ -124,6 +127,7 @@ class FlasherAtmelAt(object):
                   + target['target_id']\
                   + " -v -cl 10mhz  program --verify -f "\
                   + temp.name
+            get_metrics().increment(SUBPROCESSES, command='atprogram')
             proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             stdout, stderr = proc.communicate()
             FlasherAtmelAt.logger.debug(stdout)
@@ -18,18 +18,17 @@ import logging
 from os.path import join, abspath, isfile
 import os
 import platform
-from time import sleep, time
-from threading import Thread
-import hashlib
-from subprocess import PIPE, Popen
-from serial.serialutil import SerialException
+from time import sleep
 import six
 
-import mbed_lstools
-
 from mbed_flasher.common import MountVerifier
-from mbed_flasher.daplink_errors import DAPLINK_ERRORS
-from mbed_flasher.flashers.enhancedserial import EnhancedSerial
+from mbed_flasher.daplink_details import get_details_cache
+from mbed_flasher.daplink_errors import DAPLINK_ERRORS, DAPLINK_ERROR_CLASSES
+from mbed_flasher.image import ImageWriter, PreparedImage
+from mbed_flasher import metrics
+from mbed_flasher.results import new_report
+from mbed_flasher.watcher import AnyCondition, FileRemoved, MountReturned, MountVanished, \
+    WATCH_FAILED, wait_for
 
 EXIT_CODE_SUCCESS = 0
 EXIT_CODE_FLASH_FAILED = -4
@@ -39,6 +38,45 @@ EXIT_CODE_PYOCD_NOT_INSTALLED = -8
 EXIT_CODE_EGDB_NOT_SUPPORTED = -13
 EXIT_CODE_OS_ERROR = -14
 EXIT_CODE_FILE_STILL_PRESENT = -15
+EXIT_CODE_BOOTLOADER_MODE = -16
+
+STATE_PRE_RESET = 'reset'
+STATE_COPY = 'copy'
+STATE_DETACH = 'detach'
+STATE_REMOUNT = 'remount'
+STATE_VERIFY = 'verify'
+STATE_POST_RESET = 'post-reset'
+STATE_DONE = 'done'
+# states which use the bus, pipelined flashes hold a copy slot during them
+COPY_SLOT_STATES = (STATE_PRE_RESET, STATE_COPY)
+# phase of each state in timing metrics
+STATE_PHASES = {STATE_PRE_RESET: metrics.PHASE_PRE_RESET,
+                STATE_COPY: metrics.PHASE_COPY,
+                STATE_DETACH: metrics.PHASE_DETACH,
+                STATE_REMOUNT: metrics.PHASE_REMOUNT,
+                STATE_VERIFY: metrics.PHASE_VERIFY,
+                STATE_POST_RESET: metrics.PHASE_POST_RESET}
+
+# Per state deadlines in seconds. With 'probe' the state ends as soon as its
+# condition is observed, 'conservative' sleeps the full time like earlier releases.
+TIMING_PROFILES = {
+    'probe': {
+        'probe': True,
+        STATE_PRE_RESET: 1,
+        STATE_DETACH: 4,
+        STATE_REMOUNT: 4,
+        STATE_POST_RESET: 2,
+        'pyocd_reset': 0,
+    },
+    'conservative': {
+        'probe': False,
+        STATE_PRE_RESET: 0.1,
+        STATE_DETACH: 4,
+        STATE_REMOUNT: 0,
+        STATE_POST_RESET: 0.4,
+        'pyocd_reset': 0.5,
+    },
+}
 
 
 class FlasherMbed(object):
@@ -47,15 +85,29 @@ class FlasherMbed(object):
     """
     name = "mbed"
     FLASHING_VERIFICATION_TIMEOUT = 100
+    TIMING_PROFILE = 'probe'
 
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, timing_profile=None, copy_slots=None, details_cache=None):
+        """
+        :param logger: logger to use
+        :param timing_profile: 'probe' or 'conservative'
+        :param copy_slots: semaphore shared by pipelined flashes, held during reset and
+                           copy so that other devices can remount meanwhile
+        :param details_cache: DetailsCache of DETAILS.TXT, default process wide cache
+        """
         self.logger = logger if logger else logging.getLogger('mbed-flasher')
+        self.timing = TIMING_PROFILES[timing_profile or self.TIMING_PROFILE]
+        self.copy_slots = copy_slots
+        self.details_cache = details_cache if details_cache else get_details_cache()
+        # phase durations, fault text and remounted target of the last flash
+        self.report = new_report()
 
     @staticmethod
     def get_supported_targets():
         """
         Load target mapping information
         """
+        import mbed_lstools
         mbeds = mbed_lstools.create()
         return sorted(set(mbeds.manufacture_ids.values()))
 
@@ -64,77 +116,84 @@ class FlasherMbed(object):
         """
         Get available devices
         """
+        import mbed_lstools
         mbeds = mbed_lstools.create()
         return mbeds.list_mbeds()
 
-    def reset_board(self, serial_port):
+    def reset_board(self, serial_port, resetter=None):
         """
         Reset board
+        :param serial_port: serial port of the board
+        :param resetter: SerialResetter keeping the port open between resets of one flash,
+                         by default the port is opened for this reset only
+        :return: 0 if reset was sent, otherwise EXIT_CODE_RESET_FAIL
         """
-        try:
-            port = EnhancedSerial(serial_port)
-        except SerialException as err:
-            self.logger.info("reset could not be sent")
-            self.logger.error(err)
-            # SerialException.message is type "string"
-            # pylint: disable=no-member
-            if err.message.find('could not open port') != -1:
-                # python 3 compatibility
-                # pylint: disable=superfluous-parens
-                print('Reset could not be given. Close your Serial connection to device.')
+        if resetter is None:
+            resetter = self.resetter()
+        if resetter.reset(serial_port) != EXIT_CODE_SUCCESS:
             return EXIT_CODE_RESET_FAIL
+        return EXIT_CODE_SUCCESS
 
-        port.baudrate = 115200
-        port.timeout = 1
-        port.xonxoff = False
-        port.rtscts = False
-        port.flushInput()
-        port.flushOutput()
-
-        if port:
-            self.logger.info("sendBreak to device to reboot")
-            result = port.safe_send_break()
-            if result:
-                self.logger.info("reset completed")
-            else:
-                self.logger.info("reset failed")
-        port.close()
-
-    def runner(self, drive):
+    def resetter(self, keep_open=False):
         """
-        Runner
+        :param keep_open: keep the port open until the resetter is closed
+        :return: SerialResetter used to reset the board
         """
-        start_time = time()
-        while True:
-            sleep(2)
-            if platform.system() == 'Windows':
-                proc = Popen(["dir", drive[0]], stdin=PIPE, stdout=PIPE, stderr=PIPE, shell=True)
-            else:
-                proc = Popen(["ls", drive[0]], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            out = proc.stdout.read()
-            proc.communicate()
+        from mbed_flasher.serial_reset import SerialResetter
+        return SerialResetter(self.logger, keep_open=keep_open)
 
-            if out.lower().find(b'.htm') != -1:
-                if out.find(drive[1].encode()) == -1:
-                    break
+    def mount_verifier(self):
+        """
+        :return: MountVerifier used to find the device after it remounts
+        """
+        return MountVerifier(self.logger)
 
-            if time() - start_time > FlasherMbed.FLASHING_VERIFICATION_TIMEOUT:
-                self.logger.debug("re-mount check timed out for %s", drive[0])
-                break
+    def runner(self, drive):
+        """
+        Wait until copied file has been consumed from the mount point
+        :param drive: list of mount point and name of the copied file
+        :return: WATCH_DONE, WATCH_FAILED or None if timed out
+        """
+        result = wait_for(FileRemoved(drive[0], drive[1]),
+                          self.FLASHING_VERIFICATION_TIMEOUT)
+        if result is None:
+            self.logger.debug("re-mount check timed out for %s", drive[0])
+        elif result == WATCH_FAILED:
+            self.logger.debug("fault file appeared in %s", drive[0])
+        return result
+
+    def _wait_state(self, state, condition):
+        """
+        Wait until condition of state is observed or state deadline expires,
+        without probing the whole deadline is slept
+        :param state: flash state
+        :param condition: condition which ends the state
+        """
+        deadline = self.timing[state]
+        if not deadline:
+            return
+        if not self.timing['probe']:
+            sleep(deadline)
+        elif wait_for(condition, deadline) is None:
+            self.logger.debug("%s state not completed in %s seconds", state, deadline)
 
     # pylint: disable=too-many-return-statements, duplicate-except
     def flash(self, source, target, method, no_reset):
         """copy file to the destination
-        :param source: binary to be flashed
+        :param source: binary to be flashed, path or PreparedImage
         :param target: target to be flashed
         :param method: method to use when flashing
         :param no_reset: do not reset flashed board at all
         """
-        if not isinstance(source, six.string_types):
+        self.report = new_report()
+        if isinstance(source, PreparedImage):
+            tail = source.name
+        elif isinstance(source, six.string_types):
+            (_, tail) = os.path.split(os.path.abspath(source))
+        else:
             return
 
         mount_point = os.path.abspath(target['mount_point'])
-        (_, tail) = os.path.split(os.path.abspath(source))
         destination = abspath(join(mount_point, tail))
 
         if method == 'pyocd':
@@ -145,49 +204,147 @@ class FlasherMbed(object):
             self.logger.debug("edbg is not supported for Mbed devices")
             return EXIT_CODE_EGDB_NOT_SUPPORTED
 
+        details = self.details_cache.get(target)
+        if details is not None and details.in_bootloader:
+            self.logger.error("Interface of %s is in bootloader mode, binary would "
+                              "replace interface firmware", target.get('target_id'))
+            return EXIT_CODE_BOOTLOADER_MODE
+
+        job = {'source': source, 'target': target, 'new_target': target,
+               'destination': destination, 'tail': tail,
+               'no_reset': no_reset, 'retcode': None,
+               # interface resets the target itself after programming
+               'auto_reset': bool(details is not None and details.auto_reset),
+               'resetter': self.resetter(keep_open=True)}
+        states = {STATE_PRE_RESET: self._state_pre_reset,
+                  STATE_COPY: self._state_copy,
+                  STATE_DETACH: self._state_detach,
+                  STATE_REMOUNT: self._state_remount,
+                  STATE_VERIFY: self._state_verify,
+                  STATE_POST_RESET: self._state_post_reset}
+        holding_slot = False
         try:
-            if 'serial_port' in target and not no_reset:
-                self.reset_board(target['serial_port'])
-                sleep(0.1)
-
-            copy_file_success = self.copy_file(source, destination)
-            if copy_file_success == EXIT_CODE_FILE_COULD_NOT_BE_READ:
-                return EXIT_CODE_FILE_COULD_NOT_BE_READ
-
-            self.logger.debug("copy finished")
-            sleep(4)
-
-            new_target = MountVerifier(self.logger).check_points_unchanged(target)
-
-            if isinstance(new_target, int):
-                return new_target
-
-            thread = Thread(target=self.runner,
-                            args=([target['mount_point'], tail],))
-            thread.start()
-            while thread.is_alive():
-                thread.join(2.5)
-
-            if not no_reset:
-                if 'serial_port' in new_target:
-                    self.reset_board(new_target['serial_port'])
-                else:
-                    self.reset_board(target['serial_port'])
-                sleep(0.4)
-
-            # verify flashing went as planned
-            self.logger.debug("verifying flash")
-            return self.verify_flash_success(new_target, target, tail)
+            state = STATE_PRE_RESET
+            while state != STATE_DONE:
+                if self.copy_slots is not None:
+                    if state in COPY_SLOT_STATES and not holding_slot:
+                        self.copy_slots.acquire()
+                        holding_slot = True
+                    elif state not in COPY_SLOT_STATES and holding_slot:
+                        self.copy_slots.release()
+                        holding_slot = False
+                self.logger.debug("flash state: %s", state)
+                with metrics.get_metrics().phase(STATE_PHASES[state],
+                                                 target.get('platform_name'),
+                                                 operation='flash') as timer:
+                    next_state = states[state](job)
+                self.logger.debug("%s took %.3fs", state, timer.elapsed)
+                self.report['phases'][STATE_PHASES[state]] = timer.elapsed
+                state = next_state
+            return job['retcode']
         except IOError as err:
             self.logger.error(err)
             raise err
         except OSError as err:
             self.logger.error("Write failed due to OSError: %s", err)
             return EXIT_CODE_OS_ERROR
+        finally:
+            if holding_slot:
+                self.copy_slots.release()
+            job['resetter'].close()
+
+    def _state_pre_reset(self, job):
+        """
+        Reset board before copy and wait for mount point to be responsive
+        """
+        target = job['target']
+        if 'serial_port' in target and not job['no_reset']:
+            self.reset_board(target['serial_port'], resetter=job['resetter'])
+            self._wait_state(STATE_PRE_RESET, MountReturned(target['mount_point']))
+        return STATE_COPY
+
+    def _state_copy(self, job):
+        """
+        Copy binary to the mount point
+        """
+        copy_file_success = self.copy_file(job['source'], job['destination'])
+        if copy_file_success == EXIT_CODE_FILE_COULD_NOT_BE_READ:
+            job['retcode'] = EXIT_CODE_FILE_COULD_NOT_BE_READ
+            return STATE_DONE
+
+        self.logger.debug("copy finished")
+        source = job['source']
+        if isinstance(source, PreparedImage):
+            size = source.size
+        else:
+            size = os.path.getsize(source) if os.path.isfile(source) else 0
+        metrics.get_metrics().increment(metrics.BYTES_WRITTEN, size,
+                                        platform=job['target'].get('platform_name'))
+        return STATE_DETACH
+
+    def _state_detach(self, job):
+        """
+        Wait for the device to take the binary, either the mount point
+        disappears for remount or the binary leaves the mount point
+        """
+        # serial port re-enumerates with the mount point, a kept handle would be stale
+        job['resetter'].close()
+        mount_point = job['target']['mount_point']
+        self._wait_state(STATE_DETACH, AnyCondition(MountVanished(mount_point),
+                                                    FileRemoved(mount_point, job['tail'])))
+        return STATE_REMOUNT
+
+    def _state_remount(self, job):
+        """
+        Wait for the mount point to return and resolve possibly changed points
+        """
+        target = job['target']
+        self._wait_state(STATE_REMOUNT, MountReturned(target['mount_point']))
+        self.details_cache.invalidate(target.get('target_id'))
+
+        new_target = self.mount_verifier().check_points_unchanged(target)
+        if isinstance(new_target, int):
+            job['retcode'] = new_target
+            return STATE_DONE
+
+        job['new_target'] = new_target
+        self.report['new_target'] = new_target
+        serial_port = new_target.get('serial_port', target.get('serial_port'))
+        if serial_port and not job['no_reset'] and not job['auto_reset']:
+            # opened once on the port the device came back with, used by post-reset
+            job['resetter'].open(serial_port)
+        return STATE_VERIFY
+
+    def _state_verify(self, job):
+        """
+        Wait for the binary to be consumed by the device
+        """
+        self.runner([job['target']['mount_point'], job['tail']])
+        return STATE_POST_RESET
+
+    def _state_post_reset(self, job):
+        """
+        Reset board after flashing and verify flashing went as planned
+        """
+        target = job['target']
+        new_target = job['new_target']
+        serial_port = new_target.get('serial_port', target.get('serial_port'))
+        if job['auto_reset'] and not job['no_reset']:
+            self.logger.debug("target reset by interface, no serial reset needed")
+        elif serial_port and not job['no_reset']:
+            self.reset_board(serial_port, resetter=job['resetter'])
+            mount_point = new_target.get('mount_point', target['mount_point'])
+            self._wait_state(STATE_POST_RESET, MountReturned(mount_point))
+
+        self.logger.debug("verifying flash")
+        job['retcode'] = self.verify_flash_success(new_target, target, job['tail'])
+        return STATE_DONE
 
     def try_pyocd_flash(self, source, target):
         """
         try pyOCD flash
+        :param source: path of the binary or PreparedImage
+        :param target: target to be flashed
         """
         try:
             from pyOCD.board import MbedBoard
@@ -202,12 +359,16 @@ class FlasherMbed(object):
                 ocd_target = board.target
                 ocd_flash = board.flash
                 self.logger.debug("resetting device: %s", target["target_id"])
-                sleep(0.5)  # small sleep for lesser HW ie raspberry
+                # small sleep for lesser HW ie raspberry
+                sleep(self.timing['pyocd_reset'])
                 ocd_target.reset()
                 self.logger.debug("flashing device: %s", target["target_id"])
-                ocd_flash.flashBinary(source)
+                if isinstance(source, PreparedImage):
+                    ocd_flash.flashBlock(0, source.byte_list())
+                else:
+                    ocd_flash.flashBinary(source)
                 self.logger.debug("resetting device: %s", target["target_id"])
-                sleep(0.5)  # small sleep for lesser HW ie raspberry
+                sleep(self.timing['pyocd_reset'])
                 ocd_target.reset()
             return EXIT_CODE_SUCCESS
         except AttributeError as err:
@@ -218,48 +379,26 @@ class FlasherMbed(object):
     def copy_file(self, source, destination):
         """
         copy file from os
+        :param source: path of the binary or PreparedImage
+        :param destination: path of the file to be written
         """
         if platform.system() == 'Windows':
-
-            with open(source, 'rb') as source_file:
-                aux_source = source_file.read()
-                self.logger.debug("SHA1: %s",
-                                  hashlib.sha1(aux_source).hexdigest())
+            if isinstance(source, PreparedImage):
+                self.logger.debug("SHA1: %s", source.sha1)
+                source = source.path
+            else:
+                self.logger.debug("SHA1: %s", ImageWriter.hash_file(source))
             self.logger.debug("copying file: %s to %s",
                               source, destination)
+            metrics.get_metrics().increment(metrics.SUBPROCESSES, command='copy')
             os.system("copy %s %s" % (os.path.abspath(source), destination))
         else:
             self.logger.debug('read source file')
-            with open(source, 'rb') as source_file:
-                aux_source = source_file.read()
-
-            if not aux_source:
+            sha1 = ImageWriter(logger=self.logger).write(source, destination)
+            if not sha1:
                 self.logger.error("File couldn't be read")
                 return EXIT_CODE_FILE_COULD_NOT_BE_READ
-
-            self.logger.debug("SHA1: %s",
-                              hashlib.sha1(aux_source).hexdigest())
-            self.logger.debug("writing binary: %s (size=%i bytes)",
-                              destination,
-                              len(aux_source))
-
-            new_file = self.get_file(destination)
-            os.write(new_file, aux_source)
-            os.close(new_file)
-
-    @staticmethod
-    def get_file(destination):
-        """
-        Get file
-        """
-        if platform.system() == 'Darwin':
-            return os.open(
-                destination,
-                os.O_CREAT | os.O_TRUNC | os.O_RDWR | os.O_SYNC)
-
-        return os.open(
-            destination,
-            os.O_CREAT | os.O_DIRECT | os.O_TRUNC | os.O_RDWR)
+            self.logger.debug("SHA1: %s", sha1)
 
     @staticmethod
     def _read_file(path, file_name):
@@ -277,18 +416,23 @@ class FlasherMbed(object):
 
         if isfile(join(mount, 'FAIL.TXT')):
             fault = FlasherMbed._read_file(mount, "FAIL.TXT")
+            self.report['fault'] = fault
             self.logger.error("Flashing failed: %s. tid=%s",
                               fault, target["target_id"])
 
-            try:
-                return DAPLINK_ERRORS[fault]
-            except KeyError:
-                return EXIT_CODE_FLASH_FAILED
+            retcode = DAPLINK_ERRORS.get(fault)
+            metrics.get_metrics().increment(
+                metrics.DAPLINK_ERRORS, error=DAPLINK_ERROR_CLASSES.get(retcode, 'unknown'),
+                platform=target.get('platform_name'))
+            return retcode if retcode is not None else EXIT_CODE_FLASH_FAILED
 
         if isfile(join(mount, 'ASSERT.TXT')):
             fault = FlasherMbed._read_file(mount, "ASSERT.TXT")
+            self.report['fault'] = fault
             self.logger.error("Flashing failed: %s. tid=%s",
                               fault, target)
+            metrics.get_metrics().increment(metrics.DAPLINK_ERRORS, error='assert',
+                                            platform=target.get('platform_name'))
             return EXIT_CODE_FLASH_FAILED
 
         if isfile(join(mount, tail)):
@@ -0,0 +1,475 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import atexit
+from collections import deque
+import logging
+import os
+import select
+import shutil
+import tempfile
+from threading import Event, Lock, Thread
+import time
+import six
+
+from mbed_flasher.common import MountVerifier
+from mbed_flasher.daplink_errors import DAPLINK_ERRORS
+from mbed_flasher.flashers.enhancedserial import EnhancedSerial
+from mbed_flasher.flashers.FlasherMbed import FlasherMbed
+
+PLATFORM_CODES = {'K64F': '0240', 'K22F': '0231', 'NUCLEO_F401RE': '0720', 'NRF51_DK': '1100'}
+CONSUMED_EXTENSIONS = ('.bin', '.hex', '.act')
+DEFAULT_POLL_INTERVAL = 0.02
+DEFAULT_REMOUNT_TIME = 0.2
+
+DETAILS_TEMPLATE = """# DAPLink Firmware - see https://mbed.com/daplink
+Unique ID: {target_id}
+HIC ID: 97969900
+Auto Reset: {auto_reset:d}
+Automation allowed: 1
+Overflow detection: 0
+Daplink Mode: Interface
+Interface Version: {version:04d}
+Bootloader Version: 0242
+Git SHA: 0000000000000000000000000000000000000000
+Local Mods: 0
+USB Interfaces: MSD, CDC, HID
+Remount count: {remount_count}
+URL: https://mbed.org/device/?code={target_id}
+"""
+
+MBED_HTM_TEMPLATE = """<!-- mbed Microcontroller Website and Authentication Shortcut -->
+<html><head><meta http-equiv="refresh"
+content="0; url=https://mbed.org/device/?code={target_id}"/>
+<title>mbed Website Shortcut</title></head><body></body></html>
+"""
+
+
+class VirtualDevice(object):
+    """
+    Simulated DAPLink board. The mount point is a directory with DETAILS.TXT
+    and MBED.HTM. A dropped image is consumed after latency plus its size
+    divided by throughput, then the mount point disappears for remount_time
+    and returns without the image, with FAIL.TXT if a failure was requested.
+    The serial port is a pty. A pty has no break line, so breaks are counted
+    by the registered farm when they are sent with VirtualSerial.
+    """
+    # pylint: disable=too-many-instance-attributes, too-many-arguments
+    def __init__(self, target_id, platform_name, mount_point, latency=0.0, throughput=None,
+                 remount_time=DEFAULT_REMOUNT_TIME, interface_version=244, auto_reset=False):
+        """
+        :param target_id: 48 character target_id
+        :param platform_name: platform name
+        :param mount_point: directory used as mount point, created if missing
+        :param latency: seconds before a dropped image is consumed
+        :param throughput: bytes per second images are consumed, None is instant
+        :param remount_time: seconds the mount point is away during remount
+        :param interface_version: DAPLink interface version in DETAILS.TXT
+        :param auto_reset: DETAILS.TXT tells the interface resets the target itself
+        """
+        self.target_id = target_id
+        self.platform_name = platform_name
+        self.mount_point = mount_point
+        self.latency = latency
+        self.throughput = throughput
+        self.remount_time = remount_time
+        self.interface_version = interface_version
+        self.auto_reset = auto_reset
+        self.remount_count = 0
+        self.breaks = 0
+        self.consumed = []
+        self.serial_port = None
+        self._master = None
+        self._slave = None
+        self._failures = deque()
+        # name: [size, first seen] of images being written
+        self._dropped = {}
+        self._remounted_at = None
+        self._away = mount_point + '.remount'
+        if not os.path.isdir(mount_point):
+            os.makedirs(mount_point)
+        self._write_files(mount_point)
+        if hasattr(os, 'openpty'):
+            self._master, self._slave = os.openpty()
+            self.serial_port = os.ttyname(self._slave)
+
+    def to_mbed(self):
+        """
+        :return: device dictionary like mbed-ls lists
+        """
+        return {'target_id': self.target_id,
+                'target_id_usb_id': self.target_id,
+                'target_id_mbed_htm': self.target_id,
+                'platform_name': self.platform_name,
+                'mount_point': self.mount_point,
+                'serial_port': self.serial_port,
+                'daplink_version': '%04d' % self.interface_version}
+
+    @property
+    def mounted(self):
+        """
+        :return: True unless the device is remounting
+        """
+        return self._remounted_at is None
+
+    def fail_next(self, error):
+        """
+        Fail consumption of the next dropped file with FAIL.TXT
+        :param error: message of DAPLINK_ERRORS or its exit code
+        """
+        if not isinstance(error, six.string_types):
+            messages = sorted(message for message, code in DAPLINK_ERRORS.items()
+                              if code == error)
+            if not messages:
+                raise ValueError("No DAPLink error with code %s" % error)
+            error = messages[0]
+        self._failures.append(error)
+
+    def _write_files(self, directory):
+        with open(os.path.join(directory, 'DETAILS.TXT'), 'w') as details:
+            details.write(DETAILS_TEMPLATE.format(target_id=self.target_id,
+                                                  auto_reset=self.auto_reset,
+                                                  version=self.interface_version,
+                                                  remount_count=self.remount_count))
+        with open(os.path.join(directory, 'MBED.HTM'), 'w') as mbed_htm:
+            mbed_htm.write(MBED_HTM_TEMPLATE.format(target_id=self.target_id))
+
+    def _consume_due(self, now):
+        """
+        Track files being dropped
+        :return: names of dropped files which are due to be consumed
+        """
+        try:
+            names = [name for name in os.listdir(self.mount_point)
+                     if name.lower().endswith(CONSUMED_EXTENSIONS)]
+        except OSError:
+            return []
+        due = []
+        for name in names:
+            try:
+                size = os.path.getsize(os.path.join(self.mount_point, name))
+            except OSError:
+                continue
+            dropped = self._dropped.get(name)
+            if dropped is None or dropped[0] != size:
+                # consumed only once size is seen unchanged, file may still be written
+                self._dropped[name] = [size, dropped[1] if dropped else now]
+                continue
+            duration = self.latency
+            if self.throughput:
+                duration += float(size) / self.throughput
+            if now - dropped[1] >= duration:
+                due.append(name)
+        for name in list(self._dropped):
+            if name not in names:
+                del self._dropped[name]
+        return due
+
+    def poll(self, now, update_mounts):
+        """
+        Advance the simulation
+        :param now: current time
+        :param update_mounts: called to update the mount table when mounted changes,
+                              the table is updated before the mount point goes away
+                              and after it has returned like the system does
+        """
+        if self._remounted_at is not None:
+            if now - self._remounted_at >= self.remount_time:
+                os.rename(self._away, self.mount_point)
+                self._remounted_at = None
+                update_mounts()
+            return
+
+        due = self._consume_due(now)
+        if not due:
+            return
+        # interface programs the target, detaches and comes back without the files
+        self._remounted_at = now
+        update_mounts()
+        os.rename(self.mount_point, self._away)
+        for name in due:
+            os.remove(os.path.join(self._away, name))
+            del self._dropped[name]
+            self.consumed.append(name)
+        fail_path = os.path.join(self._away, 'FAIL.TXT')
+        if self._failures:
+            with open(fail_path, 'w') as fail:
+                fail.write(self._failures.popleft())
+        elif os.path.exists(fail_path):
+            os.remove(fail_path)
+        self.remount_count += 1
+        self._write_files(self._away)
+
+    def read_serial(self):
+        """
+        Drain data written to the serial port, so that writers do not block
+        """
+        try:
+            os.read(self._master, 1024)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Close the serial port
+        """
+        for descriptor in (self._master, self._slave):
+            if descriptor is not None:
+                os.close(descriptor)
+        self._master = self._slave = None
+
+
+class VirtualSerial(EnhancedSerial):  # pylint: disable=too-many-ancestors
+    """
+    Serial port which counts breaks sent to ports of the registered farm
+    """
+    def safe_send_break(self):
+        """
+        :return: True if break was sent
+        """
+        result = super(VirtualSerial, self).safe_send_break()
+        farm = FlasherVirtual.farm
+        if result and farm is not None:
+            farm.record_break(self.port)
+        return result
+
+
+class VirtualFarm(object):
+    """
+    Set of virtual devices simulated by one thread. The farm keeps a
+    dev/serial/by-id, dev/disk/by-id and proc/self/mountinfo tree of its
+    devices in root, which FlasherVirtual gives to MountVerifier.
+    """
+    def __init__(self, count=0, directory=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                 logger=None, **options):
+        """
+        :param count: amount of devices to create
+        :param directory: directory of mount points and root, default a temporary directory
+        :param poll_interval: seconds between simulation steps
+        :param logger: logger to use
+        :param options: options of VirtualDevice for created devices
+        """
+        self.logger = logger if logger else logging.getLogger('mbed-flasher')
+        self._temporary = directory is None
+        self.directory = tempfile.mkdtemp(prefix='mbedflash-virtual-') \
+            if directory is None else directory
+        self.root = os.path.join(self.directory, 'root')
+        for path in (('dev', 'serial', 'by-id'), ('dev', 'disk', 'by-id'), ('proc', 'self')):
+            if not os.path.isdir(os.path.join(self.root, *path)):
+                os.makedirs(os.path.join(self.root, *path))
+        self.poll_interval = poll_interval
+        self.devices = []
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        for _ in range(count):
+            self.add_device(**options)
+
+    def add_device(self, platform_name='K64F', **options):
+        """
+        :param platform_name: platform name, one of PLATFORM_CODES
+        :param options: options of VirtualDevice
+        :return: new VirtualDevice
+        """
+        with self._lock:
+            index = len(self.devices)
+            target_id = '%s0000%08x4e45%028x' % (PLATFORM_CODES[platform_name], index, index)
+            device = VirtualDevice(target_id, platform_name,
+                                   os.path.join(self.directory, 'VIRT%04i' % index),
+                                   **options)
+            self.devices.append(device)
+            if device.serial_port:
+                os.symlink(device.serial_port, os.path.join(
+                    self.root, 'dev', 'serial', 'by-id',
+                    'usb-ARM_DAPLink_CMSIS-DAP_%s-if01' % target_id))
+            os.symlink('../../vd%i' % index, os.path.join(
+                self.root, 'dev', 'disk', 'by-id', 'usb-MBED_VFS_%s-0:0' % target_id))
+            self._write_mountinfo()
+        return device
+
+    def get(self, target_id):
+        """
+        :return: VirtualDevice with target_id, None if not found
+        """
+        for device in self.devices:
+            if device.target_id == target_id:
+                return device
+        return None
+
+    def record_break(self, serial_port):
+        """
+        :param serial_port: serial port a break was sent to
+        :return: True if serial_port is a port of the farm
+        """
+        with self._lock:
+            for device in self.devices:
+                if device.serial_port == serial_port:
+                    device.breaks += 1
+                    return True
+        return False
+
+    def get_available_devices(self):
+        """
+        :return: mounted devices like mbed-ls lists them
+        """
+        with self._lock:
+            return [device.to_mbed() for device in self.devices if device.mounted]
+
+    def _write_mountinfo(self):
+        """
+        Write mount table of mounted devices, must be called with lock held
+        """
+        lines = ["25 1 8:1 / / rw,relatime shared:1 - ext4 /dev/root rw\n"]
+        for index, device in enumerate(self.devices):
+            if device.mounted:
+                lines.append("%i 25 0:%i / %s rw,nosuid - vfat /dev/vd%i rw\n" % (
+                    100 + index, 100 + index, device.mount_point.replace(' ', '\\040'),
+                    index))
+        path = os.path.join(self.root, 'proc', 'self', 'mountinfo')
+        with open(path + '.tmp', 'w') as mountinfo:
+            mountinfo.writelines(lines)
+        os.rename(path + '.tmp', path)
+
+    def start(self):
+        """
+        Start simulating devices
+        :return: self
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name='virtual-farm')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def _wait_serial(self):
+        """
+        Wait for serial packets for a poll interval
+        :return: devices with pending packets
+        """
+        # pylint: disable=protected-access
+        ports = dict((device._master, device) for device in self.devices
+                     if device._master is not None)
+        if not ports:
+            self._stop.wait(self.poll_interval)
+            return []
+        if hasattr(select, 'poll'):
+            # select is limited to descriptors below FD_SETSIZE
+            poller = select.poll()
+            for descriptor in ports:
+                poller.register(descriptor, select.POLLIN)
+            readable = [descriptor for descriptor, _ in poller.poll(self.poll_interval * 1000)]
+        else:
+            readable, _, _ = select.select(list(ports), [], [], self.poll_interval)
+        return [ports[descriptor] for descriptor in readable]
+
+    def _run(self):
+        while not self._stop.is_set():
+            for device in self._wait_serial():
+                device.read_serial()
+            now = time.time()
+            with self._lock:
+                for device in self.devices:
+                    try:
+                        device.poll(now, self._write_mountinfo)
+                    except (IOError, OSError) as err:
+                        self.logger.warning("virtual device %s: %s", device.target_id, err)
+
+    def register(self):
+        """
+        Start the farm and list its devices with AvailableFlashers
+        :return: self
+        """
+        from mbed_flasher.flashers import AvailableFlashers
+        FlasherVirtual.farm = self
+        if FlasherVirtual not in AvailableFlashers:
+            AvailableFlashers.append(FlasherVirtual)
+        return self.start()
+
+    def close(self):
+        """
+        Stop simulating, unregister and remove the devices
+        """
+        from mbed_flasher.flashers import AvailableFlashers
+        if FlasherVirtual.farm is self:
+            FlasherVirtual.farm = None
+            if FlasherVirtual in AvailableFlashers:
+                AvailableFlashers.remove(FlasherVirtual)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for device in self.devices:
+            device.close()
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self.register()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FlasherVirtual(FlasherMbed):
+    """
+    Flasher of virtual devices. Devices are flashed like mbed devices by
+    dropping the image to the mount point. MBED_FLASHER_VIRTUAL_DEVICES
+    environment variable creates a farm of that many devices on first use.
+    """
+    name = "virtual"
+    farm = None
+
+    @staticmethod
+    def get_supported_targets():
+        """
+        :return: platforms of virtual devices
+        """
+        return sorted(PLATFORM_CODES)
+
+    @staticmethod
+    def get_farm():
+        """
+        :return: registered farm, created from MBED_FLASHER_VIRTUAL_DEVICES if not given
+        """
+        if FlasherVirtual.farm is None and os.environ.get('MBED_FLASHER_VIRTUAL_DEVICES'):
+            farm = VirtualFarm(count=int(os.environ['MBED_FLASHER_VIRTUAL_DEVICES']))
+            atexit.register(farm.close)
+            farm.register()
+        return FlasherVirtual.farm
+
+    @staticmethod
+    def get_available_devices():
+        """
+        :return: mounted virtual devices
+        """
+        farm = FlasherVirtual.get_farm()
+        return farm.get_available_devices() if farm else []
+
+    def resetter(self, keep_open=False):
+        """
+        :param keep_open: keep the port open until the resetter is closed
+        :return: SerialResetter sending breaks with VirtualSerial
+        """
+        from mbed_flasher.serial_reset import SerialResetter
+        return SerialResetter(self.logger, keep_open=keep_open, serial_class=VirtualSerial)
+
+    def mount_verifier(self):
+        """
+        :return: MountVerifier reading the links and mount table of the farm
+        """
+        farm = FlasherVirtual.farm
+        return MountVerifier(self.logger, root=farm.root if farm else '/')
@@ -15,6 +15,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import os
 from mbed_flasher.flashers.FlasherMbed import FlasherMbed as mbed_flasher
 
 # disable Invalid constant name warning, not a const
@@ -40,3 +41,8 @@ if platform.system() == 'Windows':
                         if x.find("atprogram.exe") != -1:
                             AvailableFlashers.append(FlasherAtmelAt)
 '''
+
+# simulated boards for load testing, see FlasherVirtual
+if os.environ.get('MBED_FLASHER_VIRTUAL_DEVICES'):
+    from mbed_flasher.flashers.FlasherVirtual import FlasherVirtual
+    AvailableFlashers.append(FlasherVirtual)
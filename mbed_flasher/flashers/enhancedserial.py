@@ -12,8 +12,23 @@ like found in the telnetlib.
 """
 import re
 from time import sleep
-import pkg_resources
-from serial import Serial, SerialException, SerialTimeoutException
+from serial import Serial, SerialException, SerialTimeoutException, VERSION
+
+
+def _parse_pyserial_version(version_string):
+    """! Parse pyserial version once per process
+    @return Returns float with pyserial module number
+    """
+    match = re.search(r"^\d+\.\d+", version_string)
+    if match:
+        try:
+            return float(match.group(0))
+        except ValueError:
+            pass
+    return 3.0   # We will assume you've got latest (3.0+)
+
+
+PYSERIAL_VERSION = _parse_pyserial_version(VERSION)
 
 
 class EnhancedSerial(Serial): # pylint: disable=too-many-ancestors, too-many-instance-attributes
@@ -35,17 +50,7 @@ class EnhancedSerial(Serial): # pylint: disable=too-many-ancestors, too-many-ins
         """! Retrieve pyserial module version
         @return Returns float with pyserial module number
         """
-        # pylint: disable = anomalous-backslash-in-string
-        self.re_float = re.compile("^\d+\.\d+")
-        pyserial_version = pkg_resources.require("pyserial")[0].version
-        version = 3.0
-        match = self.re_float.search(pyserial_version)
-        if match:
-            try:
-                version = float(match.group(0))
-            except ValueError:
-                version = 3.0   # We will assume you've got latest (3.0+)
-        return version
+        return PYSERIAL_VERSION
 
     def safe_send_break(self):
         """! Closure for pyserial version dependant API calls
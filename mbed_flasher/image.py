@@ -0,0 +1,331 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import platform
+from threading import Lock
+
+
+def _view(buf):
+    """
+    :return: zero copy view of buffer where supported (python 3)
+    """
+    try:
+        return memoryview(buf)
+    except TypeError:
+        return buf
+
+
+def _release(view):
+    """
+    Release view so that the underlying mmap can be closed
+    """
+    if hasattr(view, 'release'):
+        view.release()
+
+
+class ImageWriter(object):
+    """
+    Streams an image to a mount point in block aligned chunks.
+    Memory use is bounded by CHUNK_SIZE regardless of image size.
+    """
+    CHUNK_SIZE = 256 * 1024
+    DEFAULT_BLOCK_SIZE = 512
+
+    def __init__(self, logger=None):
+        self.logger = logger if logger else logging.getLogger('mbed-flasher')
+
+    @staticmethod
+    def get_block_size(destination):
+        """
+        :param destination: file to be written
+        :return: block size of the file system holding destination
+        """
+        try:
+            block_size = os.statvfs(os.path.dirname(destination) or '.').f_bsize
+        except (AttributeError, OSError):
+            return ImageWriter.DEFAULT_BLOCK_SIZE
+        if block_size < 512 or block_size & (block_size - 1):
+            return ImageWriter.DEFAULT_BLOCK_SIZE
+        return block_size
+
+    def get_chunk_size(self, block_size):
+        """
+        :param block_size: target block size, power of two
+        :return: chunk size aligned to both block and page size
+        """
+        granule = max(block_size, mmap.PAGESIZE)
+        return max(granule, self.CHUNK_SIZE - self.CHUNK_SIZE % granule)
+
+    @staticmethod
+    def open_target(destination):
+        """
+        Open destination bypassing page cache where the file system allows it
+        :return: tuple of file descriptor and True if opened with O_DIRECT
+        """
+        flags = os.O_CREAT | os.O_TRUNC | os.O_RDWR | getattr(os, 'O_BINARY', 0)
+        if platform.system() == 'Darwin':
+            return os.open(destination, flags | os.O_SYNC), False
+        if hasattr(os, 'O_DIRECT'):
+            try:
+                return os.open(destination, flags | os.O_DIRECT), True
+            except OSError as err:
+                if err.errno != errno.EINVAL:
+                    raise
+        return os.open(destination, flags), False
+
+    @staticmethod
+    def _clear_direct(target_fd):
+        """
+        Turn off O_DIRECT for writing the unaligned tail of the image
+        """
+        import fcntl
+        flags = fcntl.fcntl(target_fd, fcntl.F_GETFL)
+        fcntl.fcntl(target_fd, fcntl.F_SETFL, flags & ~os.O_DIRECT)
+
+    @staticmethod
+    def _write_all(target_fd, data):
+        """
+        Write data, retrying partial writes
+        """
+        written = 0
+        while written < len(data):
+            written += os.write(target_fd, data[written:])
+
+    # pylint: disable=too-many-arguments
+    def _write_direct(self, target_fd, source, size, chunk_size, block_size, digest):
+        """
+        Copy block aligned chunks through a page aligned buffer with O_DIRECT
+        :return: offset up to which source was written
+        """
+        buf = mmap.mmap(-1, chunk_size)
+        buf_view = _view(buf)
+        offset = 0
+        aligned_size = size - size % block_size
+        try:
+            while offset < aligned_size:
+                length = min(chunk_size, aligned_size - offset)
+                buf_view[:length] = source[offset:offset + length]
+                if digest:
+                    digest.update(buf_view[:length])
+                try:
+                    self._write_all(target_fd, buf_view[:length])
+                except OSError as err:
+                    if err.errno != errno.EINVAL:
+                        raise
+                    # file system accepted O_DIRECT on open but not on write
+                    self.logger.debug("O_DIRECT write rejected, using buffered write")
+                    os.lseek(target_fd, offset, os.SEEK_SET)
+                    self._clear_direct(target_fd)
+                    self._write_all(target_fd, buf_view[:length])
+                offset += length
+        finally:
+            _release(buf_view)
+            buf.close()
+        return offset
+
+    # pylint: disable=too-many-arguments
+    def _write_buffered(self, target_fd, source_fd, source, offset, size, chunk_size, digest):
+        """
+        Copy rest of the source, with sendfile when the target permits
+        """
+        use_sendfile = source_fd is not None and hasattr(os, 'sendfile')
+        while offset < size:
+            length = min(chunk_size, size - offset)
+            if digest:
+                digest.update(source[offset:offset + length])
+            if use_sendfile:
+                try:
+                    sent = 0
+                    while sent < length:
+                        sent += os.sendfile(target_fd, source_fd, offset + sent, length - sent)
+                    offset += length
+                    continue
+                except OSError as err:
+                    if err.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                        raise
+                    use_sendfile = False
+                    os.lseek(target_fd, offset, os.SEEK_SET)
+            self._write_all(target_fd, source[offset:offset + length])
+            offset += length
+
+    def write(self, source, destination):
+        """
+        Stream source image to destination
+        :param source: path of the image or PreparedImage
+        :param destination: path of the file to be written
+        :return: SHA1 hex digest of the image, None if source is empty
+        """
+        if isinstance(source, PreparedImage):
+            if not source.size:
+                return None
+            source_view = source.view()
+            try:
+                self._stream(source_view, None, source.size, destination, None)
+            finally:
+                _release(source_view)
+            return source.sha1
+
+        with open(source, 'rb') as source_file:
+            source_fd = source_file.fileno()
+            size = os.fstat(source_fd).st_size
+            if not size:
+                return None
+            source_map = mmap.mmap(source_fd, 0, access=mmap.ACCESS_READ)
+            source_view = _view(source_map)
+            digest = hashlib.sha1()
+            try:
+                self._stream(source_view, source_fd, size, destination, digest)
+            finally:
+                _release(source_view)
+                source_map.close()
+            return digest.hexdigest()
+
+    # pylint: disable=too-many-arguments
+    def _stream(self, source, source_fd, size, destination, digest):
+        """
+        Stream memory mapped image to destination
+        :param source: view of the image
+        :param source_fd: file descriptor of the image for sendfile, None to copy from view
+        :param size: image size in bytes
+        :param destination: path of the file to be written
+        :param digest: hash object updated while writing, None if already known
+        """
+        block_size = self.get_block_size(destination)
+        chunk_size = self.get_chunk_size(block_size)
+        target_fd, direct = self.open_target(destination)
+        self.logger.debug("writing binary: %s (size=%i bytes, block=%i, direct=%s)",
+                          destination, size, block_size, direct)
+        try:
+            offset = 0
+            if direct:
+                offset = self._write_direct(target_fd, source, size,
+                                            chunk_size, block_size, digest)
+                if offset < size:
+                    self._clear_direct(target_fd)
+            self._write_buffered(target_fd, source_fd, source, offset, size,
+                                 chunk_size, digest)
+            os.fsync(target_fd)
+        finally:
+            os.close(target_fd)
+
+    @staticmethod
+    def hash_file(source):
+        """
+        :param source: path of the image
+        :return: SHA1 hex digest of the image computed in chunks
+        """
+        digest = hashlib.sha1()
+        with open(source, 'rb') as source_file:
+            for block in iter(lambda: source_file.read(ImageWriter.CHUNK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+class PreparedImage(object):
+    """
+    Image read once and shared by every device flashed in one batch.
+    Holds a read only memory map of the image with its hashes and format,
+    so flashing further devices does not touch the source file again.
+    """
+    FORMAT_BIN = 'bin'
+    FORMAT_HEX = 'hex'
+
+    def __init__(self, path):
+        """
+        :param path: path of the image
+        """
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(self.path)
+        self._map = None
+        self._byte_list = None
+        self._lock = Lock()
+        with open(self.path, 'rb') as source_file:
+            self.size = os.fstat(source_file.fileno()).st_size
+            if self.size:
+                self._map = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        sha1 = hashlib.sha1()
+        sha256 = hashlib.sha256()
+        if self._map is not None:
+            source = self.view()
+            try:
+                for offset in range(0, self.size, ImageWriter.CHUNK_SIZE):
+                    chunk = source[offset:offset + ImageWriter.CHUNK_SIZE]
+                    sha1.update(chunk)
+                    sha256.update(chunk)
+            finally:
+                _release(source)
+        self.sha1 = sha1.hexdigest()
+        self.sha256 = sha256.hexdigest()
+        self.format = self._detect_format()
+
+    def _detect_format(self):
+        """
+        :return: FORMAT_HEX for Intel HEX images, otherwise FORMAT_BIN
+        """
+        if self.name.lower().endswith('.hex'):
+            return self.FORMAT_HEX
+        if self._map is not None and self._map[0:1] == b':':
+            return self.FORMAT_HEX
+        return self.FORMAT_BIN
+
+    def view(self):
+        """
+        :return: read only view of the image, release it before close()
+        """
+        if self._map is None:
+            return b''
+        return _view(self._map)
+
+    def data(self):
+        """
+        :return: copy of the image content as bytes
+        """
+        if self._map is None:
+            return b''
+        return self._map[:]
+
+    def byte_list(self):
+        """
+        :return: image content as list of ints as pyOCD flashBlock takes it,
+                 converted on first use and shared by every device of the batch
+        """
+        with self._lock:
+            if self._byte_list is None:
+                self._byte_list = list(bytearray(self.data()))
+            return self._byte_list
+
+    def close(self):
+        """
+        Unmap the image
+        """
+        self._byte_list = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return "PreparedImage(%s, size=%i, sha1=%s)" % (self.path, self.size, self.sha1)
@@ -26,9 +26,8 @@ from os.path import isdir, isfile, join
 import json
 import time
 
-from mbed_flasher.flash import Flash
-from mbed_flasher.erase import Erase
-from mbed_flasher.reset import Reset
+# subcommand implementations are imported by their handlers,
+# so that short commands do not pay for imports they do not use
 
 EXIT_CODE_SUCCESS = 0
 EXIT_CODE_FILE_MISSING = 5
@@ -38,6 +37,12 @@ EXIT_CODE_DEVICES_MISSING = 20
 EXIT_CODE_COULD_NOT_MAP_DEVICE = 25
 EXIT_CODE_COULD_NOT_MAP_ALL_DEVICE = 30
 EXIT_CODE_PLATFORM_REQUIRED = 40
+EXIT_CODE_RESULT_FILE_NOT_WRITABLE = 45
+
+# arguments forwarded by client to the daemon
+CLIENT_REQUEST_ARGUMENTS = ['input', 'tid', 'platform_name', 'no_reset', 'parallel',
+                            'timing_profile', 'skip_unchanged', 'method', 'priority',
+                            'manifest']
 
 def get_subparser(subparsers, name, func, **kwargs):
     """
@@ -74,6 +79,108 @@ def get_resource_subparser(subparsers, name, func, **kwargs):
     tmp_parser = get_subparser(subparsers, name, func=func, **kwargs)
     return tmp_parser
 
+def add_flash_arguments(parser):
+    """
+    Add arguments of flash command, shared by flash and client flash
+    """
+    image_group = parser.add_mutually_exclusive_group()
+    image_group.add_argument('-i', '--input',
+                             help='Binary input to be flashed.',
+                             default=None, metavar='INPUT')
+    image_group.add_argument('--manifest',
+                             help='Json file which maps target_ids, prefixes or platforms '
+                                  'to images and methods, see doc/usage.md',
+                             default=None, metavar='MANIFEST')
+    parser.add_argument('--tid', '--target_id',
+                        help='Target to be flashed, '
+                             'ALL will flash all connected devices '
+                             'with given platform-name, '
+                             'also multiple targets can be given. '
+                             'Short target_id matches boards by prefix',
+                        default=None, metavar='TARGET_ID', action='append')
+    parser.add_argument('-t', '--platform_name',
+                        help='Platform of the target device(s)',
+                        default=None)
+    parser.add_argument('--no-reset',
+                        help='Do not reset device before or after flashing',
+                        default=None, dest='no_reset', action='store_true')
+    parser.add_argument('--parallel',
+                        help='Amount of devices flashed concurrently, '
+                             'by default devices are flashed one by one',
+                        default=1, type=int, metavar='N', dest='parallel')
+    parser.add_argument('--pipeline',
+                        help='Flash devices in a pipeline: at most N devices are reset '
+                             'and copied to at once while others remount and verify',
+                        default=None, type=int, metavar='N', dest='pipeline')
+    parser.add_argument('--timing',
+                        help='probe: continue as soon as device is ready, '
+                             'conservative: fixed waits of earlier releases',
+                        default=None, dest='timing_profile',
+                        choices=['probe', 'conservative'])
+    parser.add_argument('--skip-unchanged',
+                        help='Only reset devices which already have the image '
+                             'from a previous successful flash',
+                        default=False, dest='skip_unchanged', action='store_true')
+    parser.add_argument('method', help='<simple|pyocd|edbg>, used for flashing',
+                        metavar='method',
+                        choices=['simple', 'pyocd', 'edbg'],
+                        nargs='?')
+
+def add_reset_arguments(parser):
+    """
+    Add arguments of reset command, shared by reset and client reset
+    """
+    parser.add_argument('--tid', '--target_id',
+                        help='Target to be reset or ALL, '
+                             'also multiple targets can be given. '
+                             'Short target_id matches boards by prefix',
+                        default=None, metavar='TARGET_ID', action='append')
+    parser.add_argument('--parallel',
+                        help='Amount of devices reset concurrently, '
+                             'by default devices are reset one by one',
+                        default=1, type=int, metavar='N', dest='parallel')
+    parser.add_argument('method',
+                        help='<simple|pyocd|edbg>, used for reset',
+                        metavar='method',
+                        choices=['simple', 'pyocd', 'edbg'],
+                        nargs='?')
+
+def add_erase_arguments(parser):
+    """
+    Add arguments of erase command, shared by erase and client erase
+    """
+    parser.add_argument('--tid', '--target_id',
+                        help='Target to be erased or ALL, '
+                             'also multiple targets can be given. '
+                             'Short target_id matches boards by prefix',
+                        default=None, metavar='TARGET_ID', action='append')
+    parser.add_argument('--no-reset',
+                        help='Do not reset device after erase',
+                        default=None, dest='no_reset', action='store_true')
+    parser.add_argument('--parallel',
+                        help='Amount of devices erased concurrently, '
+                             'by default devices are erased one by one',
+                        default=1, type=int, metavar='N', dest='parallel')
+    parser.add_argument('method',
+                        help='<simple|pyocd|edbg>, used for erase',
+                        metavar='method',
+                        choices=['simple', 'pyocd', 'edbg'],
+                        nargs='?')
+
+def add_result_arguments(parser):
+    """
+    Add arguments for per device result records of flash, reset and erase
+    """
+    result_group = parser.add_mutually_exclusive_group()
+    result_group.add_argument('--json',
+                              help='Print a JSON record of every device to stdout '
+                                   'as soon as the device completes',
+                              dest='result_file', action='store_const', const='-')
+    result_group.add_argument('--result-file',
+                              help='Write a JSON record of every device to this file '
+                                   'as soon as the device completes, one record per line',
+                              default=None, dest='result_file', metavar='PATH')
+
 class FlasherCLI(object):
     """
     FlasherCLI module
@@ -101,6 +208,7 @@ class FlasherCLI(object):
         self.logger.addHandler(self.console_handler)
         self.logger.info('Writing logs to file %s', log_file)
         self.logger.setLevel(logging.DEBUG)
+        self.result_writer = None
 
         if args is None:
             args = sys.argv[1:]
@@ -134,10 +242,60 @@ class FlasherCLI(object):
         :return: 0 or args.func()
         """
         if self.args.func:
-            return self.args.func(self.args)
+            if getattr(self.args, 'result_file', None):
+                from mbed_flasher.results import ResultWriter
+                try:
+                    self.result_writer = ResultWriter.open(self.args.result_file)
+                except (IOError, OSError) as err:
+                    print("Could not open result file: %s" % err)
+                    return EXIT_CODE_RESULT_FILE_NOT_WRITABLE
+            stdout = sys.stdout
+            if self.result_writer and self.result_writer.stream is stdout:
+                # stdout carries only records, messages to the user go to stderr
+                sys.stdout = sys.stderr
+            try:
+                retcode = self.args.func(self.args)
+                if retcode and self.result_writer and not self.result_writer.count:
+                    # command failed before any device, e.g. target_id was not found
+                    self.write_request_records(retcode)
+            finally:
+                sys.stdout = stdout
+                if self.result_writer:
+                    self.result_writer.close()
+                    self.result_writer = None
+            if 'mbed_flasher.devices' in sys.modules:
+                from mbed_flasher.devices import get_device_cache
+                self.logger.debug("device scans: %s", get_device_cache().stats())
+            if self.args.metrics_file and self.args.command != 'serve':
+                self.write_metrics(self.args.metrics_file)
+            return retcode
         self.parser.print_usage()
         return 0
 
+    def write_request_records(self, retcode):
+        """
+        Write a record of every requested target_id
+        :param retcode: return code of the command
+        """
+        from mbed_flasher.results import make_request_records
+        for record in make_request_records(self.args.command, getattr(self.args, 'tid', None),
+                                           getattr(self.args, 'platform_name', None),
+                                           getattr(self.args, 'method', None), retcode):
+            if self.args.command == 'flash':
+                record['skipped'] = False
+            self.result_writer.write(record)
+
+    def write_metrics(self, path):
+        """
+        Write metrics of this run as prometheus textfile
+        :param path: path of the .prom file
+        """
+        from mbed_flasher.metrics import get_metrics
+        try:
+            get_metrics().write_textfile(path)
+        except (IOError, OSError) as err:
+            self.logger.warning("could not write metrics to %s: %s", path, err)
+
     def argparser_setup(self, sysargs):
         """! Configure CLI (Command Line options) options
         @return Returns ArgumentParser's tuple of (options, arguments)
@@ -160,6 +318,12 @@ class FlasherCLI(object):
                             action="store_true",
                             help="Silent - only errors will be printed.")
 
+        parser.add_argument('--metrics-file',
+                            dest='metrics_file',
+                            default=os.environ.get('MBED_FLASHER_METRICS_FILE'),
+                            help='Write phase timings and counters to this file in '
+                                 'prometheus text format, default MBED_FLASHER_METRICS_FILE')
+
         subparsers = parser.add_subparsers(title='command',
                                            dest='command',
                                            help='command help',
@@ -183,57 +347,47 @@ class FlasherCLI(object):
                                               'flash',
                                               func=self.subcmd_flash_handler,
                                               help='Flash given resource')
-        parser_flash.add_argument('-i', '--input',
-                                  help='Binary input to be flashed.',
-                                  default=None, metavar='INPUT')
-        parser_flash.add_argument('--tid', '--target_id',
-                                  help='Target to be flashed, '
-                                       'ALL will flash all connected devices '
-                                       'with given platform-name, '
-                                       'also multiple targets can be given. '
-                                       'Short target_id matches boards by prefix',
-                                  default=None, metavar='TARGET_ID', action='append')
-        parser_flash.add_argument('-t', '--platform_name',
-                                  help='Platform of the target device(s)',
-                                  default=None)
-        parser_flash.add_argument('--no-reset',
-                                  help='Do not reset device before or after flashing',
-                                  default=None, dest='no_reset', action='store_true')
-        parser_flash.add_argument('method', help='<simple|pyocd|edbg>, used for flashing',
-                                  metavar='method',
-                                  choices=['simple', 'pyocd', 'edbg'],
-                                  nargs='?')
+        add_flash_arguments(parser_flash)
+        add_result_arguments(parser_flash)
         # Initialize reset command
         parser_reset = get_resource_subparser(subparsers, 'reset',
                                               func=self.subcmd_reset_handler,
                                               help='Reset given resource')
-        parser_reset.add_argument('--tid', '--target_id',
-                                  help='Target to be reset or ALL, '
-                                       'also multiple targets can be given. '
-                                       'Short target_id matches boards by prefix',
-                                  default=None, metavar='TARGET_ID', action='append')
-        parser_reset.add_argument('method',
-                                  help='<simple|pyocd|edbg>, used for reset',
-                                  metavar='method',
-                                  choices=['simple', 'pyocd', 'edbg'],
-                                  nargs='?')
+        add_reset_arguments(parser_reset)
+        add_result_arguments(parser_reset)
         # Initialize erase command
         parser_erase = get_resource_subparser(subparsers, 'erase',
                                               func=self.subcmd_erase_handler,
                                               help='Erase given resource')
-        parser_erase.add_argument('--tid', '--target_id',
-                                  help='Target to be erased or ALL, '
-                                       'also multiple targets can be given. '
-                                       'Short target_id matches boards by prefix',
-                                  default=None, metavar='TARGET_ID', action='append')
-        parser_erase.add_argument('--no-reset',
-                                  help='Do not reset device after erase',
-                                  default=None, dest='no_reset', action='store_true')
-        parser_erase.add_argument('method',
-                                  help='<simple|pyocd|edbg>, used for erase',
-                                  metavar='method',
-                                  choices=['simple', 'pyocd', 'edbg'],
-                                  nargs='?')
+        add_erase_arguments(parser_erase)
+        add_result_arguments(parser_erase)
+        # Initialize daemon commands
+        parser_serve = get_subparser(subparsers, 'serve',
+                                     func=self.subcmd_serve_handler,
+                                     help='Serve flash, erase and reset requests '
+                                          'on a local unix socket')
+        parser_serve.add_argument('--socket',
+                                  help='Path of the unix socket, default '
+                                       'MBED_FLASHER_SOCKET or mbedflash.sock '
+                                       'in the cache directory',
+                                  default=None, dest='socket')
+        parser_client = get_subparser(subparsers, 'client',
+                                      func=self.subcmd_client_handler,
+                                      help='Send request to a running mbedflash serve')
+        parser_client.add_argument('--socket',
+                                   help='Path of the unix socket of the daemon',
+                                   default=None, dest='socket')
+        parser_client.add_argument('--priority',
+                                   help='Requests with higher priority are run first '
+                                        'on a busy device',
+                                   default=0, type=int, dest='priority')
+        client_subparsers = parser_client.add_subparsers(title='request',
+                                                         dest='request',
+                                                         metavar='<request>')
+        client_subparsers.required = True
+        add_flash_arguments(client_subparsers.add_parser('flash', help='Flash given resource'))
+        add_reset_arguments(client_subparsers.add_parser('reset', help='Reset given resource'))
+        add_erase_arguments(client_subparsers.add_parser('erase', help='Erase given resource'))
 
         #parser.add_argument('-m', '--mapping',
         #                    dest='device_mapping_table', help='Device mapping table.')
@@ -283,8 +437,12 @@ class FlasherCLI(object):
         """
         flash command handler
         """
-        flasher = Flash()
-        available = flasher.get_available_device_mapping()
+        if args.manifest:
+            return self.flash_manifest(args)
+        from mbed_flasher.flash import Flash
+        flasher = Flash(timing_profile=args.timing_profile,
+                        result_writer=self.result_writer)
+        available = flasher.get_device_index()
         available_target_ids = []
         retcode = 0
         #print(args)
@@ -296,7 +454,7 @@ class FlasherCLI(object):
             print("File is missing")
             return EXIT_CODE_FILE_MISSING
         if args.platform_name:
-            if args.platform_name not in flasher.get_supported_targets():
+            if not flasher.is_supported_target(args.platform_name):
                 print("Not supported platform: %s" % args.platform_name)
                 print("Supported platforms: %s" % flasher.get_supported_targets())
                 return EXIT_CODE_NOT_SUPPORTED_PLATFORM
@@ -308,7 +466,10 @@ class FlasherCLI(object):
         if 'all' in args.tid:
             retcode = flasher.flash(build=args.input, target_id='all',
                                     platform_name=args.platform_name,
-                                    method=args.method, no_reset=args.no_reset)
+                                    method=args.method, no_reset=args.no_reset,
+                                    max_workers=args.parallel,
+                                    skip_unchanged=args.skip_unchanged,
+                                    pipeline=args.pipeline)
 
         if len(available) <= 0:
             print("Could not find any connected device")
@@ -336,40 +497,66 @@ class FlasherCLI(object):
                                     target_id=target_ids_to_flash,
                                     platform_name=available_platforms[0],
                                     method=args.method,
-                                    no_reset=args.no_reset)
+                                    no_reset=args.no_reset,
+                                    max_workers=args.parallel,
+                                    skip_unchanged=args.skip_unchanged,
+                                    pipeline=args.pipeline)
 
         return retcode
 
+    def flash_manifest(self, args):
+        """
+        flash devices of a manifest and print result of every device
+        """
+        from mbed_flasher.manifest import Manifest, ManifestError, flash_manifest, \
+            EXIT_CODE_INVALID_MANIFEST
+        if args.tid or args.platform_name:
+            print("--manifest selects devices, --tid and --platform_name can not be used")
+            return EXIT_CODE_INVALID_MANIFEST
+        if args.pipeline:
+            print("--pipeline can not be used with --manifest, "
+                  "use --parallel to flash devices concurrently")
+            return EXIT_CODE_INVALID_MANIFEST
+        try:
+            manifest = Manifest.load(args.manifest, method=args.method)
+            retcode, results = flash_manifest(manifest,
+                                              max_workers=args.parallel,
+                                              timing_profile=args.timing_profile,
+                                              skip_unchanged=args.skip_unchanged,
+                                              logger=self.logger,
+                                              result_writer=self.result_writer)
+        except ManifestError as err:
+            print(err)
+            return EXIT_CODE_INVALID_MANIFEST
+        if args.result_file == '-':
+            # records on stdout replace the summary
+            return retcode
+        for target_id, result in results.items():
+            print("%s: %s (%s) -> %s" % (target_id, result['image'], result['method'],
+                                         'SUCCESS' if result['retcode'] == 0
+                                         else 'FAIL %s' % result['retcode']))
+        return retcode
+
     @staticmethod
     def prepare_platforms_and_targets(available, tid, available_target_ids):
         """
         prepare available platforms and target ids to flash
+        :param available: DeviceIndex or list of available devices
+        :param tid: target id or prefix, or list of them
+        :param available_target_ids: list extended with all available target ids
+        :return: tuple of platforms and target ids matching tid, in enumeration order
         """
+        from mbed_flasher.devices import DeviceIndex
+        if not isinstance(available, DeviceIndex):
+            available = DeviceIndex(available)
+        available_target_ids.extend(available.target_ids)
+
         available_platforms = []
         target_ids_to_flash = []
-
-        for device in available:
-            available_target_ids.append(device['target_id'])
-            if isinstance(tid, list):
-                for item in tid:
-                    if device['target_id'] == item \
-                            or device['target_id'].startswith(item):
-                        if device['target_id'] not in target_ids_to_flash:
-                            target_ids_to_flash.append(device['target_id'])
-
-                        if 'platform_name' in device \
-                                and device['platform_name'] not in available_platforms:
-                            available_platforms.append(device['platform_name'])
-
-            else:
-                if device['target_id'] == tid \
-                        or device['target_id'].startswith(tid):
-                    if device['target_id'] not in target_ids_to_flash:
-                        target_ids_to_flash.append(device['target_id'])
-
-                    if 'platform_name' in device and \
-                                    device['platform_name'] not in available_platforms:
-                        available_platforms.append(device['platform_name'])
+        for device in available.match(tid, prefix=True):
+            target_ids_to_flash.append(device['target_id'])
+            if 'platform_name' in device and device['platform_name'] not in available_platforms:
+                available_platforms.append(device['platform_name'])
 
         return available_platforms, target_ids_to_flash
 
@@ -377,13 +564,15 @@ class FlasherCLI(object):
         """
         reset command handler
         """
-        resetter = Reset()
         if args.tid:
+            from mbed_flasher.reset import Reset
+            resetter = Reset(result_writer=self.result_writer)
             ids = self.parse_id_to_devices(args.tid)
             if isinstance(ids, int):
                 retcode = ids
             else:
-                retcode = resetter.reset(target_id=ids, method=args.method)
+                retcode = resetter.reset(target_id=ids, method=args.method,
+                                         max_workers=args.parallel)
         else:
             print("Target_id is missing")
             return EXIT_CODE_NO_TARGET_ID
@@ -394,34 +583,64 @@ class FlasherCLI(object):
         """
         erase command handler
         """
-        eraser = Erase()
         if args.tid:
+            from mbed_flasher.erase import Erase
+            eraser = Erase(result_writer=self.result_writer)
             ids = self.parse_id_to_devices(args.tid)
             if isinstance(ids, int):
                 retcode = ids
             else:
                 retcode = eraser.erase(target_id=ids,
                                        no_reset=args.no_reset,
-                                       method=args.method)
+                                       method=args.method,
+                                       max_workers=args.parallel)
         else:
             print("Target_id is missing")
             return EXIT_CODE_NO_TARGET_ID
 
         return retcode
 
+    def subcmd_serve_handler(self, args):
+        """
+        serve command handler
+        """
+        from mbed_flasher.daemon import serve
+        return serve(socket_path=args.socket, logger=self.logger,
+                     metrics_file=args.metrics_file)
+
+    def subcmd_client_handler(self, args):
+        """
+        client command handler, sends request to a running daemon
+        """
+        from mbed_flasher.daemon import send_request
+        request = {'command': args.request}
+        for key in CLIENT_REQUEST_ARGUMENTS:
+            if key in args:
+                request[key] = getattr(args, key)
+        for key in ['input', 'manifest']:
+            if request.get(key):
+                # daemon may run in another working directory
+                request[key] = os.path.abspath(request[key])
+        response = send_request(request, socket_path=args.socket)
+        if response.get('message'):
+            print(response['message'])
+        if response.get('results'):
+            self.logger.info("results: %s", response['results'])
+        return response.get('retcode', EXIT_CODE_SUCCESS)
+
     # args not used, but the logic to call sub cmd handler is passing two args
     # pylint: disable=unused-argument
     def subcmd_version_handler(self, args):
         """
         version command handler
         """
-        import pkg_resources  # part of setuptools
-        versions = pkg_resources.require("mbed-flasher")
+        from mbed_flasher import __version__
         if self.args.verbose:
-            for version in versions:
-                print(version)
+            from mbed_flasher.platforms import get_mbed_ls_version
+            print("mbed-flasher %s" % __version__)
+            print("mbed-ls %s" % get_mbed_ls_version())
         else:
-            print(versions[0].version)
+            print(__version__)
 
         return EXIT_CODE_SUCCESS
 
@@ -430,44 +649,35 @@ class FlasherCLI(object):
         """
         list platform command
         """
-        flasher = Flash()
-        print(json.dumps(flasher.get_supported_targets()))
+        from mbed_flasher.platforms import get_platform_database
+        print(json.dumps(get_platform_database().platforms))
         return EXIT_CODE_SUCCESS
 
     def subcmd_list_flashers(self, args):
         """
         list flasher command handler
         """
-        flasher = Flash()
-        print(json.dumps(flasher.get_supported_flashers()))
+        from mbed_flasher.flashers import AvailableFlashers
+        print(json.dumps([flasher.name for flasher in AvailableFlashers]))
         return EXIT_CODE_SUCCESS
 
     def parse_id_to_devices(self, tid):
         """
         :param tid: target id
         """
-        flasher = Flash()
-        available = flasher.get_available_device_mapping()
-        target_ids = []
-        available_target_ids = []
+        from mbed_flasher.devices import get_device_cache
+        available = get_device_cache().get_index()
         if not available:
             print("Could not find any connected device")
             return EXIT_CODE_DEVICES_MISSING
         if 'all' in tid:
-            for device in available:
-                target_ids.append(device['target_id'])
+            target_ids = available.target_ids
         else:
-            for item in tid:
-                for device in available:
-                    available_target_ids.append(device['target_id'])
-                    if device['target_id'] == item or \
-                            device['target_id'].startswith(item):
-                        if device['target_id'] not in target_ids:
-                            target_ids.append(device['target_id'])
+            target_ids = [device['target_id'] for device in available.match(tid, prefix=True)]
         if not target_ids:
             print("Could not find given target_id from attached devices")
             print("Available target_ids:")
-            print(available_target_ids)
+            print(available.target_ids)
             return EXIT_CODE_COULD_NOT_MAP_DEVICE
 
         if len(target_ids) == 1:
@@ -0,0 +1,248 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import os
+import six
+
+from mbed_flasher.devices import get_device_cache
+from mbed_flasher.image import PreparedImage
+from mbed_flasher.scheduler import Job, Scheduler
+
+EXIT_CODE_SUCCESS = 0
+EXIT_CODE_INVALID_MANIFEST = 75
+EXIT_CODE_FLASH_FAILED = 80
+
+METHODS = ('simple', 'pyocd', 'edbg')
+
+
+class ManifestError(ValueError):
+    """
+    Manifest can not be read or resolved to attached devices
+    """
+
+
+class ManifestEntry(object):
+    """
+    Image to flash on devices selected by target_id prefixes or platform name
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, image, target_ids=None, platform_name=None, method=None, no_reset=None):
+        """
+        :param image: path of the image
+        :param target_ids: list of target_ids or target_id prefixes
+        :param platform_name: platform of the devices, used when target_ids are not given
+        :param method: method for flashing, None uses the default method of the manifest
+        :param no_reset: do not reset devices before or after flashing
+        """
+        if not target_ids and not platform_name:
+            raise ManifestError("Entry for %s requires target_id or platform_name" % image)
+        if method is not None and method not in METHODS:
+            raise ManifestError("Unknown method %s for %s" % (method, image))
+        self.image = image
+        self.target_ids = target_ids if target_ids else []
+        self.platform_name = platform_name
+        self.method = method
+        self.no_reset = no_reset
+
+    def selector(self):
+        """
+        :return: human readable selector of the entry
+        """
+        if self.target_ids:
+            return "target_id %s" % ', '.join(self.target_ids)
+        return "platform %s" % self.platform_name
+
+    def __repr__(self):
+        return "ManifestEntry(%s, %s)" % (self.image, self.selector())
+
+
+class Manifest(object):
+    """
+    Mapping of devices to images. Manifest file is json, either a list of entries
+    or an object with list of entries in "entries":
+
+        [{"target_id": "0240000028884e45", "image": "server.bin"},
+         {"platform_name": "K64F", "image": "client.bin", "method": "simple"}]
+
+    target_id may be a list and matches target_ids by prefix. Entries with
+    target_id take precedence over entries with platform_name, so a platform
+    entry covers the remaining devices of that platform. Relative image paths
+    are relative to the manifest file.
+    """
+    def __init__(self, entries, method='simple'):
+        """
+        :param entries: list of ManifestEntry
+        :param method: method for entries which do not specify one
+        """
+        self.entries = entries
+        self.method = method
+
+    @staticmethod
+    def load(path, method='simple'):
+        """
+        :param path: path of the manifest file
+        :param method: method for entries which do not specify one
+        :return: Manifest
+        """
+        try:
+            with open(path, 'r') as manifest_file:
+                data = json.load(manifest_file)
+        except (IOError, OSError) as err:
+            six.raise_from(ManifestError("Could not read manifest %s: %s" % (path, err)), err)
+        except ValueError as err:
+            six.raise_from(ManifestError("Invalid json in manifest %s: %s" % (path, err)), err)
+        if isinstance(data, dict):
+            data = data.get('entries')
+        if not isinstance(data, list) or not data:
+            raise ManifestError("Manifest %s has no entries" % path)
+        base = os.path.dirname(os.path.abspath(path))
+        entries = []
+        for item in data:
+            if not isinstance(item, dict) or not item.get('image'):
+                raise ManifestError("Manifest entry requires image: %s" % item)
+            target_ids = item.get('target_id')
+            if isinstance(target_ids, six.string_types):
+                target_ids = [target_ids]
+            entries.append(ManifestEntry(image=os.path.join(base, item['image']),
+                                         target_ids=target_ids,
+                                         platform_name=item.get('platform_name'),
+                                         method=item.get('method'),
+                                         no_reset=item.get('no_reset')))
+        return Manifest(entries, method=method)
+
+    @property
+    def images(self):
+        """
+        :return: list of distinct image paths in order of entries
+        """
+        images = []
+        for entry in self.entries:
+            if entry.image not in images:
+                images.append(entry.image)
+        return images
+
+    def resolve(self, index):
+        """
+        Select entry of every device
+        :param index: DeviceIndex of attached devices
+        :return: list of (device, entry) tuples in enumeration order
+        """
+        selected = {}
+        unmatched = []
+        for by_target_id in (True, False):
+            chosen = {}
+            for entry in self.entries:
+                if bool(entry.target_ids) != by_target_id:
+                    continue
+                if by_target_id:
+                    devices = index.match(entry.target_ids, platform_name=entry.platform_name,
+                                          prefix=True)
+                else:
+                    devices = index.by_platform(entry.platform_name)
+                if not devices:
+                    unmatched.append(entry.selector())
+                for device in devices:
+                    target_id = device['target_id']
+                    if target_id in chosen:
+                        raise ManifestError("Device %s is selected by both %s and %s" % (
+                            target_id, chosen[target_id].selector(), entry.selector()))
+                    chosen[target_id] = entry
+            for target_id, entry in chosen.items():
+                selected.setdefault(target_id, entry)
+        if unmatched:
+            raise ManifestError("No attached devices for %s, available target_ids: %s" % (
+                '; '.join(unmatched), index.target_ids))
+        return [(device, selected[device['target_id']]) for device in index.devices
+                if device['target_id'] in selected]
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def flash_manifest(manifest, device_cache=None, scheduler=None, max_workers=None,
+                   timing_profile=None, skip_unchanged=False, priority=0, logger=None,
+                   result_writer=None):
+    """
+    Flash all devices of manifest. Devices are resolved against one enumeration,
+    each image is read once and all devices are flashed as jobs of one scheduler.
+    :param manifest: Manifest
+    :param device_cache: DeviceCache, default process wide cache
+    :param scheduler: Scheduler running the jobs, default a scheduler of max_workers
+    :param max_workers: amount of devices flashed concurrently, None flashes one by one
+                        with the default scheduler and is not limited with a given one
+    :param timing_profile: timing profile of Flash
+    :param skip_unchanged: skip devices which already have the same image
+    :param priority: priority of the jobs
+    :param logger: logger to use
+    :param result_writer: ResultWriter of the default scheduler, receives a record
+                          of every flashed device
+    :return: tuple of return code of first failed device and dictionary of
+             target_id to image, method and retcode
+    """
+    logger = logger if logger else logging.getLogger('mbed-flasher')
+    device_cache = device_cache if device_cache else get_device_cache()
+    index = device_cache.get_index()
+    targets = manifest.resolve(index)
+
+    images = {}
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = Scheduler(max_workers=max_workers if max_workers else 1,
+                              device_cache=device_cache, logger=logger,
+                              result_writer=result_writer)
+    try:
+        for device, entry in targets:
+            if entry.image not in images:
+                try:
+                    images[entry.image] = PreparedImage(entry.image)
+                except (IOError, OSError) as err:
+                    six.raise_from(ManifestError("Could not read image %s: %s"
+                                                 % (entry.image, err)), err)
+        entries = []
+        jobs = []
+        for device, entry in targets:
+            method = entry.method if entry.method else manifest.method
+            logger.info("%s: %s (%s)", device['target_id'], entry.image, method)
+            entries.append((entry, method))
+            jobs.append(Job('flash', device['target_id'], build=images[entry.image],
+                            priority=priority, method=method,
+                            platform_name=device['platform_name'],
+                            device_mapping_table=[device],
+                            no_reset=entry.no_reset,
+                            timing_profile=timing_profile,
+                            skip_unchanged=skip_unchanged))
+        # a shared scheduler may run more workers, max_workers still bounds this manifest
+        jobs = scheduler.submit_all(jobs, max_running=max_workers)
+        results = OrderedDict()
+        for (entry, method), job in zip(entries, jobs):
+            # wait for every job, images are closed afterwards
+            try:
+                retcode = job.result()
+            # pylint: disable=broad-except
+            except Exception as err:
+                logger.error("Flashing %s failed: %s", job.target_id, err)
+                retcode = EXIT_CODE_FLASH_FAILED
+            results[job.target_id] = {'image': entry.image, 'method': method,
+                                      'retcode': retcode}
+    finally:
+        if own_scheduler:
+            scheduler.shutdown()
+        for image in images.values():
+            image.close()
+
+    failed = [result['retcode'] for result in results.values() if result['retcode']]
+    return (failed[0] if failed else EXIT_CODE_SUCCESS), results
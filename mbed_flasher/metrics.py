@@ -0,0 +1,260 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import platform
+import socket
+import tempfile
+from threading import Lock
+import time
+
+# monotonic where available (python 3), durations do not jump with the wall clock
+clock = getattr(time, 'monotonic', time.time)
+
+PREFIX = 'mbedflash'
+
+PHASE_ENUMERATION = 'enumeration'
+PHASE_PRE_RESET = 'pre-reset'
+PHASE_COPY = 'copy'
+PHASE_DETACH = 'detach'
+PHASE_REMOUNT = 'remount'
+PHASE_VERIFY = 'verify'
+PHASE_POST_RESET = 'post-reset'
+
+# summaries, observed in seconds
+PHASE_SECONDS = 'phase_seconds'
+OPERATION_SECONDS = 'operation_seconds'
+# counters
+OPERATIONS = 'operations'
+BYTES_WRITTEN = 'bytes_written'
+SUBPROCESSES = 'subprocesses'
+ENUMERATIONS = 'enumerations'
+RETRIES = 'retries'
+DAPLINK_ERRORS = 'daplink_errors'
+MOUNT_VERIFIER_ROUNDS = 'mount_verifier_rounds'
+
+HELP = {
+    PHASE_SECONDS: 'Time spent in each phase of flash, erase and device enumeration',
+    OPERATION_SECONDS: 'Duration of flash, erase and reset of one device',
+    OPERATIONS: 'Flash, erase and reset operations by result',
+    BYTES_WRITTEN: 'Bytes of images written to devices',
+    SUBPROCESSES: 'Subprocesses spawned',
+    ENUMERATIONS: 'Device enumerations performed',
+    RETRIES: 'Retried actions',
+    DAPLINK_ERRORS: 'Flash failures reported by DAPLink by error class',
+    MOUNT_VERIFIER_ROUNDS: 'Polling rounds of mount point verification',
+}
+
+
+def _labels(labels):
+    """
+    :return: labels as hashable sorted tuple, None values are left out
+    """
+    return tuple(sorted((key, str(value)) for key, value in labels.items()
+                        if value is not None))
+
+
+def _format_labels(labels):
+    """
+    :return: labels in prometheus exposition format
+    """
+    if not labels:
+        return ''
+    escaped = ['%s="%s"' % (key, value.replace('\\', '\\\\').replace('"', '\\"')
+                            .replace('\n', '\\n')) for key, value in labels]
+    return '{%s}' % ','.join(escaped)
+
+
+class _Timer(object):
+    """
+    Context manager which observes the time spent inside it
+    """
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = clock() - self.start
+        self.metrics.observe(self.name, self.elapsed, **self.labels)
+
+
+class Metrics(object):
+    """
+    Timings and counters of the process. Timings are kept as summaries of
+    count, sum and maximum per label set, counters as totals per label set.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._summaries = {}
+        self._counters = {}
+
+    def observe(self, name, seconds, **labels):
+        """
+        :param name: summary name, e.g. PHASE_SECONDS
+        :param seconds: observed duration
+        :param labels: labels of the observation, e.g. phase and platform
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            summary = self._summaries.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            summary['count'] += 1
+            summary['sum'] += seconds
+            summary['max'] = max(summary['max'], seconds)
+
+    def timer(self, name, **labels):
+        """
+        :return: context manager which observes the time spent inside it
+        """
+        return _Timer(self, name, labels)
+
+    def phase(self, phase, platform_name=None, operation=None):
+        """
+        :param phase: phase, e.g. PHASE_COPY
+        :param platform_name: platform of the device
+        :param operation: flash or erase, None for phases of no single operation
+        :return: context manager timing the phase
+        """
+        return self.timer(PHASE_SECONDS, phase=phase, platform=platform_name,
+                          operation=operation)
+
+    def operation(self, operation, platform_name, seconds, retcode):
+        """
+        Record duration and result of an operation on one device
+        :param operation: flash, erase or reset
+        :param platform_name: platform of the device
+        :param seconds: duration of the operation
+        :param retcode: return code of the operation
+        """
+        self.observe(OPERATION_SECONDS, seconds, operation=operation, platform=platform_name)
+        self.increment(OPERATIONS, operation=operation, platform=platform_name,
+                       result='success' if retcode == 0 else 'failure')
+
+    def increment(self, name, amount=1, **labels):
+        """
+        :param name: counter name, e.g. BYTES_WRITTEN
+        :param amount: amount to add
+        :param labels: labels of the counter
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """
+        :return: dictionary of summaries and counters, each a list of
+                 dictionaries with name, labels and values
+        """
+        with self._lock:
+            summaries = [dict(summary, name=name, labels=dict(labels))
+                         for (name, labels), summary in sorted(self._summaries.items())]
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+        return {'summaries': summaries, 'counters': counters}
+
+    def get(self, name, **labels):
+        """
+        :return: value of counter or summary dictionary, None if not recorded
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            summary = self._summaries.get(key)
+            return dict(summary) if summary else None
+
+    def clear(self):
+        """
+        Forget all timings and counters
+        """
+        with self._lock:
+            self._summaries.clear()
+            self._counters.clear()
+
+    def to_prometheus(self, host=None):
+        """
+        :param host: value of host label, default host name
+        :return: metrics in prometheus text exposition format
+        """
+        host = host if host else socket.gethostname()
+        snapshot = self.snapshot()
+        lines = []
+        described = set()
+
+        def describe(metric, name, metric_type):
+            if metric not in described:
+                described.add(metric)
+                lines.append('# HELP %s %s' % (metric, HELP.get(name, name)))
+                lines.append('# TYPE %s %s' % (metric, metric_type))
+
+        for summary in snapshot['summaries']:
+            labels = _format_labels(_labels(dict(summary['labels'], host=host)))
+            metric = '%s_%s' % (PREFIX, summary['name'])
+            describe(metric, summary['name'], 'summary')
+            lines.append('%s_count%s %i' % (metric, labels, summary['count']))
+            lines.append('%s_sum%s %.6f' % (metric, labels, summary['sum']))
+        for summary in snapshot['summaries']:
+            labels = _format_labels(_labels(dict(summary['labels'], host=host)))
+            metric = '%s_%s_max' % (PREFIX, summary['name'])
+            describe(metric, summary['name'], 'gauge')
+            lines.append('%s%s %.6f' % (metric, labels, summary['max']))
+        for counter in snapshot['counters']:
+            labels = _format_labels(_labels(dict(counter['labels'], host=host)))
+            metric = '%s_%s_total' % (PREFIX, counter['name'])
+            describe(metric, counter['name'], 'counter')
+            lines.append('%s%s %s' % (metric, labels, counter['value']))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def write_textfile(self, path, host=None):
+        """
+        Write metrics for the textfile collector of node exporter. The file is
+        replaced atomically so that the collector never reads a partial file.
+        :param path: path of the .prom file
+        :param host: value of host label, default host name
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path))
+        try:
+            with os.fdopen(handle, 'w') as tmp_file:
+                tmp_file.write(self.to_prometheus(host))
+            # collector reads the file as another user
+            os.chmod(tmp_path, 0o644)
+            if hasattr(os, 'replace'):
+                os.replace(tmp_path, path)
+            else:
+                if platform.system() == 'Windows' and os.path.exists(path):
+                    os.remove(path)
+                os.rename(tmp_path, path)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+_METRICS = Metrics()
+
+
+def get_metrics():
+    """
+    :return: process wide metrics
+    """
+    return _METRICS
@@ -0,0 +1,243 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+import os
+import sys
+from threading import Lock
+import six
+
+from mbed_flasher.common import get_cache_dir, write_json_atomic
+
+PLATFORM_DB_FILE = 'platforms.json'
+PLATFORM_DB_FORMAT = 1
+# mock files which extend mbed-ls platform table, see MbedLsToolsBase
+MBED_LS_MOCK_FILE = '.mbedls-mock'
+MBED_LS_HOME_MOCK_FILE = os.path.join(os.path.expanduser('~'), '.mbed-ls', MBED_LS_MOCK_FILE)
+
+
+def _mtime(path):
+    """
+    :return: modification time of path, None if it does not exist
+    """
+    try:
+        return int(os.stat(path).st_mtime)
+    except OSError:
+        return None
+
+
+def get_package_dir(name):
+    """
+    Locate package without importing it
+    :param name: top level package name
+    :return: directory of the package, None if not found
+    """
+    if six.PY2:
+        return _search_package_dir(name)
+    from importlib.util import find_spec
+    spec = find_spec(name)
+    if spec is None or not spec.origin:
+        return None
+    return os.path.dirname(spec.origin)
+
+
+def _search_package_dir(name):
+    """
+    Search sys.path for package directory, python 2 has no importlib.util
+    :param name: top level package name
+    :return: directory of the package, None if not found
+    """
+    for entry in sys.path:
+        package_dir = os.path.join(entry or os.curdir, name)
+        if os.path.isfile(os.path.join(package_dir, '__init__.py')):
+            return package_dir
+    return None
+
+
+def get_mbed_ls_version():
+    """
+    Installed mbed-ls version, read from package metadata next to mbed_lstools
+    without importing pkg_resources
+    :return: version string, None if metadata is not found
+    """
+    package_dir = get_package_dir('mbed_lstools')
+    if package_dir is None:
+        return None
+    site_dir = os.path.dirname(os.path.abspath(package_dir))
+    try:
+        entries = os.listdir(site_dir)
+    except OSError:
+        return None
+    for entry in entries:
+        name, ext = os.path.splitext(entry)
+        if ext in ('.dist-info', '.egg-info') and name.lower().startswith('mbed_ls-'):
+            return name.split('-')[1]
+    return None
+
+
+def get_database_key(flashers):
+    """
+    Key of the platform database, database is rebuilt when the key changes.
+    mbed-ls platform table can also be extended by its mock files.
+    :param flashers: flashers in the database
+    :return: dictionary
+    """
+    package_dir = get_package_dir('mbed_lstools')
+    return {
+        'format': PLATFORM_DB_FORMAT,
+        'mbed_ls': get_mbed_ls_version(),
+        'mbed_ls_mtime': _mtime(os.path.join(package_dir, 'lstools_base.py'))
+                         if package_dir else None,
+        'mocks': [[path, _mtime(path)] for path in
+                  [os.path.abspath(MBED_LS_MOCK_FILE), MBED_LS_HOME_MOCK_FILE]],
+        'flashers': sorted(flasher.name for flasher in flashers)
+    }
+
+
+class PlatformDatabase(object):
+    """
+    Platforms supported by each flasher, persisted to the cache directory.
+    Loaded on first use and rebuilt when mbed-ls or its mock files change.
+    """
+    def __init__(self, path=None, flashers=None, logger=None):
+        """
+        :param path: path of the database, default platforms.json in the cache directory
+        :param flashers: flashers to query, default AvailableFlashers
+        :param logger: logger to use
+        """
+        self._path = path
+        self._flashers = flashers
+        self.logger = logger if logger else logging.getLogger('mbed-flasher')
+        self._lock = Lock()
+        self._flasher_platforms = None
+        self._platforms = None
+        self._platform_set = frozenset()
+
+    @property
+    def path(self):
+        """
+        :return: path of the database file
+        """
+        if self._path is None:
+            self._path = os.path.join(get_cache_dir(), PLATFORM_DB_FILE)
+        return self._path
+
+    @property
+    def flashers(self):
+        """
+        :return: flashers in the database
+        """
+        if self._flashers is None:
+            from mbed_flasher.flashers import AvailableFlashers
+            self._flashers = AvailableFlashers
+        return self._flashers
+
+    def _read(self, key):
+        """
+        :param key: expected database key
+        :return: flasher to platforms dictionary, None if file is missing or stale
+        """
+        try:
+            with open(self.path, 'r') as db_file:
+                database = json.load(db_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(database, dict) or database.get('key') != key:
+            return None
+        return database.get('flashers')
+
+    def _build(self):
+        """
+        :return: flasher to platforms dictionary queried from flashers
+        """
+        flasher_platforms = {}
+        for flasher in self.flashers:
+            flasher_platforms[flasher.name] = list(flasher.get_supported_targets())
+        return flasher_platforms
+
+    def load(self):
+        """
+        Load database from the file or rebuild it if stale
+        """
+        with self._lock:
+            if self._flasher_platforms is not None:
+                return
+            key = get_database_key(self.flashers)
+            flasher_platforms = self._read(key)
+            if flasher_platforms is None:
+                self.logger.debug("rebuilding platform database %s", self.path)
+                flasher_platforms = self._build()
+                try:
+                    write_json_atomic(self.path, {'key': key, 'flashers': flasher_platforms})
+                except (IOError, OSError) as err:
+                    self.logger.warning("Could not write platform database: %s", err)
+            platforms = []
+            for flasher in self.flashers:
+                platforms.extend(flasher_platforms.get(flasher.name, []))
+            self._platforms = platforms
+            self._platform_set = frozenset(platforms)
+            self._flasher_platforms = flasher_platforms
+
+    def invalidate(self):
+        """
+        Rebuild database on next use
+        """
+        with self._lock:
+            self._flasher_platforms = None
+            self._platforms = None
+            self._platform_set = frozenset()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    @property
+    def platforms(self):
+        """
+        :return: list of supported platforms, in order of flashers
+        """
+        self.load()
+        return self._platforms
+
+    @property
+    def flasher_platforms(self):
+        """
+        :return: dictionary of flasher name to list of its platforms
+        """
+        self.load()
+        return self._flasher_platforms
+
+    def is_supported(self, platform_name):
+        """
+        :param platform_name: platform name
+        :return: True if some flasher supports platform
+        """
+        self.load()
+        return platform_name in self._platform_set
+
+    def __contains__(self, platform_name):
+        return self.is_supported(platform_name)
+
+
+_PLATFORM_DB = PlatformDatabase()
+
+
+def get_platform_database():
+    """
+    :return: process wide platform database
+    """
+    return _PLATFORM_DB
@@ -17,9 +17,13 @@ limitations under the License.
 # python 3 compatibility
 # pylint: disable=superfluous-parens
 
-from serial.serialutil import SerialException
-from mbed_flasher.flashers.enhancedserial import EnhancedSerial
-from mbed_flasher.common import Logger
+from collections import OrderedDict
+from mbed_flasher.common import Logger, run_parallel
+from mbed_flasher.daplink_details import get_details_cache
+from mbed_flasher.devices import DeviceIndex, get_device_cache
+from mbed_flasher.metrics import clock, get_metrics
+from mbed_flasher.results import make_record, make_request_records
+from mbed_flasher.serial_reset import SerialResetter
 
 EXIT_CODE_SUCCESS = 0
 EXIT_CODE_COULD_NOT_MAP_TO_DEVICE = 3
@@ -29,26 +33,34 @@ EXIT_CODE_NONSUPPORTED_METHOD_FOR_RESET = 9
 EXIT_CODE_RESET_FAILED_PORT_OPEN = 11
 EXIT_CODE_SERIAL_RESET_FAILED = 13
 EXIT_CODE_TARGET_ID_MISSING = 15
+EXIT_CODE_SERIAL_RESET_NOT_SUPPORTED = 17
 
 
 class Reset(object):
     """ Reset object, which manages reset for given devices
     """
     _flashers = []
-    def __init__(self):
+    def __init__(self, device_cache=None, details_cache=None, result_writer=None):
+        """
+        :param device_cache: DeviceCache to enumerate devices, default process wide cache
+        :param details_cache: DetailsCache of DETAILS.TXT, default process wide cache
+        :param result_writer: ResultWriter which receives a record of every reset device
+        """
         logger = Logger('mbed-flasher')
         self.logger = logger.logger
         self._flashers = self.__get_flashers()
+        self.device_cache = device_cache if device_cache else get_device_cache()
+        self.details_cache = details_cache if details_cache else get_details_cache()
+        self.result_writer = result_writer
+        self.results = OrderedDict()
+        self.timings = OrderedDict()
+        self.records = OrderedDict()
 
     def get_available_device_mapping(self):
         """
         :return: available devices
         """
-        available_devices = []
-        for flasher in self._flashers:
-            devices = flasher.get_available_devices()
-            available_devices.extend(devices)
-        return available_devices
+        return self.device_cache.get_devices()
 
     @staticmethod
     def __get_flashers():
@@ -61,43 +73,39 @@ class Reset(object):
     def reset_board(self, serial_port):
         """
         :param serial_port: serial port
-        :return: return exit code if failed
+        :return: 0 if break was sent, otherwise exit code
         """
-        try:
-            port = EnhancedSerial(serial_port)
-        except SerialException as err:
-            self.logger.info("reset could not be sent")
-            self.logger.error(err)
-            # SerialException.message is type "string"
-            # pylint: disable=no-member
-            if err.message.find('could not open port') != -1:
-                print('Reset could not be given. Close your Serial connection to device.')
-            return EXIT_CODE_RESET_FAILED_PORT_OPEN
-        port.baudrate = 115200
-        port.timeout = 1
-        port.xonxoff = False
-        port.rtscts = False
-        port.flushInput()
-        port.flushOutput()
-
-        if port:
-            self.logger.info("sendBreak to device to reboot")
-            result = port.safe_send_break()
-            if result:
-                self.logger.info("reset completed")
-            else:
-                self.logger.error("reset failed")
-                return EXIT_CODE_SERIAL_RESET_FAILED
-        port.close()
+        return SerialResetter(self.logger).reset(serial_port)
 
-    def reset(self, target_id=None, method=None):
+    def reset_serial(self, item):
+        """
+        Reset device by serial break unless DETAILS.TXT tells it has no serial port
+        :param item: device with serial_port
+        :return: exit code
+        """
+        details = self.details_cache.get(item)
+        if details is not None and not details.supports_serial_reset:
+            self.logger.error("Interface of %s has no serial port, use pyocd for reset",
+                              item['target_id'])
+            return EXIT_CODE_SERIAL_RESET_NOT_SUPPORTED
+        return self.reset_board(item['serial_port'])
+
+    def reset(self, target_id=None, method=None, max_workers=None):
         """Reset (mbed) device
         :param target_id: target_id
         :param method: method for reset i.e. simple, pyocd or edbg
+        :param max_workers: amount of devices reset concurrently, None resets one by one
+        :return: 0 if all devices were reset, otherwise return code of first failed device.
+                 Return codes of each device are stored to self.results,
+                 reset durations in seconds to self.timings and
+                 result records to self.records
         """
         self.logger.info("Starting reset for target_id %s", target_id)
         self.logger.info("Method for reset: %s", method)
-        available_devices = self.get_available_device_mapping()
+        self.results = OrderedDict()
+        self.timings = OrderedDict()
+        self.records = OrderedDict()
+        available_devices = self.device_cache.get_index()
 
         if target_id is None:
             return EXIT_CODE_TARGET_ID_MISSING
@@ -106,44 +114,74 @@ class Reset(object):
 
         if len(targets_to_reset) <= 0:
             print("Could not map given target_id(s) to available devices")
+            self._store_failed(make_request_records('reset', target_id, None, method,
+                                                    EXIT_CODE_COULD_NOT_MAP_TO_DEVICE))
             return EXIT_CODE_COULD_NOT_MAP_TO_DEVICE
 
-        for item in targets_to_reset:
-            if method == 'simple' and 'serial_port' in item:
-                self.reset_board(item['serial_port'])
-            elif method == 'pyocd':
-                return self.try_pyocd_reset(item)
-            elif method == 'edbg':
-                print("Not supported yet")
-            else:
-                print("Selected method %s not supported" % method)
-                return EXIT_CODE_NONSUPPORTED_METHOD_FOR_RESET
+        if method not in ['simple', 'pyocd', 'edbg']:
+            print("Selected method %s not supported" % method)
+            self._store_failed([make_record('reset', item, method,
+                                            EXIT_CODE_NONSUPPORTED_METHOD_FOR_RESET, 0)
+                                for item in targets_to_reset])
+            return EXIT_CODE_NONSUPPORTED_METHOD_FOR_RESET
+        if method == 'edbg':
+            print("Not supported yet")
+            return EXIT_CODE_SUCCESS
 
+        def reset_device(item):
+            """
+            Reset single device and measure the time it took
+            """
+            start = clock()
+            if method == 'pyocd':
+                retcode = self.try_pyocd_reset(item)
+            elif 'serial_port' in item:
+                retcode = self.reset_serial(item)
+            else:
+                self.logger.warning("%s has no serial port, not reset", item['target_id'])
+                retcode = EXIT_CODE_SUCCESS
+            elapsed = clock() - start
+            get_metrics().operation('reset', item.get('platform_name'), elapsed, retcode)
+            record = make_record('reset', item, method, retcode, elapsed)
+            if self.result_writer:
+                self.result_writer.write(record)
+            return retcode, elapsed, record
+
+        outcomes = run_parallel(reset_device, targets_to_reset, max_workers=max_workers)
+        for item, (retcode, elapsed, record) in zip(targets_to_reset, outcomes):
+            self.results[item['target_id']] = retcode
+            self.timings[item['target_id']] = elapsed
+            self.records[item['target_id']] = record
+            self.logger.debug("%s -> %s in %.2fs", item['target_id'],
+                              'SUCCESS' if retcode == EXIT_CODE_SUCCESS else 'FAIL', elapsed)
+
+        for retcode in self.results.values():
+            if retcode != EXIT_CODE_SUCCESS:
+                return retcode
         return EXIT_CODE_SUCCESS
 
+    def _store_failed(self, records):
+        """
+        Store records of requested devices which failed before they were reset
+        :param records: records of failed devices
+        """
+        for record in records:
+            self.results[record['target_id']] = record['retcode']
+            self.records[record['target_id']] = record
+            if self.result_writer:
+                self.result_writer.write(record)
+
     @staticmethod
     def prepare_target_to_reset(target_id, available_devices):
         """
         prepare target to reset
+        :param target_id: list of target ids, 'all', or target id prefix
+        :param available_devices: DeviceIndex or list of available devices
+        :return: list of matching devices
         """
-        targets_to_reset = []
-
-        if isinstance(target_id, list):
-            for target in target_id:
-                for device in available_devices:
-                    if target == device['target_id'] and \
-                                    device not in targets_to_reset:
-                        targets_to_reset.append(device)
-        else:
-            if target_id == 'all':
-                targets_to_reset = available_devices
-            elif len(target_id) <= 48:
-                for device in available_devices:
-                    if (target_id == device['target_id'] or
-                            device['target_id'].startswith(target_id)) and \
-                                    device not in targets_to_reset:
-                        targets_to_reset.append(device)
-        return targets_to_reset
+        if not isinstance(available_devices, DeviceIndex):
+            available_devices = DeviceIndex(available_devices)
+        return available_devices.select(target_id)
 
     def try_pyocd_reset(self, item):
         """
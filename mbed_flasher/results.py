@@ -0,0 +1,135 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict
+import json
+import sys
+from threading import Lock
+import time
+
+# path which writes records to standard output
+STDOUT = '-'
+
+
+def new_report():
+    """
+    :return: dictionary an operation fills with details of one device:
+             durations of phases, DAPLink fault text and target after remount
+    """
+    return {'phases': OrderedDict(), 'fault': None, 'new_target': None}
+
+
+# pylint: disable=too-many-arguments
+def make_record(operation, target, method, retcode, duration, report=None):
+    """
+    :param operation: flash, erase or reset
+    :param target: device as enumerated before the operation
+    :param method: simple, pyocd or edbg
+    :param retcode: return code of the operation
+    :param duration: duration of the operation in seconds
+    :param report: dictionary from new_report filled by the operation
+    :return: result record of one device
+    """
+    report = report if report else new_report()
+    new_target = report['new_target'] if report['new_target'] else {}
+    return OrderedDict([
+        ('operation', operation),
+        ('target_id', target.get('target_id')),
+        ('platform', target.get('platform_name')),
+        ('method', method),
+        ('retcode', retcode),
+        ('success', retcode == 0),
+        ('fault', report['fault']),
+        ('mount_point', target.get('mount_point')),
+        ('serial_port', target.get('serial_port')),
+        ('new_mount_point', new_target.get('mount_point')),
+        ('new_serial_port', new_target.get('serial_port')),
+        ('phases', OrderedDict((phase, round(seconds, 6))
+                               for phase, seconds in report['phases'].items())),
+        ('duration', round(duration, 6)),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+    ])
+
+
+def make_request_records(operation, target_ids, platform_name, method, retcode):
+    """
+    Records of requested devices which failed before the operation started,
+    e.g. because target_id could not be mapped to a device
+    :param operation: flash, erase or reset
+    :param target_ids: requested target_id or list of them, 'all' or a prefix
+                       is recorded as given, None gives no records
+    :param platform_name: requested platform name
+    :param method: simple, pyocd or edbg
+    :param retcode: return code of the operation
+    :return: list of records
+    """
+    if target_ids is None:
+        return []
+    if not isinstance(target_ids, (list, tuple)):
+        target_ids = [target_ids]
+    return [make_record(operation, {'target_id': target_id, 'platform_name': platform_name},
+                        method, retcode, 0)
+            for target_id in target_ids]
+
+
+class ResultWriter(object):
+    """
+    Writes result records as JSON lines, one line per device as soon as the
+    device completes, so that the file can be followed while devices are
+    still being processed. Safe to use from worker threads.
+    """
+    def __init__(self, stream, close_stream=False):
+        """
+        :param stream: file object to write records to
+        :param close_stream: close stream when the writer is closed
+        """
+        self.stream = stream
+        self.close_stream = close_stream
+        self.count = 0
+        self._lock = Lock()
+
+    @classmethod
+    def open(cls, path):
+        """
+        :param path: path of result file, STDOUT for standard output
+        :return: ResultWriter, an existing file is truncated
+        """
+        if path == STDOUT:
+            return cls(sys.stdout)
+        return cls(open(path, 'w'), close_stream=True)
+
+    def write(self, record):
+        """
+        :param record: record of one device
+        """
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self.stream.write(line)
+            self.stream.flush()
+            self.count += 1
+
+    def close(self):
+        """
+        Close the result file, standard output is left open
+        """
+        if self.close_stream:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,296 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import heapq
+from itertools import count
+import logging
+from threading import Condition, Semaphore, Thread
+from time import time
+
+from mbed_flasher.common import Future
+from mbed_flasher.devices import get_device_cache
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class Job(object):
+    """
+    Flash, erase or reset of one device. Jobs of the same device are run one
+    at a time, highest priority first and in order of submission within a priority.
+    """
+    OPERATIONS = ('flash', 'erase', 'reset')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, operation, target_id, build=None, priority=0, method='simple',
+                 **options):
+        """
+        :param operation: flash, erase or reset
+        :param target_id: full target_id of the device
+        :param build: path of the image or PreparedImage, required by flash
+        :param priority: jobs with higher priority run first
+        :param method: method i.e. simple, pyocd or edbg
+        :param options: keyword arguments of the operation, e.g. no_reset,
+                        platform_name, timing_profile or skip_unchanged
+        """
+        if operation not in Job.OPERATIONS:
+            raise ValueError("Unknown operation %s" % operation)
+        if operation == 'flash' and build is None:
+            raise ValueError("build is required for flash")
+        self.operation = operation
+        self.target_id = target_id
+        self.build = build
+        self.priority = priority
+        self.method = method
+        self.options = options
+        self.future = Future()
+        self.submitted = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def wait_time(self):
+        """
+        :return: seconds the job was queued, None if not started
+        """
+        if self.started is None:
+            return None
+        return self.started - self.submitted
+
+    def done(self):
+        """
+        :return: True if job has finished
+        """
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """
+        :param timeout: maximum time to wait in seconds, None waits forever
+        :return: return code of the operation
+        """
+        return self.future.result(timeout)
+
+    def __repr__(self):
+        return "Job(%s, %s, priority=%s)" % (self.operation, self.target_id, self.priority)
+
+
+class Scheduler(object):
+    """
+    Runs jobs with a bounded pool of worker threads. Each target_id has its own
+    priority queue and at most one running job, so different devices are
+    processed in parallel while jobs of the same device never interleave.
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, device_cache=None, logger=None,
+                 result_writer=None):
+        """
+        :param max_workers: maximum amount of concurrently running jobs
+        :param device_cache: DeviceCache, default process wide cache
+        :param logger: logger to use
+        :param result_writer: ResultWriter which receives a record of every processed device
+        """
+        self.max_workers = max_workers
+        self.device_cache = device_cache if device_cache else get_device_cache()
+        self.logger = logger if logger else logging.getLogger('mbed-flasher')
+        self.result_writer = result_writer
+        self._condition = Condition()
+        self._queues = {}
+        self._busy = set()
+        self._sequence = count()
+        self._workers = []
+        self._shutdown = False
+        self._started = 0
+        self._completed = 0
+        self._max_depth = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def submit(self, job):
+        """
+        Queue job for execution
+        :param job: Job
+        :return: job, its result is available with job.result()
+        """
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Scheduler is shut down")
+            job.submitted = time()
+            queue = self._queues.setdefault(job.target_id, [])
+            heapq.heappush(queue, (-job.priority, next(self._sequence), job))
+            self._max_depth = max(self._max_depth, self._depth())
+            # more workers than devices would only wait for device locks
+            targets = len(set(self._queues) | self._busy)
+            if len(self._workers) < min(self.max_workers, targets):
+                worker = Thread(target=self._worker)
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify_all()
+        return job
+
+    def submit_all(self, jobs, max_running=None):
+        """
+        Queue jobs for execution, waiting before each job while max_running
+        of the jobs already submitted by this call are unfinished
+        :param jobs: iterable of Job
+        :param max_running: maximum amount of unfinished jobs, None submits all at once
+        :return: list of submitted jobs
+        """
+        if not max_running:
+            return [self.submit(job) for job in jobs]
+        slots = Semaphore(max_running)
+        submitted = []
+        for job in jobs:
+            slots.acquire()
+            job.future.add_done_callback(lambda _: slots.release())
+            submitted.append(self.submit(job))
+        return submitted
+
+    def flash(self, target_id, build, priority=0, **options):
+        """
+        :return: submitted flash job
+        """
+        return self.submit(Job('flash', target_id, build=build, priority=priority, **options))
+
+    def erase(self, target_id, priority=0, **options):
+        """
+        :return: submitted erase job
+        """
+        return self.submit(Job('erase', target_id, priority=priority, **options))
+
+    def reset(self, target_id, priority=0, **options):
+        """
+        :return: submitted reset job
+        """
+        return self.submit(Job('reset', target_id, priority=priority, **options))
+
+    def _depth(self):
+        """
+        :return: amount of queued jobs, must be called with condition held
+        """
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _next_job(self):
+        """
+        :return: highest priority job of an idle device, None if there is none.
+                 Must be called with condition held.
+        """
+        best = None
+        for target_id, queue in self._queues.items():
+            if queue and target_id not in self._busy:
+                if best is None or queue[0] < self._queues[best][0]:
+                    best = target_id
+        if best is None:
+            return None
+        job = heapq.heappop(self._queues[best])[2]
+        if not self._queues[best]:
+            del self._queues[best]
+        self._busy.add(best)
+        return job
+
+    def _worker(self):
+        """
+        Run jobs until scheduler is shut down
+        """
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    if self._shutdown and not self._queues:
+                        return
+                    self._condition.wait()
+                    job = self._next_job()
+                job.started = time()
+                self._started += 1
+                self._wait_total += job.wait_time
+                self._wait_max = max(self._wait_max, job.wait_time)
+            self.logger.debug("running %r after %.3fs in queue", job, job.wait_time)
+            try:
+                result = self._run(job)
+            # errors are delivered to the submitter of the job
+            # pylint: disable=broad-except
+            except Exception as err:
+                self.logger.exception("%r failed", job)
+                result, error = None, err
+            else:
+                error = None
+            with self._condition:
+                job.finished = time()
+                self._busy.discard(job.target_id)
+                self._completed += 1
+                self._condition.notify_all()
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def _run(self, job):
+        """
+        :param job: Job
+        :return: return code of the operation
+        """
+        options = dict(job.options)
+        if job.operation == 'flash':
+            from mbed_flasher.flash import Flash
+            flasher = Flash(logger=self.logger,
+                            timing_profile=options.pop('timing_profile', None),
+                            device_cache=self.device_cache,
+                            result_writer=self.result_writer)
+            return flasher.flash(build=job.build, target_id=job.target_id,
+                                 method=job.method, **options)
+        if job.operation == 'erase':
+            from mbed_flasher.erase import Erase
+            return Erase(device_cache=self.device_cache,
+                         result_writer=self.result_writer).erase(
+                target_id=job.target_id, method=job.method, **options)
+        from mbed_flasher.reset import Reset
+        return Reset(device_cache=self.device_cache,
+                     result_writer=self.result_writer).reset(
+            target_id=job.target_id, method=job.method)
+
+    def stats(self):
+        """
+        :return: dictionary of queue depths, running and completed jobs and wait times
+        """
+        with self._condition:
+            return {
+                'queued': self._depth(),
+                'queue_depth': dict((target_id, len(queue))
+                                    for target_id, queue in self._queues.items()),
+                'max_queue_depth': self._max_depth,
+                'running': len(self._busy),
+                'completed': self._completed,
+                'wait_time_total': self._wait_total,
+                'wait_time_max': self._wait_max,
+                'wait_time_mean': self._wait_total / self._started if self._started else 0.0,
+            }
+
+    def shutdown(self, wait=True):
+        """
+        Stop workers after queued jobs have been run
+        :param wait: wait for workers to finish
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for worker in list(self._workers):
+                while worker.is_alive():
+                    worker.join(0.5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -0,0 +1,140 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# python 3 compatibility
+# pylint: disable=superfluous-parens
+
+import logging
+from serial.serialutil import SerialException
+from mbed_flasher.flashers.enhancedserial import EnhancedSerial
+from mbed_flasher.metrics import get_metrics, RETRIES
+
+EXIT_CODE_SUCCESS = 0
+EXIT_CODE_RESET_FAILED_PORT_OPEN = 11
+EXIT_CODE_SERIAL_RESET_FAILED = 13
+
+# applied when the port is opened, instead of reconfiguring the tty once per setting
+PORT_SETTINGS = {'baudrate': 115200, 'timeout': 1, 'xonxoff': False, 'rtscts': False}
+
+
+class SerialResetter(object):
+    """
+    Resets boards by sending a serial break. With keep_open the port stays open
+    between resets, so e.g. the resets before and after one flash share a handle.
+    A handle is reopened if a reset is given to another port or if the port
+    went stale while the device remounted.
+    """
+    def __init__(self, logger=None, keep_open=False, serial_class=None):
+        """
+        :param logger: logger to use
+        :param keep_open: keep the port open until close is called
+        :param serial_class: class opening the port, default EnhancedSerial
+        """
+        self.logger = logger if logger else logging.getLogger('mbed-flasher')
+        self.keep_open = keep_open
+        self.serial_class = serial_class if serial_class else EnhancedSerial
+        self._port = None
+        self._serial_port = None
+        self.opened = 0
+
+    def _open(self, serial_port):
+        """
+        :param serial_port: serial port
+        :return: open port, reused if serial_port has not changed
+        """
+        if self._port is not None and self._serial_port == serial_port:
+            return self._port
+        self.close()
+        self._port = self.serial_class(serial_port, **PORT_SETTINGS)
+        self._serial_port = serial_port
+        self.opened += 1
+        return self._port
+
+    def open(self, serial_port):
+        """
+        Open port ahead of a reset, with keep_open the next reset of serial_port uses it
+        :param serial_port: serial port
+        :return: True if port is open, otherwise the reset opens it again
+        """
+        try:
+            self._open(serial_port)
+        except (SerialException, OSError) as err:
+            self.close()
+            self.logger.debug("opening %s failed: %s", serial_port, err)
+            return False
+        return True
+
+    def _send_break(self, serial_port):
+        """
+        :return: True if break was sent
+        :raises SerialException: if port can not be opened or used
+        """
+        port = self._open(serial_port)
+        port.flushInput()
+        port.flushOutput()
+        self.logger.info("sendBreak to device to reboot")
+        return port.safe_send_break()
+
+    def reset(self, serial_port):
+        """
+        :param serial_port: serial port of the board
+        :return: 0 if break was sent, otherwise exit code
+        """
+        reused = self._port is not None and self._serial_port == serial_port
+        try:
+            try:
+                result = self._send_break(serial_port)
+            except (SerialException, OSError) as err:
+                if not reused:
+                    raise
+                # device remounted and the kept handle no longer refers to it
+                self.logger.debug("reopening %s: %s", serial_port, err)
+                get_metrics().increment(RETRIES, action='serial-reset')
+                self.close()
+                result = self._send_break(serial_port)
+        except (SerialException, OSError) as err:
+            self.close()
+            self.logger.info("reset could not be sent")
+            self.logger.error(err)
+            if str(err).find('could not open port') != -1:
+                print('Reset could not be given. Close your Serial connection to device.')
+            return EXIT_CODE_RESET_FAILED_PORT_OPEN
+        finally:
+            if not self.keep_open:
+                self.close()
+        if not result:
+            self.logger.error("reset failed")
+            return EXIT_CODE_SERIAL_RESET_FAILED
+        self.logger.info("reset completed")
+        return EXIT_CODE_SUCCESS
+
+    def close(self):
+        """
+        Close kept port
+        """
+        if self._port is not None:
+            try:
+                self._port.close()
+            except (SerialException, OSError) as err:
+                self.logger.debug("closing %s failed: %s", self._serial_port, err)
+        self._port = None
+        self._serial_port = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
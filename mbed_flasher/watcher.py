@@ -0,0 +1,488 @@
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ctypes
+import errno
+import os
+import platform
+import select
+import struct
+from threading import Event, Lock, Thread
+from time import time
+
+from mbed_flasher.common import Future
+
+WATCH_DONE = 'done'
+WATCH_FAILED = 'failed'
+
+FAULT_FILES = ('fail.txt', 'assert.txt')
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO \
+                | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT \
+                | IN_ONLYDIR
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def list_mount_point(mount_point):
+    """
+    List mount point contents in process
+    :param mount_point: mount point to list
+    :return: list of file names or None if mount point is not accessible
+    """
+    path = mount_point
+    if platform.system() == 'Windows' and path.endswith(':'):
+        path += '\\'
+    try:
+        if hasattr(os, 'scandir'):
+            return [entry.name for entry in os.scandir(path)]
+        return os.listdir(path)
+    except OSError:
+        return None
+
+
+class FileRemoved(object):
+    """
+    Condition for a file dropped to mount point to be consumed by the device
+    """
+    def __init__(self, mount_point, filename):
+        self.paths = [mount_point]
+        self.mount_point = mount_point
+        self.filename = filename.lower()
+
+    def check(self):
+        """
+        :return: WATCH_DONE when file has left a responsive mount point,
+                 WATCH_FAILED when file has left and a fault file appeared,
+                 None when outcome is not known yet
+        """
+        names = list_mount_point(self.mount_point)
+        if names is None:
+            return None
+        names = [name.lower() for name in names]
+        if self.filename in names:
+            return None
+        for fault_file in FAULT_FILES:
+            if fault_file in names:
+                return WATCH_FAILED
+        for name in names:
+            if name.endswith('.htm'):
+                return WATCH_DONE
+        return None
+
+
+class MountVanished(object):
+    """
+    Condition for mount point to disappear from the system
+    """
+    def __init__(self, mount_point):
+        self.paths = [mount_point]
+        self.mount_point = mount_point
+
+    def check(self):
+        """
+        :return: WATCH_DONE when mount point is not accessible or is empty,
+                 otherwise None
+        """
+        if not list_mount_point(self.mount_point):
+            return WATCH_DONE
+        return None
+
+
+class MountReturned(object):
+    """
+    Condition for mount point to be back with device contents
+    """
+    def __init__(self, mount_point):
+        self.paths = [mount_point]
+        self.mount_point = mount_point
+
+    def check(self):
+        """
+        :return: WATCH_DONE when mount point lists device .htm file, otherwise None
+        """
+        for name in list_mount_point(self.mount_point) or []:
+            if name.lower().endswith('.htm'):
+                return WATCH_DONE
+        return None
+
+
+class AnyCondition(object):
+    """
+    Condition which is met when any of given conditions is met
+    """
+    def __init__(self, *conditions):
+        self.conditions = conditions
+        self.paths = []
+        for condition in conditions:
+            self.paths.extend(condition.paths)
+
+    def check(self):
+        """
+        :return: outcome of first met condition, None if none is met
+        """
+        for condition in self.conditions:
+            result = condition.check()
+            if result is not None:
+                return result
+        return None
+
+
+class PollingWatcher(object):
+    """
+    Watcher which polls conditions in process without forking
+    """
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, poll_interval=None):
+        self.poll_interval = poll_interval if poll_interval else self.POLL_INTERVAL
+        self._wakeup = Event()
+
+    # paths are used by event based watchers
+    # pylint: disable=unused-argument
+    def wait_for_event(self, paths, timeout):
+        """
+        Block until something may have changed in paths
+        :param paths: paths to watch
+        :param timeout: maximum time to block in seconds
+        """
+        self._wakeup.wait(max(0, min(timeout, self.poll_interval)))
+        self._wakeup.clear()
+
+    def wakeup(self):
+        """
+        Interrupt wait_for_event from another thread
+        """
+        self._wakeup.set()
+
+    def wait(self, condition, timeout):
+        """
+        Wait until condition outcome is known
+        :param condition: condition object with paths and check()
+        :param timeout: timeout in seconds
+        :return: outcome of condition, None if timed out
+        """
+        deadline = time() + timeout
+        while True:
+            result = condition.check()
+            if result is not None:
+                return result
+            remaining = deadline - time()
+            if remaining <= 0:
+                return None
+            self.wait_for_event(condition.paths, remaining)
+
+    def close(self):
+        """
+        Release watcher resources
+        """
+
+
+class InotifyWatcher(PollingWatcher):
+    """
+    Linux watcher which wakes up on inotify events of watched directories
+    and on mount table changes, conditions are re-checked on every wake up.
+    """
+    MAX_EVENT_WAIT = 1.0
+    _libc = None
+
+    def __init__(self, poll_interval=None):
+        super(InotifyWatcher, self).__init__(poll_interval)
+        libc = InotifyWatcher._get_libc()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        self._wakeup_pipe = os.pipe()
+        self._poller = select.poll()
+        self._poller.register(self._fd, select.POLLIN)
+        self._poller.register(self._wakeup_pipe[0], select.POLLIN)
+        try:
+            self._mounts = os.open('/proc/self/mounts', os.O_RDONLY)
+            self._poller.register(self._mounts, select.POLLPRI | select.POLLERR)
+        except OSError:
+            self._mounts = None
+
+    @staticmethod
+    def _get_libc():
+        """
+        :return: libc handle with inotify functions
+        """
+        if InotifyWatcher._libc is None:
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            InotifyWatcher._libc = libc
+        return InotifyWatcher._libc
+
+    @staticmethod
+    def is_available():
+        """
+        :return: True if inotify can be used in this system
+        """
+        if platform.system() != 'Linux':
+            return False
+        try:
+            return hasattr(InotifyWatcher._get_libc(), 'inotify_init1')
+        except (OSError, AttributeError):
+            return False
+
+    def _update_watches(self, paths):
+        """
+        Watch paths and their parent directories, directories which do not
+        exist are retried on next wake up. Watches no longer needed are removed.
+        """
+        watched = set()
+        for path in paths:
+            watched.add(os.path.abspath(path))
+            watched.add(os.path.dirname(os.path.abspath(path)))
+        for path in list(self._watches):
+            if path not in watched:
+                InotifyWatcher._get_libc().inotify_rm_watch(self._fd, self._watches.pop(path))
+        for path in watched:
+            if path in self._watches:
+                continue
+            encoded = path.encode('utf-8') if not isinstance(path, bytes) else path
+            wd = InotifyWatcher._get_libc().inotify_add_watch(self._fd, encoded, IN_WATCH_MASK)
+            if wd >= 0:
+                self._watches[path] = wd
+
+    def _drain_events(self):
+        """
+        Read pending inotify events and forget removed watches
+        """
+        removed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset + INOTIFY_EVENT.size <= len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                if mask & IN_IGNORED:
+                    removed.add(wd)
+                offset += INOTIFY_EVENT.size + length
+        if removed:
+            for path, wd in list(self._watches.items()):
+                if wd in removed:
+                    del self._watches[path]
+
+    def wait_for_event(self, paths, timeout):
+        """
+        Block until an inotify event or mount table change happens
+        :param paths: paths to watch
+        :param timeout: maximum time to block in seconds
+        """
+        self._update_watches(paths)
+        timeout = max(0, min(timeout, self.MAX_EVENT_WAIT))
+        events = self._poller.poll(int(timeout * 1000))
+        for descriptor, _ in events:
+            if descriptor == self._fd:
+                self._drain_events()
+            elif descriptor == self._wakeup_pipe[0]:
+                os.read(self._wakeup_pipe[0], 512)
+
+    def wakeup(self):
+        """
+        Interrupt wait_for_event from another thread
+        """
+        os.write(self._wakeup_pipe[1], b'x')
+
+    def close(self):
+        """
+        Close inotify and mount table descriptors
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._mounts is not None:
+            os.close(self._mounts)
+            self._mounts = None
+        if self._wakeup_pipe is not None:
+            os.close(self._wakeup_pipe[0])
+            os.close(self._wakeup_pipe[1])
+            self._wakeup_pipe = None
+
+
+def create_watcher():
+    """
+    :return: event based watcher when inotify is available, polling watcher otherwise
+    """
+    if InotifyWatcher.is_available():
+        try:
+            return InotifyWatcher()
+        except OSError:
+            pass
+    return PollingWatcher()
+
+
+class MountReactor(object):
+    """
+    Single thread which resolves mount point conditions of many devices.
+    Conditions are checked in one scan loop and the reactor sleeps on one
+    watcher until any of the watched paths or the mount table changes.
+    The thread is started on demand and exits when nothing is pending.
+    """
+    def __init__(self, watcher_factory=create_watcher):
+        self._watcher_factory = watcher_factory
+        self._lock = Lock()
+        self._pending = []
+        self._thread = None
+        self._watcher = None
+
+    def watch(self, condition, timeout):
+        """
+        Register condition to be resolved
+        :param condition: condition object with paths and check()
+        :param timeout: timeout in seconds
+        :return: Future resolving to outcome of condition, None if timed out
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((condition, time() + timeout, future))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='mount-reactor')
+                self._thread.daemon = True
+                self._thread.start()
+            elif self._watcher is not None:
+                self._watcher.wakeup()
+        return future
+
+    def watch_file_removed(self, mount_point, filename, timeout):
+        """
+        :return: Future for file dropped to mount point to be consumed
+        """
+        return self.watch(FileRemoved(mount_point, filename), timeout)
+
+    def watch_mount_vanished(self, mount_point, timeout):
+        """
+        :return: Future for mount point to disappear
+        """
+        return self.watch(MountVanished(mount_point), timeout)
+
+    def watch_mount_returned(self, mount_point, timeout):
+        """
+        :return: Future for mount point to come back
+        """
+        return self.watch(MountReturned(mount_point), timeout)
+
+    def pending_count(self):
+        """
+        :return: amount of unresolved conditions
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def _scan(self):
+        """
+        Check all pending conditions once and resolve finished ones
+        :return: list of pending items still unresolved
+        """
+        with self._lock:
+            pending = list(self._pending)
+        now = time()
+        resolved = []
+        for item in pending:
+            condition, deadline, future = item
+            try:
+                result = condition.check()
+            # errors are delivered to the waiting thread
+            # pylint: disable=broad-except
+            except Exception as err:
+                resolved.append(item)
+                future.set_exception(err)
+                continue
+            if result is not None or now >= deadline:
+                resolved.append(item)
+                future.set_result(result)
+        with self._lock:
+            for item in resolved:
+                self._pending.remove(item)
+            return list(self._pending)
+
+    def _run(self):
+        """
+        Reactor loop
+        """
+        watcher = self._watcher_factory()
+        with self._lock:
+            self._watcher = watcher
+        try:
+            while True:
+                self._scan()
+                with self._lock:
+                    if not self._pending:
+                        self._thread = None
+                        self._watcher = None
+                        return
+                    # conditions may have been added after the scan
+                    pending = list(self._pending)
+                paths = []
+                for condition, _, _ in pending:
+                    paths.extend(condition.paths)
+                timeout = min(deadline for _, deadline, _ in pending) - time()
+                watcher.wait_for_event(paths, max(0, timeout))
+        # waiting threads must not hang if the watcher breaks
+        # pylint: disable=broad-except
+        except Exception as err:
+            with self._lock:
+                failed, self._pending = self._pending, []
+                self._thread = None
+                self._watcher = None
+            for _, _, future in failed:
+                future.set_exception(err)
+        finally:
+            watcher.close()
+
+
+_REACTOR = MountReactor()
+
+
+def get_reactor():
+    """
+    :return: process wide mount reactor
+    """
+    return _REACTOR
+
+
+def wait_for(condition, timeout):
+    """
+    Wait condition using the process wide mount reactor
+    :param condition: condition object with paths and check()
+    :param timeout: timeout in seconds
+    :return: outcome of condition, None if timed out
+    """
+    return get_reactor().watch(condition, timeout).result()
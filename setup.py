@@ -15,6 +15,7 @@ limitations under the License.
 """
 
 import os
+import re
 # pylint: disable=E0611,F0401
 #         No name 'core' in module 'distutils'
 #         Unable to import 'distutils.core'
@@ -36,8 +37,17 @@ def read(fname):
     """
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
 
+
+def get_version():
+    """
+    read __version__ from package without importing it
+    """
+    init = read(os.path.join('mbed_flasher', '__init__.py'))
+    match = re.search(r"^__version__ = '([^']+)'", init, re.MULTILINE)
+    return match.group(1)
+
 setup(name='mbed-flasher',
-      version='0.5.0',
+      version=get_version(),
       description=DESCRIPTION,
       long_description=read('README.md'),
       author=OWNER_NAMES,
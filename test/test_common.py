@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import mock
+from mbed_flasher.common import Future, MountVerifier, parse_mountinfo, run_parallel
+
+TARGET_ID = '0240000028884e450019700f6bf0000f8021000097969900'
+MOUNTINFO = (
+    "25 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw\n"
+    "36 25 8:16 / /media/user/DAPLINK\\0401 rw,nosuid shared:20 - vfat /dev/sdb rw,fmask=0022\n"
+)
+
+
+class RunParallelTestCase(unittest.TestCase):
+    def test_sequential_keeps_order(self):
+        self.assertEqual(run_parallel(lambda item: item * 2, [1, 2, 3]), [2, 4, 6])
+
+    def test_parallel_keeps_order(self):
+        def slow_double(item):
+            time.sleep(0.01 * (5 - item))
+            return item * 2
+        self.assertEqual(run_parallel(slow_double, range(5), max_workers=5),
+                         [0, 2, 4, 6, 8])
+
+    def test_parallel_is_bounded(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def task(_):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+
+        run_parallel(task, range(10), max_workers=3)
+        self.assertLessEqual(state['peak'], 3)
+        self.assertGreater(state['peak'], 1)
+
+    def test_parallel_raises_worker_error(self):
+        def task(item):
+            if item == 2:
+                raise IOError("failed")
+            return item
+
+        with self.assertRaises(IOError):
+            run_parallel(task, range(4), max_workers=2)
+
+
+class FutureTestCase(unittest.TestCase):
+    def test_result_from_other_thread(self):
+        future = Future()
+        threading.Timer(0.1, future.set_result, [5]).start()
+        self.assertEqual(future.result(), 5)
+        self.assertTrue(future.done())
+
+    def test_exception_and_callback(self):
+        future = Future()
+        called = []
+        future.add_done_callback(called.append)
+        future.set_exception(IOError("failed"))
+        self.assertEqual(called, [future])
+        with self.assertRaises(IOError):
+            future.result()
+
+    def test_result_timeout(self):
+        with self.assertRaises(RuntimeError):
+            Future().result(timeout=0.1)
+
+
+class ParseMountinfoTestCase(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_mountinfo(MOUNTINFO + "garbage\n"),
+                         [('/dev/sda1', '/', 'ext4'),
+                          ('/dev/sdb', '/media/user/DAPLINK 1', 'vfat')])
+
+
+@unittest.skipUnless(hasattr(os, 'symlink'), 'requires symbolic links')
+@mock.patch('mbed_flasher.common.platform.system', return_value='Linux')
+class MountVerifierTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for directory in ['dev/serial/by-id', 'dev/disk/by-id', 'proc/self']:
+            os.makedirs(os.path.join(self.root, directory))
+        self.verifier = MountVerifier(logging.getLogger('mbed-flasher'), root=self.root)
+        self.target = {'target_id': TARGET_ID, 'serial_port': '/dev/ttyACM0',
+                       'mount_point': '/media/user/DAPLINK'}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def link(self, directory, name, device):
+        os.symlink('../../' + device, os.path.join(self.root, directory, name))
+
+    def link_serial(self, device, suffix=''):
+        self.link('dev/serial/by-id', 'usb-ARM_DAPLink_CMSIS-DAP_%s%s-if01' % (
+            TARGET_ID, suffix), device)
+
+    def link_disk(self, device, suffix=''):
+        self.link('dev/disk/by-id', 'usb-MBED_VFS_%s%s-0:0' % (TARGET_ID, suffix), device)
+
+    def write_mountinfo(self, text=MOUNTINFO):
+        with open(os.path.join(self.root, 'proc/self/mountinfo'), 'w') as mountinfo:
+            mountinfo.write(text)
+
+    def test_changed_points_resolved(self, _):
+        self.link_serial('ttyACM3')
+        self.link_disk('sdb')
+        self.link('dev/disk/by-id', 'ata-SSD_1234', 'sda')
+        self.write_mountinfo()
+        self.assertEqual(self.verifier.check_points_unchanged(self.target),
+                         {'target_id': TARGET_ID, 'serial_port': '/dev/ttyACM3',
+                          'dev_point': '/dev/sdb', 'mount_point': '/media/user/DAPLINK 1'})
+
+    def test_unchanged_serial_port(self, _):
+        self.link_serial('ttyACM0')
+        self.link_disk('sdb')
+        self.write_mountinfo()
+        new_target = self.verifier.check_points_unchanged(self.target)
+        self.assertNotIn('serial_port', new_target)
+        self.assertEqual(new_target['dev_point'], '/dev/sdb')
+
+    def test_no_devices(self, _):
+        shutil.rmtree(os.path.join(self.root, 'dev'))
+        self.assertIs(self.verifier.check_points_unchanged(self.target), self.target)
+
+    def test_duplicates(self, _):
+        self.link_serial('ttyACM1')
+        self.link_serial('ttyACM2', suffix='-2')
+        self.assertEqual(self.verifier.check_points_unchanged(self.target), -10)
+        shutil.rmtree(os.path.join(self.root, 'dev/serial/by-id'))
+        self.link_disk('sdb')
+        self.link_disk('sdc', suffix='-2')
+        self.assertEqual(self.verifier.check_points_unchanged(self.target), -11)
+
+    def test_missing_disk(self, _):
+        self.link_serial('ttyACM1')
+        self.assertEqual(self.verifier.check_points_unchanged(self.target), -12)
+
+    @mock.patch('mbed_flasher.common.sleep')
+    def test_mount_appears_later(self, mock_sleep, _):
+        self.link_disk('sdb')
+        self.write_mountinfo(MOUNTINFO.splitlines(True)[0])
+        mock_sleep.side_effect = lambda _: self.write_mountinfo()
+        new_target = self.verifier.check_points_unchanged(self.target)
+        self.assertEqual(new_target['mount_point'], '/media/user/DAPLINK 1')
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    @mock.patch('mbed_flasher.common.MountVerifier.MOUNT_POINT_TIMEOUT', 0)
+    def test_mount_does_not_appear(self, _):
+        self.link_disk('sdb')
+        self.assertEqual(self.verifier.check_points_unchanged(self.target), -12)
+
+    @mock.patch('mbed_flasher.common.MountVerifier.MOUNT_POINT_TIMEOUT', 0)
+    def test_only_vfat_mounts_verify(self, _):
+        self.link_disk('sdb')
+        self.write_mountinfo("40 25 8:16 / /tmp/DAPLINK rw - tmpfs /dev/sdb rw\n")
+        self.assertEqual(self.verifier.check_points_unchanged(self.target), -12)
+        # bind mount listed after the mount of the disk
+        self.write_mountinfo(MOUNTINFO + "41 25 8:16 /dir /mnt/bind rw - vfat /dev/sdb rw\n")
+        self.assertEqual(self.verifier.check_points_unchanged(self.target)['mount_point'],
+                         '/media/user/DAPLINK 1')
+
+    def target_of(self, index):
+        target_id = TARGET_ID[:-1] + str(index)
+        os.symlink('../../sd%s' % 'bcde'[index],
+                   os.path.join(self.root, 'dev/disk/by-id/usb-MBED_VFS_%s-0:0' % target_id))
+        return {'target_id': target_id, 'serial_port': '/dev/ttyACM%i' % index,
+                'mount_point': '/media/user/DAPLINK%i' % index}
+
+    def mount(self, indexes):
+        self.write_mountinfo(''.join(
+            "%i 25 8:%i / /media/user/NEW%i rw - vfat /dev/sd%s rw\n" % (
+                30 + index, index, index, 'bcde'[index]) for index in indexes))
+
+    @mock.patch('mbed_flasher.common.sleep')
+    def test_batch_retires_targets_as_mounts_appear(self, mock_sleep, _):
+        targets = [self.target_of(index) for index in range(3)]
+        rounds = [[1], [1, 0], [1, 0, 2]]
+        self.mount(rounds.pop(0))
+        mock_sleep.side_effect = lambda _: self.mount(rounds.pop(0))
+        with mock.patch.object(self.verifier, 'read_links',
+                               wraps=self.verifier.read_links) as links, \
+                mock.patch.object(self.verifier, 'read_mounts',
+                                  wraps=self.verifier.read_mounts) as mounts:
+            results = self.verifier.check_targets(targets)
+        self.assertEqual([result['mount_point'] for result in results],
+                         ['/media/user/NEW0', '/media/user/NEW1', '/media/user/NEW2'])
+        self.assertEqual(links.call_count, 1)
+        self.assertEqual(mounts.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    def test_concurrent_verifications_share_rounds(self, _):
+        targets = [self.target_of(index) for index in range(4)]
+        threading.Timer(0.3, self.mount, [range(4)]).start()
+        with mock.patch.object(self.verifier, 'read_mounts',
+                               wraps=self.verifier.read_mounts) as mounts:
+            results = run_parallel(self.verifier.check_points_unchanged, targets,
+                                   max_workers=4)
+        self.assertEqual([result['mount_point'] for result in results],
+                         ['/media/user/NEW%i' % index for index in range(4)])
+        # polled every 0.25 seconds, separate verifications would read 4 times per round
+        self.assertLess(mounts.call_count, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import mock
+from mbed_flasher.common import run_parallel
+from mbed_flasher.daemon import DaemonServer, FlashDaemon, send_request, \
+    EXIT_CODE_DAEMON_UNAVAILABLE, EXIT_CODE_INVALID_REQUEST, EXIT_CODE_COULD_NOT_MAP_DEVICE, \
+    EXIT_CODE_FILE_MISSING, EXIT_CODE_NO_TARGET_ID
+from mbed_flasher.devices import DeviceCache
+from mbed_flasher.main import FlasherCLI
+
+TARGET_IDS = ['0240000028884e450019700f6bf0000f8021000097969900',
+              '0240000028884e450019700f6bf0000f8021000097969901']
+
+
+class FakeFlasher(object):
+    @staticmethod
+    def get_available_devices():
+        return [{'target_id': target_id, 'platform_name': 'K64F',
+                 'mount_point': '/mnt/DAPLINK', 'serial_port': '/dev/ttyACM0'}
+                for target_id in TARGET_IDS]
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'requires unix domain sockets')
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'mbedflash.sock')
+        self.device_cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        self.daemon = FlashDaemon(device_cache=self.device_cache, platform_db=mock.Mock())
+        self.server = DaemonServer(self.socket_path, self.daemon)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.daemon.scheduler.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def request(self, **request):
+        return send_request(request, socket_path=self.socket_path)
+
+    @mock.patch('mbed_flasher.reset.Reset.reset', return_value=0)
+    def test_ping_and_stats(self, _):
+        self.assertEqual(self.request(command='ping'), {'retcode': 0})
+        self.request(command='reset', tid=['0240'])
+        self.request(command='reset', tid=['0240'])
+        stats = self.request(command='stats')['results']
+        self.assertEqual(stats['devices'], {'hits': 1, 'misses': 1})
+        self.assertEqual(stats['scheduler']['completed'], 4)
+
+    def test_invalid_request(self):
+        self.assertEqual(self.request(command='format')['retcode'], EXIT_CODE_INVALID_REQUEST)
+
+    def test_argument_errors(self):
+        self.assertEqual(self.request(command='reset')['retcode'], EXIT_CODE_NO_TARGET_ID)
+        self.assertEqual(self.request(command='reset', tid=['9999'])['retcode'],
+                         EXIT_CODE_COULD_NOT_MAP_DEVICE)
+        self.assertEqual(self.request(command='flash', input='missing.bin',
+                                      tid=['0240'])['retcode'], EXIT_CODE_FILE_MISSING)
+
+    @mock.patch('mbed_flasher.reset.Reset.reset')
+    def test_reset_resolves_prefix(self, mock_reset):
+        mock_reset.return_value = 0
+        response = self.request(command='reset', tid=['0240'])
+        self.assertEqual(response, {'retcode': 0, 'results': {TARGET_IDS[0]: 0, TARGET_IDS[1]: 0}})
+        self.assertEqual(sorted(call[1]['target_id'] for call in mock_reset.call_args_list),
+                         TARGET_IDS)
+
+    @mock.patch('mbed_flasher.reset.Reset.reset')
+    def test_first_failure_is_returned(self, mock_reset):
+        mock_reset.side_effect = lambda target_id, method: 0 if target_id == TARGET_IDS[0] else 5
+        response = self.request(command='reset', tid=['all'])
+        self.assertEqual(response['retcode'], 5)
+        self.assertEqual(response['results'], {TARGET_IDS[0]: 0, TARGET_IDS[1]: 5})
+
+    @mock.patch('mbed_flasher.flash.Flash.flash')
+    def test_flash_uses_warm_device_cache(self, mock_flash):
+        mock_flash.return_value = 0
+        build = os.path.join(self.tmp_dir, 'image.bin')
+        with open(build, 'wb') as image:
+            image.write(b'\x00' * 16)
+        self.daemon.warm_up()
+        for _ in range(3):
+            self.assertEqual(self.request(command='flash', input=build, tid=[TARGET_IDS[0]],
+                                          method='simple')['retcode'], 0)
+        self.assertEqual(self.device_cache.stats()['misses'], 1)
+        self.assertEqual(mock_flash.call_args[1]['target_id'], TARGET_IDS[0])
+        self.assertEqual(mock_flash.call_args[1]['platform_name'], 'K64F')
+
+    @mock.patch('mbed_flasher.reset.Reset.reset')
+    def test_same_device_serialized_other_devices_concurrent(self, mock_reset):
+        active = {}
+        overlaps = []
+        lock = threading.Lock()
+
+        def reset(target_id, method):
+            # pylint: disable=unused-argument
+            with lock:
+                if active.get(target_id):
+                    overlaps.append(target_id)
+                active[target_id] = True
+                overlaps.append(len([tid for tid in active if active[tid]]))
+            time.sleep(0.1)
+            with lock:
+                active[target_id] = False
+            return 0
+        mock_reset.side_effect = reset
+        requests = [TARGET_IDS[0], TARGET_IDS[0], TARGET_IDS[1]]
+        run_parallel(lambda tid: self.request(command='reset', tid=[tid]),
+                     requests, max_workers=3)
+        self.assertNotIn(TARGET_IDS[0], overlaps)
+        self.assertIn(2, overlaps)
+
+    @mock.patch('mbed_flasher.reset.Reset.reset')
+    def test_parallel_bounds_devices(self, mock_reset):
+        active = []
+        most = []
+        lock = threading.Lock()
+
+        def reset(target_id, method):
+            # pylint: disable=unused-argument
+            with lock:
+                active.append(target_id)
+                most.append(len(active))
+            time.sleep(0.1)
+            with lock:
+                active.remove(target_id)
+            return 0
+        mock_reset.side_effect = reset
+        response = self.request(command='reset', tid=['all'], parallel=1)
+        self.assertEqual(response['retcode'], 0)
+        self.assertEqual(max(most), 1)
+        self.request(command='reset', tid=['all'], parallel=2)
+        self.assertEqual(max(most), 2)
+
+    @mock.patch('mbed_flasher.main.logging')
+    @mock.patch('mbed_flasher.reset.Reset.reset')
+    def test_client_command(self, mock_reset, _):
+        mock_reset.return_value = 0
+        cli = FlasherCLI(['client', '--socket', self.socket_path,
+                          'reset', '--tid', TARGET_IDS[1]])
+        self.assertEqual(cli.execute(), 0)
+        mock_reset.assert_called_once_with(target_id=TARGET_IDS[1], method='simple')
+
+
+class ClientTestCase(unittest.TestCase):
+    def test_unreachable_daemon(self):
+        response = send_request({'command': 'ping'},
+                                socket_path=os.path.join(tempfile.gettempdir(), 'missing.sock'))
+        self.assertEqual(response['retcode'], EXIT_CODE_DAEMON_UNAVAILABLE)
+
+
+if __name__ == '__main__':
+    unittest.main()
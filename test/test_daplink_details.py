@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from mbed_flasher.daplink_details import DaplinkDetails, DetailsCache
+from mbed_flasher.erase import Erase
+from mbed_flasher.reset import Reset, EXIT_CODE_SERIAL_RESET_NOT_SUPPORTED
+
+DETAILS = b"""# DAPLink Firmware - see https://mbed.com/daplink
+Unique ID: 0240000028884e450019700f6bf0000f8021000097969900
+HIC ID: 97969900
+Auto Reset: 1
+Automation allowed: 1
+Overflow detection: 0
+Daplink Mode: Interface
+Interface Version: 0244
+Bootloader Version: 0242
+Git SHA: 34182e2cce4ca99073443ef29bbbbf5e9e0c4dc9
+Local Mods: 0
+USB Interfaces: MSD, CDC, HID
+Bootloader CRC: 0xb92403e6
+Interface CRC: 0x434eddd1
+Remount count: 3
+URL: https://mbed.org/device/?code=0240000028884e450019700f6bf0000f8021000097969900
+"""
+
+OLD_DETAILS = b"""Version: 0226
+Build:   Aug 24 2015 17:06:30
+"""
+
+
+class DaplinkDetailsTestCase(unittest.TestCase):
+    def test_parse(self):
+        details = DaplinkDetails.parse(DETAILS)
+        self.assertEqual(details.unique_id, '0240000028884e450019700f6bf0000f8021000097969900')
+        self.assertEqual(details.hic_id, '97969900')
+        self.assertEqual(details.interface_version, 244)
+        self.assertEqual(details.bootloader_version, 242)
+        self.assertTrue(details.automation_allowed)
+        self.assertTrue(details.auto_reset)
+        self.assertFalse(details.overflow_detection)
+        self.assertEqual(details.mode, 'interface')
+        self.assertEqual(details.remount_count, 3)
+        self.assertEqual(details.usb_interfaces, ['MSD', 'CDC', 'HID'])
+        self.assertFalse(details.in_bootloader)
+        self.assertTrue(details.supports_erase)
+        self.assertTrue(details.supports_serial_reset)
+        self.assertTrue(details.fields['url'].startswith('https://mbed.org'))
+
+    def test_parse_old_firmware(self):
+        details = DaplinkDetails.parse(OLD_DETAILS)
+        self.assertEqual(details.interface_version, 226)
+        self.assertIsNone(details.auto_reset)
+        self.assertIsNone(details.mode)
+        self.assertFalse(details.automation_allowed)
+        self.assertFalse(details.supports_erase)
+        self.assertTrue(details.supports_serial_reset)
+
+    def test_capabilities(self):
+        details = DaplinkDetails.parse(DETAILS.replace(b'0244', b'0241')
+                                       .replace(b'Interface\n', b'Bootloader\n')
+                                       .replace(b'MSD, CDC, HID', b'MSD, HID'))
+        self.assertFalse(details.supports_erase)
+        self.assertTrue(details.in_bootloader)
+        self.assertFalse(details.supports_serial_reset)
+
+
+class DetailsCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mount_point = tempfile.mkdtemp()
+        self.path = os.path.join(self.mount_point, 'DETAILS.TXT')
+        self.write(DETAILS)
+        self.target = {'target_id': '0240', 'mount_point': self.mount_point}
+
+    def tearDown(self):
+        shutil.rmtree(self.mount_point)
+
+    def write(self, data, mtime=None):
+        with open(self.path, 'wb') as details_file:
+            details_file.write(data)
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_cached_until_file_changes(self):
+        cache = DetailsCache()
+        details = cache.get(self.target)
+        self.assertIs(cache.get(self.target), details)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1})
+        self.write(DETAILS.replace(b'Remount count: 3', b'Remount count: 4'),
+                   mtime=os.stat(self.path).st_mtime + 10)
+        self.assertEqual(cache.get(self.target).remount_count, 4)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2})
+
+    def test_invalidate(self):
+        cache = DetailsCache()
+        details = cache.get(self.target)
+        cache.invalidate('0240')
+        self.assertIsNot(cache.get(self.target), details)
+        cache.invalidate()
+        cache.get(self.target)
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 3})
+
+    def test_missing_file(self):
+        cache = DetailsCache()
+        os.remove(self.path)
+        self.assertIsNone(cache.get(self.target))
+        self.assertIsNone(cache.get({'target_id': '0240'}))
+
+
+class DetailsUsageTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.mount_point = tempfile.mkdtemp()
+        self.target = {'target_id': '0240', 'platform_name': 'K64F',
+                       'mount_point': self.mount_point, 'serial_port': '/dev/ttyACM0'}
+
+    def tearDown(self):
+        shutil.rmtree(self.mount_point)
+
+    def write(self, data):
+        with open(os.path.join(self.mount_point, 'DETAILS.TXT'), 'wb') as details_file:
+            details_file.write(data)
+
+    def test_erase_rejected_before_remount(self):
+        self.write(DETAILS.replace(b'0244', b'0242'))
+        eraser = Erase(details_cache=DetailsCache())
+        with mock.patch.object(eraser, 'wait_to_disappear') as mock_wait:
+            self.assertEqual(eraser.erase_board(self.target, no_reset=True), 31)
+        mock_wait.assert_not_called()
+        self.assertFalse(os.path.isfile(os.path.join(self.mount_point, 'ERASE.ACT')))
+
+    def test_serial_reset_rejected_without_serial_port(self):
+        self.write(DETAILS.replace(b'MSD, CDC, HID', b'MSD, HID'))
+        resetter = Reset(details_cache=DetailsCache())
+        with mock.patch.object(resetter, 'reset_board') as mock_reset:
+            self.assertEqual(resetter.reset_serial(self.target),
+                             EXIT_CODE_SERIAL_RESET_NOT_SUPPORTED)
+        mock_reset.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
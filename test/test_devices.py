@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import os
+import time
+import unittest
+import mock
+from mbed_flasher.common import run_parallel
+from mbed_flasher.devices import DeviceCache, DeviceIndex
+from mbed_flasher.erase import Erase
+from mbed_flasher.flash import Flash
+from mbed_flasher.main import FlasherCLI
+from mbed_flasher.reset import Reset
+
+TARGET_ID = '0240000028884e450019700f6bf0000f8021000097969900'
+
+
+class FakeFlasher(object):
+    scans = 0
+
+    @staticmethod
+    def get_available_devices():
+        FakeFlasher.scans += 1
+        time.sleep(0.01)
+        return [{'target_id': TARGET_ID, 'platform_name': 'K64F',
+                 'mount_point': '/mnt/DAPLINK', 'serial_port': '/dev/ttyACM0'}]
+
+
+class DeviceCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        FakeFlasher.scans = 0
+
+    def test_scan_reused_within_ttl(self):
+        cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        self.assertEqual(cache.get_devices(), cache.get_devices())
+        self.assertEqual(FakeFlasher.scans, 1)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_ttl_expires(self):
+        cache = DeviceCache(ttl=0, flashers=[FakeFlasher])
+        cache.get_devices()
+        cache.get_devices()
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 2})
+
+    def test_invalidate_and_refresh(self):
+        cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        cache.get_devices()
+        cache.invalidate()
+        cache.get_devices()
+        cache.get_devices(refresh=True)
+        self.assertEqual(FakeFlasher.scans, 3)
+
+    def test_flasher_of_device(self):
+        cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        self.assertIsNone(cache.get_flasher(TARGET_ID))
+        cache.get_devices()
+        cache.invalidate()
+        self.assertIs(cache.get_flasher(TARGET_ID), FakeFlasher)
+        self.assertIsNone(cache.get_flasher('1100'))
+
+    def test_returned_devices_are_copies(self):
+        cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        cache.get_devices()[0]['mount_point'] = 'changed'
+        self.assertEqual(cache.get_devices()[0]['mount_point'], '/mnt/DAPLINK')
+
+    def test_concurrent_callers_share_scan(self):
+        cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        run_parallel(lambda _: cache.get_devices(), range(8), max_workers=8)
+        self.assertEqual(FakeFlasher.scans, 1)
+
+    @mock.patch('mbed_flasher.main.logging')
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.flash')
+    def test_flash_command_scans_once(self, mock_flash, _):
+        mock_flash.return_value = 0
+        cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        bin_path = os.path.join('test', 'helloworld.bin')
+        with mock.patch('mbed_flasher.devices._DEVICE_CACHE', cache):
+            fcli = FlasherCLI(["flash", "-i", bin_path, "--tid", TARGET_ID[:10], "-t", "K64F"])
+            self.assertEqual(fcli.execute(), 0)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(mock_flash.call_count, 1)
+
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.flash')
+    def test_flash_invalidates(self, mock_flash):
+        mock_flash.return_value = 0
+        cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        flasher = Flash(device_cache=cache)
+        flasher.flash(build=os.path.join('test', 'helloworld.bin'), target_id=TARGET_ID)
+        flasher.get_available_device_mapping()
+        self.assertEqual(cache.misses, 2)
+
+
+
+class DeviceIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.devices = [
+            {'target_id': '0240000001', 'platform_name': 'K64F'},
+            {'target_id': '1100000001', 'platform_name': 'NRF51_DK'},
+            {'target_id': '0240000002', 'platform_name': 'K64F'},
+            {'target_id': '02400000020', 'platform_name': 'K64F'},
+            {'target_id': '0241000001', 'platform_name': 'K64F'}]
+        self.index = DeviceIndex(self.devices)
+
+    def _ids(self, devices):
+        return [device['target_id'] for device in devices]
+
+    def test_exact(self):
+        self.assertIs(self.index.get('0240000002'), self.devices[2])
+        self.assertIsNone(self.index.get('024'))
+        # exact target_ids keep the given order, as before DeviceIndex
+        self.assertEqual(self._ids(self.index.match(['0240000002', '024', '0240000001',
+                                                     '0240000002'])),
+                         ['0240000002', '0240000001'])
+
+    def test_prefix_in_enumeration_order(self):
+        self.assertEqual(self._ids(self.index.with_prefix('02400')),
+                         ['0240000001', '0240000002', '02400000020'])
+        self.assertEqual(self._ids(self.index.match(['0240000002', '024', '11'], prefix=True)),
+                         ['0240000001', '1100000001', '0240000002', '02400000020',
+                          '0241000001'])
+        self.assertEqual(self.index.with_prefix('9'), [])
+
+    def test_platforms(self):
+        self.assertEqual(self.index.platforms, ['K64F', 'NRF51_DK'])
+        self.assertEqual(self._ids(self.index.by_platform('NRF51_DK')), ['1100000001'])
+        self.assertEqual(self._ids(self.index.match('0', platform_name='NRF51_DK',
+                                                    prefix=True)), [])
+
+    def test_select(self):
+        self.assertEqual(len(self.index.select('all')), 5)
+        self.assertEqual(self._ids(self.index.select('0241')), ['0241000001'])
+        self.assertEqual(self._ids(self.index.select(['1100000001', '0240000001'])),
+                         ['1100000001', '0240000001'])
+        self.assertEqual(self.index.select('0' * 49), [])
+
+    def test_call_sites_agree(self):
+        for prepare in [Erase.prepare_target_to_erase, Reset.prepare_target_to_reset]:
+            self.assertEqual(self._ids(prepare('02400', self.devices)),
+                             ['0240000001', '0240000002', '02400000020'])
+            self.assertEqual(self._ids(prepare(['0240000002'], self.devices)), ['0240000002'])
+            self.assertEqual(self._ids(prepare(['0241000001', '0240000001'], self.devices)),
+                             ['0241000001', '0240000001'])
+            self.assertEqual(len(prepare('all', self.index)), 5)
+        available_target_ids = []
+        platforms, target_ids = FlasherCLI.prepare_platforms_and_targets(
+            self.index, ['11', '0241'], available_target_ids)
+        self.assertEqual(platforms, ['NRF51_DK', 'K64F'])
+        self.assertEqual(target_ids, ['1100000001', '0241000001'])
+        self.assertEqual(available_target_ids, self.index.target_ids)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,11 @@ limitations under the License.
 # pylint:disable=missing-docstring
 
 import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 try:
     from StringIO import StringIO
@@ -26,7 +31,22 @@ except ImportError:
 from test.test_helper import Helper
 import mock
 import mbed_lstools
-from mbed_flasher.erase import Erase
+from mbed_flasher.daplink_details import DetailsCache
+from mbed_flasher.daplink_errors import EXIT_CODE_USER_ERROR
+from mbed_flasher.devices import DeviceCache
+from mbed_flasher.erase import Erase, EXIT_CODE_ERASE_FAILED
+from mbed_flasher.results import new_report
+from mbed_flasher.watcher import WATCH_DONE, WATCH_FAILED
+
+
+class FakeFlasher(object):
+    @staticmethod
+    def get_available_devices():
+        devices = [{'target_id': '024000%02i' % index, 'platform_name': 'K64F',
+                    'mount_point': '/mnt/DAPLINK%i' % index,
+                    'serial_port': '/dev/ttyACM%i' % index} for index in range(6)]
+        devices.append({'target_id': '02400099', 'platform_name': 'K64F'})
+        return devices
 
 
 class EraseTestCase(unittest.TestCase):
@@ -125,5 +145,113 @@ class EraseTestCase(unittest.TestCase):
     #    ret = eraser.erase(target_id='all', method='pyocd')
     #    self.assertEqual(ret, 0)
 
+class ParallelEraseTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.device_cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        self.eraser = Erase(device_cache=self.device_cache)
+        patcher = mock.patch.object(self.eraser, 'forget_fingerprint')
+        self.mock_forget = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parallel_erase_results(self):
+        lock = threading.Lock()
+        active = {'now': 0, 'max': 0}
+
+        def erase_board(target, no_reset, report=None):
+            # pylint: disable=unused-argument
+            with lock:
+                active['now'] += 1
+                active['max'] = max(active['max'], active['now'])
+            time.sleep(0.1)
+            with lock:
+                active['now'] -= 1
+            return 31 if target['target_id'] == '02400003' else 0
+
+        targets = ['024000%02i' % index for index in range(6)]
+        with mock.patch.object(self.eraser, 'erase_board', side_effect=erase_board):
+            start = time.time()
+            ret = self.eraser.erase(target_id=targets, method='simple', max_workers=3)
+            elapsed = time.time() - start
+        self.assertEqual(ret, 31)
+        self.assertEqual(active['max'], 3)
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(list(self.eraser.results), targets)
+        self.assertEqual([code for code in self.eraser.results.values() if code], [31])
+        self.assertTrue(all(elapsed >= 0.1 for elapsed in self.eraser.timings.values()))
+        self.assertEqual(self.mock_forget.call_count, 6)
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_device_without_serial_port_fails(self, _):
+        with mock.patch.object(self.eraser, 'erase_board', return_value=0):
+            ret = self.eraser.erase(target_id='all', method='simple')
+        self.assertEqual(ret, 21)
+        self.assertEqual(self.eraser.results['02400099'], 21)
+        self.assertEqual(self.eraser.results['02400000'], 0)
+
+    def test_pyocd_erases_every_device(self):
+        with mock.patch.object(self.eraser, 'erase_pyocd', return_value=0) as mock_erase:
+            ret = self.eraser.erase(target_id=['02400001', '02400002'], method='pyocd')
+        self.assertEqual(ret, 0)
+        self.assertEqual(mock_erase.call_count, 2)
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_unsupported_method(self, _):
+        with mock.patch.object(self.eraser, 'erase_board') as mock_erase:
+            self.assertEqual(self.eraser.erase(target_id='all', method='jtag'), 29)
+        mock_erase.assert_not_called()
+
+
+class EraseBoardTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.mount_point = tempfile.mkdtemp()
+        with open(os.path.join(self.mount_point, 'DETAILS.TXT'), 'w') as details:
+            details.write("Automation allowed: 1\nDaplink Mode: Interface\n"
+                          "Interface Version: 0244\n")
+        self.target = {'target_id': '02400000', 'platform_name': 'K64F',
+                       'mount_point': self.mount_point, 'serial_port': '/dev/ttyACM0'}
+        self.eraser = Erase(details_cache=DetailsCache())
+        for name in ['wait_to_disappear', 'reset_board']:
+            patcher = mock.patch.object(self.eraser, name, return_value=0)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('mbed_flasher.erase.MountVerifier')
+        patcher.start().return_value.check_points_unchanged.return_value = self.target
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.mount_point)
+
+    def test_fault_mapped_to_daplink_error(self):
+        with open(os.path.join(self.mount_point, 'FAIL.TXT'), 'w') as fault:
+            fault.write('The transfer timed out.')
+        report = new_report()
+        with mock.patch.object(self.eraser, 'runner', return_value=WATCH_FAILED):
+            ret = self.eraser.erase_board(self.target, no_reset=False, report=report)
+        self.assertEqual(ret, EXIT_CODE_USER_ERROR)
+        self.assertEqual(report['fault'], 'The transfer timed out.')
+        self.eraser.reset_board.assert_not_called()
+
+    def test_unknown_fault_fails(self):
+        with open(os.path.join(self.mount_point, 'FAIL.TXT'), 'w') as fault:
+            fault.write('Something new')
+        with mock.patch.object(self.eraser, 'runner', return_value=WATCH_FAILED):
+            ret = self.eraser.erase_board(self.target, no_reset=True)
+        self.assertEqual(ret, EXIT_CODE_ERASE_FAILED)
+
+    def test_timeout_fails(self):
+        with mock.patch.object(self.eraser, 'runner', return_value=None):
+            ret = self.eraser.erase_board(self.target, no_reset=False)
+        self.assertEqual(ret, EXIT_CODE_ERASE_FAILED)
+        self.eraser.reset_board.assert_not_called()
+
+    def test_success(self):
+        with mock.patch.object(self.eraser, 'runner', return_value=WATCH_DONE):
+            ret = self.eraser.erase_board(self.target, no_reset=False)
+        self.assertEqual(ret, 0)
+        self.eraser.reset_board.assert_called_once_with('/dev/ttyACM0')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from mbed_flasher.common import run_parallel
+from mbed_flasher.fingerprints import FingerprintStore, _FileLock
+from mbed_flasher.flash import Flash
+from mbed_flasher.flashers.FlasherMbed import EXIT_CODE_RESET_FAIL
+
+
+class FingerprintStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'fingerprints.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_record_survives_new_store(self):
+        FingerprintStore(self.path).record('123', 'abc', 'simple')
+        store = FingerprintStore(self.path)
+        self.assertTrue(store.is_unchanged('123', 'abc', 'simple'))
+        self.assertFalse(store.is_unchanged('123', 'abc', 'pyocd'))
+        self.assertFalse(store.is_unchanged('123', 'def', 'simple'))
+        self.assertFalse(store.is_unchanged('124', 'abc', 'simple'))
+
+    def test_forget(self):
+        store = FingerprintStore(self.path)
+        store.record('123', 'abc', 'simple')
+        store.forget('123')
+        self.assertIsNone(store.get('123'))
+
+    def test_forget_unknown_target_does_not_lock(self):
+        store = FingerprintStore(self.path)
+        with mock.patch('mbed_flasher.fingerprints._FileLock') as mock_lock:
+            store.forget('123')
+            mock_lock.assert_not_called()
+        store.record('123', 'abc', 'simple')
+        with mock.patch('mbed_flasher.fingerprints._FileLock', wraps=_FileLock) as mock_lock:
+            store.forget('124')
+            mock_lock.assert_not_called()
+            store.forget('123')
+            self.assertEqual(mock_lock.call_count, 1)
+        self.assertIsNone(store.get('123'))
+
+    def test_corrupted_store(self):
+        with open(self.path, 'w') as store_file:
+            store_file.write('{not json')
+        store = FingerprintStore(self.path)
+        self.assertIsNone(store.get('123'))
+        store.record('123', 'abc', 'simple')
+        self.assertTrue(store.is_unchanged('123', 'abc', 'simple'))
+
+    def test_concurrent_writers(self):
+        def record(index):
+            FingerprintStore(self.path).record(str(index), 'sha%i' % index, 'simple')
+
+        run_parallel(record, range(20), max_workers=8)
+        store = FingerprintStore(self.path)
+        for index in range(20):
+            self.assertTrue(store.is_unchanged(str(index), 'sha%i' % index, 'simple'))
+
+
+class SkipUnchangedTestCase(unittest.TestCase):
+    target = {'target_id': '0240000028884e450019700f6bf0000f8021000097969900',
+              'platform_name': 'K64F', 'mount_point': '', 'serial_port': '/dev/ttyACM0'}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.build = os.path.join(self.tmp_dir, 'image.bin')
+        with open(self.build, 'wb') as build:
+            build.write(b'image')
+        self.flasher = Flash()
+        self.flasher._fingerprints = FingerprintStore(os.path.join(self.tmp_dir, 'fp.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _flash(self, skip_unchanged=True):
+        return self.flasher.flash(build=self.build, target_id=self.target['target_id'],
+                                  device_mapping_table=[self.target],
+                                  skip_unchanged=skip_unchanged)
+
+    def _write_build(self, content):
+        with open(self.build, 'wb') as build:
+            build.write(content)
+
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.reset_board')
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.flash')
+    def test_second_flash_only_resets(self, mock_flash, mock_reset):
+        mock_flash.return_value = 0
+        mock_reset.return_value = 0
+        self.assertEqual(self._flash(), 0)
+        self.assertEqual(self._flash(), 0)
+        self.assertEqual(mock_flash.call_count, 1)
+        mock_reset.assert_called_once_with('/dev/ttyACM0')
+
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.reset_board')
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.flash')
+    def test_skipped_flash_reports_failed_reset(self, mock_flash, mock_reset):
+        mock_flash.return_value = 0
+        mock_reset.return_value = EXIT_CODE_RESET_FAIL
+        self._flash()
+        self.assertEqual(self._flash(), EXIT_CODE_RESET_FAIL)
+        record = self.flasher.records[self.target['target_id']]
+        self.assertTrue(record['skipped'])
+        self.assertFalse(record['success'])
+
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.reset_board')
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.flash')
+    def test_failed_flash_is_not_skipped(self, mock_flash, mock_reset):
+        mock_flash.return_value = 0
+        self._flash()
+        mock_flash.return_value = -4
+        with open(self.build, 'wb') as build:
+            build.write(b'other image')
+        self.assertEqual(self._flash(), -4)
+        with open(self.build, 'wb') as build:
+            build.write(b'image')
+        self._flash()
+        self.assertEqual(mock_flash.call_count, 3)
+        self.assertFalse(mock_reset.called)
+
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.reset_board')
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.flash')
+    def test_flash_without_skip_unchanged_forgets(self, mock_flash, mock_reset):
+        mock_flash.return_value = 0
+        self._flash()
+        # another image flashed without the option
+        self._write_build(b'other image')
+        self._flash(skip_unchanged=False)
+        self.assertIsNone(self.flasher.fingerprints.get(self.target['target_id']))
+        self._write_build(b'image')
+        self._flash()
+        self.assertEqual(mock_flash.call_count, 3)
+        self.assertFalse(mock_reset.called)
+        self.assertFalse(self.flasher.records[self.target['target_id']]['skipped'])
+
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.flash')
+    def test_flash_without_fingerprints_leaves_store_alone(self, mock_flash):
+        mock_flash.return_value = 0
+        self._flash(skip_unchanged=False)
+        self.assertEqual(os.listdir(self.tmp_dir), ['image.bin'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,11 +25,18 @@ except ImportError:
     # python 3 compatible import
     from io import StringIO
 import platform
+import shutil
+import tempfile
+import threading
+import time
 from test.test_helper import Helper
 import mock
 import mbed_lstools
+from mbed_flasher.common import run_parallel
+from mbed_flasher.daplink_details import DetailsCache
 from mbed_flasher.flash import Flash
-from mbed_flasher.flashers.FlasherMbed import FlasherMbed
+from mbed_flasher.flashers.FlasherMbed import FlasherMbed, EXIT_CODE_BOOTLOADER_MODE
+from mbed_flasher.image import PreparedImage
 
 
 class FlashTestCase(unittest.TestCase):
@@ -98,20 +105,15 @@ class FlashTestCase(unittest.TestCase):
     # pylint: disable=unused-argument
     @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.copy_file')
     @mock.patch('mbed_flasher.common.MountVerifier.check_points_unchanged')
-    @mock.patch('mbed_flasher.flashers.FlasherMbed.Popen')
-    def test_run_with_uppercase_HTM(self, mock_popen, mock_verifier, mock_copy_file):
-        mock_verifier.return_value = {'target_id':'123',
+    @mock.patch('mbed_flasher.watcher.list_mount_point')
+    def test_run_with_uppercase_HTM(self, mock_list, mock_verifier, mock_copy_file):
+        mock_verifier.return_value = {'target_id': '123',
                                       'platform_name': 'K64F',
                                       'mount_point': 'path/'}
 
-        mock_stdout = mock.Mock()
-        mock_out = mock.Mock(side_effect=[b"no-htm", b"test.HTM", b"no-htm"])
-        mock_stdout.read = mock_out
-        mock_popen.return_value.stdout = mock_stdout
-
-        mock_popen.return_value.communicate.return_value = ('', '')
+        mock_list.side_effect = [['helloworld.bin'], ['MBED.HTM']]
 
-        flasher = Flash()
+        flasher = Flash(timing_profile='conservative')
         ret = flasher.flash(build=self.bin_path,
                             target_id='123',
                             platform_name='K64F',
@@ -123,24 +125,19 @@ class FlashTestCase(unittest.TestCase):
                             method='simple',
                             no_reset=True)
         self.assertEqual(ret, 0)
-        self.assertEqual(2, mock_out.call_count)
+        self.assertEqual(2, mock_list.call_count)
 
     @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.copy_file')
     @mock.patch('mbed_flasher.common.MountVerifier.check_points_unchanged')
-    @mock.patch('mbed_flasher.flashers.FlasherMbed.Popen')
-    def test_run_with_lowercase_HTM(self, mock_popen, mock_verifier, mock_copy_file):
+    @mock.patch('mbed_flasher.watcher.list_mount_point')
+    def test_run_with_lowercase_HTM(self, mock_list, mock_verifier, mock_copy_file):
         mock_verifier.return_value = {'target_id': '123',
                                       'platform_name': 'K64F',
                                       'mount_point': 'path/'}
 
-        mock_stdout = mock.Mock()
-        mock_out = mock.Mock(side_effect=[b"no-htm", b"test.htm", b"no-htm"])
-        mock_stdout.read = mock_out
-        mock_popen.return_value.stdout = mock_stdout
+        mock_list.side_effect = [['helloworld.bin'], ['mbed.htm']]
 
-        mock_popen.return_value.communicate.return_value = ('', '')
-
-        flasher = Flash()
+        flasher = Flash(timing_profile='conservative')
         ret = flasher.flash(build=self.bin_path,
                             target_id='123',
                             platform_name='K64F',
@@ -152,7 +149,134 @@ class FlashTestCase(unittest.TestCase):
                             method='simple',
                             no_reset=True)
         self.assertEqual(ret, 0)
-        self.assertEqual(2, mock_out.call_count)
+        self.assertEqual(2, mock_list.call_count)
+
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.flash')
+    @mock.patch('mbed_flasher.flash.Flash.get_available_device_mapping')
+    def test_flash_multiple_parallel_results(self, mock_mapping, mock_flash):
+        mock_mapping.return_value = [
+            {'target_id': '123', 'platform_name': 'K64F', 'mount_point': ''},
+            {'target_id': '124', 'platform_name': 'K64F', 'mount_point': ''},
+            {'target_id': '125', 'platform_name': 'K64F', 'mount_point': ''}]
+        codes = {'123': 3, '124': -3, '125': 0}
+        mock_flash.side_effect = lambda source, target, method, no_reset: \
+            codes[target['target_id']]
+
+        flasher = Flash()
+        ret = flasher.flash(build=self.bin_path,
+                            target_id=['123', '124', '125'],
+                            platform_name='K64F',
+                            method='simple',
+                            max_workers=3)
+        self.assertEqual(ret, 3)
+        self.assertEqual(list(flasher.results.items()),
+                         [('123', 3), ('124', -3), ('125', 0)])
+
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.flash')
+    @mock.patch('mbed_flasher.flash.Flash.get_available_device_mapping')
+    def test_flash_multiple_shares_prepared_image(self, mock_mapping, mock_flash):
+        mock_mapping.return_value = [
+            {'target_id': '123', 'platform_name': 'K64F', 'mount_point': ''},
+            {'target_id': '124', 'platform_name': 'K64F', 'mount_point': ''}]
+        mock_flash.return_value = 0
+
+        ret = Flash().flash(build=self.bin_path, target_id=['123', '124'],
+                            platform_name='K64F', method='simple')
+        self.assertEqual(ret, 0)
+        images = [call[1]['source'] for call in mock_flash.call_args_list]
+        self.assertEqual(len(images), 2)
+        self.assertIsInstance(images[0], PreparedImage)
+        self.assertIs(images[0], images[1])
+
+    @mock.patch('mbed_flasher.flash.Flash.get_available_device_mapping')
+    def test_flash_multiple_pipeline(self, mock_mapping):
+        mock_mapping.return_value = [
+            {'target_id': str(target_id), 'platform_name': 'K64F', 'mount_point': ''}
+            for target_id in range(123, 127)]
+        lock = threading.Lock()
+        state = {'copying': 0, 'remounting': 0, 'max_copying': 0, 'overlap': False}
+
+        def copy(job):
+            # pylint: disable=unused-argument
+            with lock:
+                state['copying'] += 1
+                state['max_copying'] = max(state['max_copying'], state['copying'])
+                state['overlap'] = state['overlap'] or state['remounting'] > 0
+            time.sleep(0.05)
+            with lock:
+                state['copying'] -= 1
+            return 'detach'
+
+        def remount(job):
+            with lock:
+                state['remounting'] += 1
+            time.sleep(0.2)
+            with lock:
+                state['remounting'] -= 1
+            job['retcode'] = 0
+            return 'done'
+
+        with mock.patch.object(FlasherMbed, '_state_pre_reset', return_value='copy'), \
+                mock.patch.object(FlasherMbed, '_state_copy', side_effect=copy), \
+                mock.patch.object(FlasherMbed, '_state_detach', return_value='remount'), \
+                mock.patch.object(FlasherMbed, '_state_remount', side_effect=remount):
+            start = time.time()
+            ret = Flash().flash(build=self.bin_path, target_id=['123', '124', '125', '126'],
+                                platform_name='K64F', method='simple', pipeline=1,
+                                max_workers=4)
+            elapsed = time.time() - start
+        self.assertEqual(ret, 0)
+        self.assertEqual(state['max_copying'], 1)
+        self.assertTrue(state['overlap'])
+        # one by one would take 4 * 0.25 seconds
+        self.assertLess(elapsed, 0.8)
+
+    @mock.patch('mbed_flasher.flash.Flash.get_available_device_mapping')
+    def test_pipeline_slots_and_workers_per_call(self, mock_mapping):
+        mock_mapping.return_value = [
+            {'target_id': str(target_id), 'platform_name': 'K64F', 'mount_point': ''}
+            for target_id in range(123, 129)]
+        lock = threading.Lock()
+        state = {'copying': 0, 'max_copying': 0, 'flashing': 0, 'max_flashing': 0}
+
+        def copy(job):
+            # pylint: disable=unused-argument
+            with lock:
+                state['copying'] += 1
+                state['max_copying'] = max(state['max_copying'], state['copying'])
+            time.sleep(0.1)
+            with lock:
+                state['copying'] -= 1
+            return 'detach'
+
+        def pre_reset(job):
+            # pylint: disable=unused-argument
+            with lock:
+                state['flashing'] += 1
+                state['max_flashing'] = max(state['max_flashing'], state['flashing'])
+            return 'copy'
+
+        def remount(job):
+            time.sleep(0.1)
+            with lock:
+                state['flashing'] -= 1
+            job['retcode'] = 0
+            return 'done'
+
+        flasher = Flash()
+        with mock.patch.object(FlasherMbed, '_state_pre_reset', side_effect=pre_reset), \
+                mock.patch.object(FlasherMbed, '_state_copy', side_effect=copy), \
+                mock.patch.object(FlasherMbed, '_state_detach', return_value='remount'), \
+                mock.patch.object(FlasherMbed, '_state_remount', side_effect=remount):
+            # each call has its own copy slot and at most two devices in flight
+            ret_codes = run_parallel(
+                lambda target_ids: flasher.flash(build=self.bin_path, target_id=target_ids,
+                                                 platform_name='K64F', method='simple',
+                                                 pipeline=1, max_workers=2),
+                [['123', '124', '125'], ['126', '127', '128']], max_workers=2)
+        self.assertEqual(ret_codes, [0, 0])
+        self.assertEqual(state['max_copying'], 2)
+        self.assertEqual(state['max_flashing'], 4)
 
     @unittest.skipIf(mbeds.list_mbeds() == [], "no hardware attached")
     def test_run_with_file_with_one_target_id_wrong_platform(self):
@@ -289,6 +413,150 @@ class FlashTestCase(unittest.TestCase):
             pass
 
 
+class FlashStatesTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.root = tempfile.mkdtemp()
+        self.mount_point = os.path.join(self.root, 'DAPLINK')
+        os.mkdir(self.mount_point)
+        with open(os.path.join(self.mount_point, 'MBED.HTM'), 'w'):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _consume_later(self, source, destination):
+        # emulate device taking the binary after a while
+        shutil.copy(source, destination)
+        threading.Timer(0.3, os.remove, [destination]).start()
+
+    @mock.patch('mbed_flasher.common.MountVerifier.check_points_unchanged')
+    def test_probe_profile_does_not_sleep(self, mock_verifier):
+        target = {'target_id': '123', 'mount_point': self.mount_point}
+        mock_verifier.return_value = target
+        flasher = FlasherMbed(timing_profile='probe')
+        start = time.time()
+        with mock.patch.object(flasher, 'copy_file', side_effect=self._consume_later):
+            ret = flasher.flash(source=FlashTestCase.bin_path, target=target,
+                                method='simple', no_reset=True)
+        self.assertEqual(ret, 0)
+        self.assertLess(time.time() - start, 2)
+
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.sleep')
+    @mock.patch('mbed_flasher.common.MountVerifier.check_points_unchanged')
+    def test_conservative_profile_sleeps(self, mock_verifier, mock_sleep):
+        target = {'target_id': '123', 'mount_point': self.mount_point,
+                  'serial_port': '/dev/ttyACM0'}
+        mock_verifier.return_value = target
+        flasher = FlasherMbed(timing_profile='conservative')
+        with mock.patch.object(flasher, 'copy_file', side_effect=self._consume_later), \
+                mock.patch.object(flasher, 'reset_board') as mock_reset:
+            ret = flasher.flash(source=FlashTestCase.bin_path, target=target,
+                                method='simple', no_reset=False)
+        self.assertEqual(ret, 0)
+        self.assertEqual(mock_reset.call_count, 2)
+        self.assertEqual([call[0][0] for call in mock_sleep.call_args_list], [0.1, 4, 0.4])
+
+    def test_copy_fails(self):
+        target = {'target_id': '123', 'mount_point': self.mount_point}
+        flasher = FlasherMbed()
+        with mock.patch.object(flasher, 'copy_file', return_value=-7):
+            ret = flasher.flash(source=FlashTestCase.bin_path, target=target,
+                                method='simple', no_reset=True)
+        self.assertEqual(ret, -7)
+
+    @mock.patch('mbed_flasher.common.MountVerifier.check_points_unchanged')
+    def test_copy_slot_held_during_copy_only(self, mock_verifier):
+        target = {'target_id': '123', 'mount_point': self.mount_point}
+        slots = threading.BoundedSemaphore(1)
+        held = {}
+
+        def remount(*_):
+            held['remount'] = not slots.acquire(False)
+            if not held['remount']:
+                slots.release()
+            return target
+
+        def copy(source, destination):
+            held['copy'] = not slots.acquire(False)
+            if not held['copy']:
+                slots.release()
+            self._consume_later(source, destination)
+        mock_verifier.side_effect = remount
+        flasher = FlasherMbed(copy_slots=slots)
+        with mock.patch.object(flasher, 'copy_file', side_effect=copy):
+            ret = flasher.flash(source=FlashTestCase.bin_path, target=target,
+                                method='simple', no_reset=True)
+        self.assertEqual(ret, 0)
+        self.assertEqual(held, {'copy': True, 'remount': False})
+        with mock.patch.object(flasher, 'copy_file', return_value=-7):
+            flasher.flash(source=FlashTestCase.bin_path, target=target,
+                          method='simple', no_reset=True)
+        self.assertTrue(slots.acquire(False))
+
+    @mock.patch('mbed_flasher.serial_reset.EnhancedSerial')
+    @mock.patch('mbed_flasher.common.MountVerifier.check_points_unchanged')
+    def test_serial_port_reopened_after_remount(self, mock_verifier, mock_serial):
+        target = {'target_id': '123', 'mount_point': self.mount_point,
+                  'serial_port': '/dev/ttyACM0'}
+        ports = {}
+
+        def open_port(serial_port, **_):
+            ports[serial_port] = mock.Mock()
+            return ports[serial_port]
+
+        def remount(*_):
+            # device re-enumerated with another serial port
+            self.assertTrue(ports['/dev/ttyACM0'].close.called)
+            self.assertEqual(list(ports), ['/dev/ttyACM0'])
+            return dict(target, serial_port='/dev/ttyACM1')
+        mock_serial.side_effect = open_port
+        mock_verifier.side_effect = remount
+        flasher = FlasherMbed()
+        with mock.patch.object(flasher, 'copy_file', side_effect=self._consume_later):
+            ret = flasher.flash(source=FlashTestCase.bin_path, target=target,
+                                method='simple', no_reset=False)
+        self.assertEqual(ret, 0)
+        self.assertEqual([call[0][0] for call in mock_serial.call_args_list],
+                         ['/dev/ttyACM0', '/dev/ttyACM1'])
+        self.assertEqual(ports['/dev/ttyACM0'].safe_send_break.call_count, 1)
+        self.assertEqual(ports['/dev/ttyACM1'].safe_send_break.call_count, 1)
+        self.assertEqual(ports['/dev/ttyACM1'].close.call_count, 1)
+
+    def write_details(self, mode, auto_reset):
+        with open(os.path.join(self.mount_point, 'DETAILS.TXT'), 'w') as details:
+            details.write("Daplink Mode: %s\nAuto Reset: %i\nInterface Version: 0244\n"
+                          % (mode, auto_reset))
+
+    def test_bootloader_mode_rejected(self):
+        self.write_details('Bootloader', 0)
+        target = {'target_id': '123', 'mount_point': self.mount_point}
+        flasher = FlasherMbed(details_cache=DetailsCache())
+        with mock.patch.object(flasher, 'copy_file') as mock_copy:
+            ret = flasher.flash(source=FlashTestCase.bin_path, target=target,
+                                method='simple', no_reset=True)
+        self.assertEqual(ret, EXIT_CODE_BOOTLOADER_MODE)
+        mock_copy.assert_not_called()
+
+    @mock.patch('mbed_flasher.common.MountVerifier.check_points_unchanged')
+    def test_auto_reset_skips_post_reset(self, mock_verifier):
+        self.write_details('Interface', 1)
+        target = {'target_id': '123', 'mount_point': self.mount_point,
+                  'serial_port': '/dev/ttyACM0'}
+        mock_verifier.return_value = target
+        details_cache = DetailsCache()
+        flasher = FlasherMbed(details_cache=details_cache)
+        with mock.patch.object(flasher, 'copy_file', side_effect=self._consume_later), \
+                mock.patch.object(flasher, 'reset_board') as mock_reset:
+            ret = flasher.flash(source=FlashTestCase.bin_path, target=target,
+                                method='simple', no_reset=False)
+        self.assertEqual(ret, 0)
+        self.assertEqual(mock_reset.call_count, 1)
+        # remount drops the cached details
+        details_cache.get(target)
+        self.assertEqual(details_cache.stats(), {'hits': 0, 'misses': 2})
+
+
 class FlashVerify(unittest.TestCase):
     @mock.patch('mbed_flasher.flashers.FlasherMbed.isfile')
     def test_verify_flash_success_ok(self, mock_isfile):
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from mbed_flasher.image import ImageWriter, PreparedImage
+from mbed_flasher.flashers.FlasherMbed import FlasherMbed, EXIT_CODE_FILE_COULD_NOT_BE_READ
+
+
+class ImageWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, 'image.bin')
+        self.destination = os.path.join(self.tmp_dir, 'target.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_source(self, size):
+        data = bytearray((index * 7) % 251 for index in range(size))
+        with open(self.source, 'wb') as source_file:
+            source_file.write(data)
+        return bytes(data)
+
+    def _assert_copied(self, data, sha1):
+        with open(self.destination, 'rb') as target_file:
+            self.assertEqual(target_file.read(), data)
+        self.assertEqual(sha1, hashlib.sha1(data).hexdigest())
+
+    def test_unaligned_sizes(self):
+        writer = ImageWriter()
+        writer.CHUNK_SIZE = 8192
+        for size in [1, 511, 4096, 4097, 8192 * 3 + 100]:
+            data = self._make_source(size)
+            self._assert_copied(data, writer.write(self.source, self.destination))
+
+    def test_empty_source(self):
+        self._make_source(0)
+        self.assertIsNone(ImageWriter().write(self.source, self.destination))
+
+    def test_buffered_fallback(self):
+        data = self._make_source(10000)
+        with mock.patch.object(ImageWriter, 'open_target',
+                               side_effect=lambda dest: (os.open(dest, os.O_CREAT | os.O_RDWR),
+                                                         False)):
+            self._assert_copied(data, ImageWriter().write(self.source, self.destination))
+
+    @unittest.skipUnless(hasattr(os, 'sendfile'), "sendfile not available")
+    def test_sendfile_rejected(self):
+        data = self._make_source(10000)
+        with mock.patch('os.sendfile', side_effect=OSError(errno.EINVAL, 'invalid')):
+            self._assert_copied(data, ImageWriter().write(self.source, self.destination))
+
+    def test_chunk_size_aligned(self):
+        writer = ImageWriter()
+        writer.CHUNK_SIZE = 100000
+        chunk = writer.get_chunk_size(512)
+        self.assertEqual(chunk % 4096, 0)
+        self.assertLessEqual(chunk, 100000)
+
+    def test_block_size_default(self):
+        with mock.patch('os.statvfs', side_effect=OSError):
+            self.assertEqual(ImageWriter.get_block_size(self.destination), 512)
+
+    def test_copy_file_empty_source(self):
+        self._make_source(0)
+        self.assertEqual(FlasherMbed().copy_file(self.source, self.destination),
+                         EXIT_CODE_FILE_COULD_NOT_BE_READ)
+
+    def test_copy_file(self):
+        data = self._make_source(5000)
+        self.assertIsNone(FlasherMbed().copy_file(self.source, self.destination))
+        self._assert_copied(data, ImageWriter.hash_file(self.source))
+
+
+class PreparedImageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, 'image.bin')
+        self.data = bytes(bytearray(range(256)) * 40)
+        with open(self.source, 'wb') as source_file:
+            source_file.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_attributes(self):
+        with PreparedImage(self.source) as image:
+            self.assertEqual(image.size, len(self.data))
+            self.assertEqual(image.name, 'image.bin')
+            self.assertEqual(image.sha1, hashlib.sha1(self.data).hexdigest())
+            self.assertEqual(image.sha256, hashlib.sha256(self.data).hexdigest())
+            self.assertEqual(image.format, PreparedImage.FORMAT_BIN)
+            self.assertEqual(image.data(), self.data)
+
+    def test_byte_list_converted_once(self):
+        with PreparedImage(self.source) as image:
+            byte_list = image.byte_list()
+            self.assertEqual(byte_list, list(bytearray(self.data)))
+            self.assertIs(image.byte_list(), byte_list)
+
+    def test_hex_format(self):
+        hex_path = os.path.join(self.tmp_dir, 'image.txt')
+        with open(hex_path, 'wb') as hex_file:
+            hex_file.write(b':00000001FF\n')
+        with PreparedImage(hex_path) as image:
+            self.assertEqual(image.format, PreparedImage.FORMAT_HEX)
+
+    def test_written_without_reading_source(self):
+        destination = os.path.join(self.tmp_dir, 'target.bin')
+        with PreparedImage(self.source) as image:
+            os.remove(self.source)
+            self.assertEqual(ImageWriter().write(image, destination), image.sha1)
+        with open(destination, 'rb') as target_file:
+            self.assertEqual(target_file.read(), self.data)
+
+    def test_empty_image(self):
+        empty = os.path.join(self.tmp_dir, 'empty.bin')
+        open(empty, 'wb').close()
+        with PreparedImage(empty) as image:
+            self.assertEqual(image.size, 0)
+            self.assertIsNone(ImageWriter().write(image, os.path.join(self.tmp_dir, 'x')))
+
+
+if __name__ == '__main__':
+    unittest.main()
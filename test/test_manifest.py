@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import mock
+import six
+from mbed_flasher.devices import DeviceCache, DeviceIndex
+from mbed_flasher.image import PreparedImage
+from mbed_flasher.main import FlasherCLI
+from mbed_flasher.manifest import Manifest, ManifestEntry, ManifestError, flash_manifest, \
+    EXIT_CODE_INVALID_MANIFEST
+from mbed_flasher.scheduler import Scheduler
+
+DEVICES = [
+    {'target_id': '0240000028884e450019700f6bf0000f8021000097969900', 'platform_name': 'K64F',
+     'mount_point': '/mnt/K64F_0', 'serial_port': '/dev/ttyACM0'},
+    {'target_id': '0240000033514e45003f500585d4000ae981000097969900', 'platform_name': 'K64F',
+     'mount_point': '/mnt/K64F_1', 'serial_port': '/dev/ttyACM1'},
+    {'target_id': '1100000000000000000000000000000000000000', 'platform_name': 'NRF51_DK',
+     'mount_point': '/mnt/NRF', 'serial_port': '/dev/ttyACM2'},
+]
+
+
+class FakeFlasher(object):
+    @staticmethod
+    def get_available_devices():
+        return [dict(device) for device in DEVICES]
+
+
+class ManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for name in ['server.bin', 'client.bin', 'nrf.bin']:
+            with open(os.path.join(self.tmp_dir, name), 'wb') as image:
+                image.write(name.encode('ascii') * 64)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_manifest(self, data):
+        path = os.path.join(self.tmp_dir, 'manifest.json')
+        with open(path, 'w') as manifest_file:
+            json.dump(data, manifest_file)
+        return path
+
+    def test_load_relative_images(self):
+        path = self.write_manifest({'entries': [
+            {'target_id': '02400000335', 'image': 'server.bin', 'method': 'pyocd'},
+            {'platform_name': 'K64F', 'image': 'client.bin'}]})
+        manifest = Manifest.load(path)
+        self.assertEqual(manifest.images, [os.path.join(self.tmp_dir, 'server.bin'),
+                                           os.path.join(self.tmp_dir, 'client.bin')])
+        self.assertEqual(manifest.entries[0].target_ids, ['02400000335'])
+        self.assertEqual(manifest.entries[0].method, 'pyocd')
+
+    def test_load_errors(self):
+        with self.assertRaises(ManifestError) as context:
+            Manifest.load(os.path.join(self.tmp_dir, 'missing.json'))
+        if six.PY3:
+            self.assertIsInstance(context.exception.__cause__, IOError)
+        with self.assertRaises(ManifestError):
+            Manifest.load(self.write_manifest([]))
+        with self.assertRaises(ManifestError):
+            Manifest.load(self.write_manifest([{'target_id': '0240'}]))
+        with self.assertRaises(ManifestError):
+            Manifest.load(self.write_manifest([{'image': 'server.bin'}]))
+        with self.assertRaises(ManifestError):
+            Manifest.load(self.write_manifest([{'image': 'server.bin', 'platform_name': 'K64F',
+                                                'method': 'jtag'}]))
+
+    def test_target_id_takes_precedence_over_platform(self):
+        manifest = Manifest([ManifestEntry('client.bin', platform_name='K64F'),
+                             ManifestEntry('server.bin', target_ids=['02400000335']),
+                             ManifestEntry('nrf.bin', platform_name='NRF51_DK')])
+        resolved = manifest.resolve(DeviceIndex(DEVICES))
+        self.assertEqual([(device['target_id'], entry.image) for device, entry in resolved],
+                         [(DEVICES[0]['target_id'], 'client.bin'),
+                          (DEVICES[1]['target_id'], 'server.bin'),
+                          (DEVICES[2]['target_id'], 'nrf.bin')])
+
+    def test_overlapping_entries(self):
+        manifest = Manifest([ManifestEntry('client.bin', target_ids=['0240']),
+                             ManifestEntry('server.bin', target_ids=['02400000335'])])
+        with self.assertRaises(ManifestError):
+            manifest.resolve(DeviceIndex(DEVICES))
+
+    def test_unmatched_entry(self):
+        manifest = Manifest([ManifestEntry('client.bin', platform_name='K64F'),
+                             ManifestEntry('server.bin', target_ids=['9999'])])
+        with self.assertRaises(ManifestError):
+            manifest.resolve(DeviceIndex(DEVICES))
+
+    @mock.patch('mbed_flasher.flash.Flash.flash')
+    def test_flash_manifest(self, mock_flash):
+        mock_flash.side_effect = lambda **kwargs: 0 if kwargs['method'] == 'simple' else 7
+        path = self.write_manifest([
+            {'platform_name': 'K64F', 'image': 'client.bin'},
+            {'platform_name': 'NRF51_DK', 'image': 'nrf.bin', 'method': 'pyocd'}])
+        device_cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        with mock.patch('mbed_flasher.manifest.PreparedImage',
+                        side_effect=PreparedImage) as mock_image:
+            retcode, results = flash_manifest(Manifest.load(path), device_cache=device_cache,
+                                              max_workers=3)
+        self.assertEqual(retcode, 7)
+        self.assertEqual(mock_image.call_count, 2)
+        self.assertEqual(device_cache.stats()['misses'], 1)
+        self.assertEqual(list(results), [device['target_id'] for device in DEVICES])
+        self.assertEqual(results[DEVICES[0]['target_id']],
+                         {'image': os.path.join(self.tmp_dir, 'client.bin'),
+                          'method': 'simple', 'retcode': 0})
+        self.assertEqual(results[DEVICES[2]['target_id']]['retcode'], 7)
+        builds = set(call[1]['build'] for call in mock_flash.call_args_list)
+        self.assertEqual(len(builds), 2)
+        # pylint: disable=protected-access
+        self.assertTrue(all(build._map is None for build in builds))
+        for call in mock_flash.call_args_list:
+            self.assertEqual(call[1]['device_mapping_table'],
+                             [device for device in DEVICES
+                              if device['target_id'] == call[1]['target_id']])
+
+    @mock.patch('mbed_flasher.main.logging')
+    @mock.patch('mbed_flasher.flash.Flash.flash')
+    def test_cli(self, mock_flash, _):
+        mock_flash.return_value = 0
+        path = self.write_manifest([{'target_id': '0240', 'image': 'client.bin'}])
+        with mock.patch('mbed_flasher.manifest.get_device_cache',
+                        return_value=DeviceCache(ttl=60, flashers=[FakeFlasher])):
+            self.assertEqual(FlasherCLI(['flash', '--manifest', path]).execute(), 0)
+            self.assertEqual(FlasherCLI(['flash', '--manifest', path,
+                                         '--tid', '0240']).execute(),
+                             EXIT_CODE_INVALID_MANIFEST)
+            self.assertEqual(FlasherCLI(['flash', '--manifest', path,
+                                         '--pipeline', '2']).execute(),
+                             EXIT_CODE_INVALID_MANIFEST)
+        self.assertEqual(mock_flash.call_count, 2)
+
+    @mock.patch('mbed_flasher.flash.Flash.flash')
+    def test_max_workers_bounds_shared_scheduler(self, mock_flash):
+        active = []
+        most = []
+        lock = threading.Lock()
+
+        def flash(**kwargs):
+            with lock:
+                active.append(kwargs['target_id'])
+                most.append(len(active))
+            time.sleep(0.1)
+            with lock:
+                active.remove(kwargs['target_id'])
+            return 0
+        mock_flash.side_effect = flash
+        path = self.write_manifest([{'platform_name': 'K64F', 'image': 'client.bin'},
+                                    {'platform_name': 'NRF51_DK', 'image': 'nrf.bin'}])
+        device_cache = DeviceCache(ttl=60, flashers=[FakeFlasher])
+        with Scheduler(max_workers=3, device_cache=device_cache) as scheduler:
+            retcode, _ = flash_manifest(Manifest.load(path), device_cache=device_cache,
+                                        scheduler=scheduler, max_workers=1)
+        self.assertEqual(retcode, 0)
+        self.assertEqual(mock_flash.call_count, 3)
+        self.assertEqual(max(most), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import mock
+from mbed_flasher.daplink_errors import DAPLINK_ERROR_CLASSES, EXIT_CODE_USER_ERROR
+from mbed_flasher.flashers.FlasherMbed import FlasherMbed, STATE_PRE_RESET, STATE_DETACH, \
+    STATE_REMOUNT, STATE_POST_RESET
+from mbed_flasher.metrics import Metrics, get_metrics, PHASE_SECONDS, OPERATION_SECONDS, \
+    OPERATIONS, BYTES_WRITTEN, DAPLINK_ERRORS, PHASE_COPY, PHASE_VERIFY
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_observe_and_increment(self):
+        self.metrics.observe(PHASE_SECONDS, 0.5, phase=PHASE_COPY, platform='K64F')
+        self.metrics.observe(PHASE_SECONDS, 1.5, phase=PHASE_COPY, platform='K64F')
+        self.metrics.increment(BYTES_WRITTEN, 100, platform='K64F')
+        self.metrics.increment(BYTES_WRITTEN, 50, platform='K64F')
+        self.assertEqual(self.metrics.get(PHASE_SECONDS, phase=PHASE_COPY, platform='K64F'),
+                         {'count': 2, 'sum': 2.0, 'max': 1.5})
+        self.assertEqual(self.metrics.get(BYTES_WRITTEN, platform='K64F'), 150)
+        self.assertIsNone(self.metrics.get(BYTES_WRITTEN, platform='NRF51822'))
+
+    def test_none_labels_are_left_out(self):
+        with self.metrics.phase(PHASE_COPY) as timer:
+            pass
+        self.assertGreaterEqual(timer.elapsed, 0)
+        self.assertEqual(self.metrics.get(PHASE_SECONDS, phase=PHASE_COPY)['count'], 1)
+
+    def test_operation(self):
+        self.metrics.operation('flash', 'K64F', 3.0, 0)
+        self.metrics.operation('flash', 'K64F', 4.0, -12)
+        self.assertEqual(self.metrics.get(OPERATION_SECONDS, operation='flash',
+                                          platform='K64F')['count'], 2)
+        self.assertEqual(self.metrics.get(OPERATIONS, operation='flash', platform='K64F',
+                                          result='success'), 1)
+        self.assertEqual(self.metrics.get(OPERATIONS, operation='flash', platform='K64F',
+                                          result='failure'), 1)
+
+    def test_snapshot_and_clear(self):
+        self.metrics.observe(PHASE_SECONDS, 1, phase=PHASE_COPY)
+        self.metrics.increment(OPERATIONS, result='success')
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['summaries'], [{'name': PHASE_SECONDS,
+                                                  'labels': {'phase': PHASE_COPY},
+                                                  'count': 1, 'sum': 1, 'max': 1}])
+        self.assertEqual(snapshot['counters'], [{'name': OPERATIONS,
+                                                 'labels': {'result': 'success'},
+                                                 'value': 1}])
+        self.metrics.clear()
+        self.assertEqual(self.metrics.snapshot(), {'summaries': [], 'counters': []})
+
+    def test_prometheus_format(self):
+        self.metrics.observe(PHASE_SECONDS, 0.25, phase=PHASE_COPY, platform='K64F')
+        self.metrics.observe(PHASE_SECONDS, 0.5, phase=PHASE_VERIFY, platform='K64F')
+        self.metrics.increment(BYTES_WRITTEN, 1024, platform='K64F')
+        lines = self.metrics.to_prometheus(host='rack"1').splitlines()
+        self.assertEqual(lines.count('# TYPE mbedflash_phase_seconds summary'), 1)
+        self.assertIn('mbedflash_phase_seconds_count{host="rack\\"1",phase="copy",'
+                      'platform="K64F"} 1', lines)
+        self.assertIn('mbedflash_phase_seconds_sum{host="rack\\"1",phase="verify",'
+                      'platform="K64F"} 0.500000', lines)
+        self.assertIn('mbedflash_phase_seconds_max{host="rack\\"1",phase="copy",'
+                      'platform="K64F"} 0.250000', lines)
+        self.assertIn('# TYPE mbedflash_bytes_written_total counter', lines)
+        self.assertIn('mbedflash_bytes_written_total{host="rack\\"1",platform="K64F"} 1024',
+                      lines)
+        self.assertEqual(Metrics().to_prometheus(), '')
+
+    def test_write_textfile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'mbedflash.prom')
+            self.metrics.increment(OPERATIONS, result='success')
+            self.metrics.write_textfile(path, host='host1')
+            with open(path) as prom_file:
+                self.assertEqual(prom_file.read(), self.metrics.to_prometheus(host='host1'))
+            self.assertEqual(os.listdir(directory), ['mbedflash.prom'])
+            self.assertTrue(os.stat(path).st_mode & stat.S_IRGRP)
+        finally:
+            shutil.rmtree(directory)
+
+
+class FlashMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        get_metrics().clear()
+        self.root = tempfile.mkdtemp()
+        self.mount_point = os.path.join(self.root, 'DAPLINK')
+        os.mkdir(self.mount_point)
+        self.source = os.path.join(self.root, 'image.bin')
+        with open(self.source, 'wb') as image:
+            image.write(b'\0' * 2048)
+        self.target = {'target_id': '123', 'platform_name': 'K64F',
+                       'mount_point': self.mount_point}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        get_metrics().clear()
+
+    @mock.patch('mbed_flasher.common.MountVerifier.check_points_unchanged')
+    def test_flash_phases_and_bytes(self, mock_verifier):
+        mock_verifier.return_value = self.target
+        flasher = FlasherMbed(timing_profile='probe')
+        flasher.timing = dict(flasher.timing)
+        for state in (STATE_PRE_RESET, STATE_DETACH, STATE_REMOUNT, STATE_POST_RESET):
+            flasher.timing[state] = 0
+        with mock.patch.object(flasher, 'copy_file'), mock.patch.object(flasher, 'runner'):
+            self.assertEqual(flasher.flash(source=self.source, target=self.target,
+                                           method='simple', no_reset=True), 0)
+        metrics = get_metrics()
+        self.assertEqual(metrics.get(BYTES_WRITTEN, platform='K64F'), 2048)
+        for phase in (PHASE_COPY, PHASE_VERIFY):
+            self.assertEqual(metrics.get(PHASE_SECONDS, phase=phase, platform='K64F',
+                                         operation='flash')['count'], 1)
+
+    def test_daplink_error_class_counted(self):
+        with open(os.path.join(self.mount_point, 'FAIL.TXT'), 'w') as fail_file:
+            fail_file.write('The transfer timed out.')
+        flasher = FlasherMbed()
+        self.assertEqual(flasher.verify_flash_success(self.target, self.target, 'image.bin'),
+                         EXIT_CODE_USER_ERROR)
+        self.assertEqual(get_metrics().get(DAPLINK_ERRORS, platform='K64F',
+                                           error=DAPLINK_ERROR_CLASSES[EXIT_CODE_USER_ERROR]),
+                         1)
+
+
+if __name__ == '__main__':
+    unittest.main()
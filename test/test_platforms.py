@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from mbed_flasher.flash import Flash
+from mbed_flasher.platforms import PlatformDatabase, get_database_key, get_package_dir
+
+
+class FakeFlasher(object):
+    name = 'fake'
+    queries = 0
+
+    @staticmethod
+    def get_supported_targets():
+        FakeFlasher.queries += 1
+        return ['K64F', 'NRF51822']
+
+
+class PlatformDatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        FakeFlasher.queries = 0
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'platforms.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _database(self):
+        return PlatformDatabase(path=self.path, flashers=[FakeFlasher])
+
+    def test_lazy_and_persistent(self):
+        database = self._database()
+        self.assertEqual(FakeFlasher.queries, 0)
+        self.assertTrue(database.is_supported('K64F'))
+        self.assertFalse(database.is_supported('SAM4E'))
+        self.assertEqual(database.platforms, ['K64F', 'NRF51822'])
+        self.assertEqual(database.flasher_platforms, {'fake': ['K64F', 'NRF51822']})
+
+        self.assertIn('NRF51822', self._database())
+        self.assertEqual(FakeFlasher.queries, 1)
+
+    def test_rebuilt_when_key_changes(self):
+        self._database().load()
+        key = dict(get_database_key([FakeFlasher]), mbed_ls='0.0.1')
+        with mock.patch('mbed_flasher.platforms.get_database_key', return_value=key):
+            self._database().load()
+        self.assertEqual(FakeFlasher.queries, 2)
+
+    def test_corrupted_file(self):
+        with open(self.path, 'w') as db_file:
+            db_file.write('{')
+        self.assertTrue(self._database().is_supported('K64F'))
+
+    def test_invalidate(self):
+        database = self._database()
+        database.load()
+        database.invalidate()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(database.is_supported('K64F'))
+        self.assertEqual(FakeFlasher.queries, 2)
+
+    def test_key_has_mbed_ls_version(self):
+        self.assertTrue(get_database_key([FakeFlasher])['mbed_ls'])
+
+    def test_package_dir(self):
+        package_dir = os.path.dirname(os.path.abspath(mock.__file__))
+        self.assertEqual(os.path.abspath(get_package_dir('mock')), package_dir)
+        with mock.patch('six.PY2', True):
+            self.assertEqual(os.path.abspath(get_package_dir('mock')), package_dir)
+            self.assertIsNone(get_package_dir('no_such_package_here'))
+        self.assertIsNone(get_package_dir('no_such_package_here'))
+
+    def test_flash_uses_database(self):
+        flasher = Flash()
+        flasher.platform_db = self._database()
+        self.assertEqual(FakeFlasher.queries, 0)
+        self.assertTrue(flasher.is_supported_target('K64F'))
+        self.assertEqual(flasher.get_supported_targets(), ['K64F', 'NRF51822'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,8 @@ limitations under the License.
 # pylint:disable=missing-docstring
 
 import logging
+import threading
+import time
 import unittest
 try:
     from StringIO import StringIO
@@ -26,9 +28,17 @@ except ImportError:
 from test.test_helper import Helper
 import mock
 import mbed_lstools
+from mbed_flasher.devices import DeviceCache
 from mbed_flasher.reset import Reset
 
 
+class FakeFlasher(object):
+    @staticmethod
+    def get_available_devices():
+        return [{'target_id': '024000%02i' % index, 'platform_name': 'K64F',
+                 'serial_port': '/dev/ttyACM%i' % index} for index in range(8)]
+
+
 class ResetTestCase(unittest.TestCase):
     """ Basic true asserts to see that testing is executed
     """
@@ -104,5 +114,58 @@ class ResetTestCase(unittest.TestCase):
     #     self.assertEqual(ret, 0)
 
 
+class ParallelResetTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.resetter = Reset(device_cache=DeviceCache(ttl=60, flashers=[FakeFlasher]))
+
+    def test_parallel_serial_reset(self):
+        lock = threading.Lock()
+        active = {'now': 0, 'max': 0}
+
+        def reset_board(serial_port):
+            with lock:
+                active['now'] += 1
+                active['max'] = max(active['max'], active['now'])
+            time.sleep(0.1)
+            with lock:
+                active['now'] -= 1
+            return 13 if serial_port == '/dev/ttyACM5' else 0
+
+        with mock.patch.object(self.resetter, 'reset_board', side_effect=reset_board):
+            start = time.time()
+            ret = self.resetter.reset(target_id='all', method='simple', max_workers=4)
+            elapsed = time.time() - start
+        self.assertEqual(ret, 13)
+        self.assertEqual(active['max'], 4)
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(list(self.resetter.results), ['024000%02i' % i for i in range(8)])
+        self.assertEqual(self.resetter.results['02400005'], 13)
+        self.assertEqual(sum(self.resetter.results.values()), 13)
+        self.assertTrue(all(elapsed >= 0.1 for elapsed in self.resetter.timings.values()))
+
+    def test_pyocd_resets_every_device(self):
+        with mock.patch.object(self.resetter, 'try_pyocd_reset', return_value=0) as mock_reset:
+            ret = self.resetter.reset(target_id=['02400001', '02400002'], method='pyocd')
+        self.assertEqual(ret, 0)
+        self.assertEqual(mock_reset.call_count, 2)
+        self.assertEqual(dict(self.resetter.results), {'02400001': 0, '02400002': 0})
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_unsupported_method(self, _):
+        with mock.patch.object(self.resetter, 'reset_board') as mock_reset:
+            self.assertEqual(self.resetter.reset(target_id='all', method='jtag'), 9)
+        mock_reset.assert_not_called()
+
+    @mock.patch('mbed_flasher.serial_reset.EnhancedSerial')
+    def test_reset_board_result(self, mock_serial):
+        port = mock_serial.return_value
+        port.safe_send_break.return_value = True
+        self.assertEqual(self.resetter.reset_board('/dev/ttyACM0'), 0)
+        port.safe_send_break.return_value = False
+        self.assertEqual(self.resetter.reset_board('/dev/ttyACM0'), 13)
+        self.assertEqual(port.close.call_count, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
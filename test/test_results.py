@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+try:
+    from StringIO import StringIO
+except ImportError:
+    # python 3 compatible import
+    from io import StringIO
+import mock
+from mbed_flasher.daplink_errors import EXIT_CODE_TRANSIENT_ERROR
+from mbed_flasher.devices import DeviceCache, get_device_cache
+from mbed_flasher.erase import Erase, EXIT_CODE_NONSUPPORTED_METHOD_FOR_ERASE
+from mbed_flasher.flash import Flash, EXIT_CODE_TARGET_ID_COULD_NOT_BE_MAPPED_TO_DEVICE, \
+    EXIT_CODE_FILE_DOES_NOT_EXIST, EXIT_CODE_KEYBOARD_INTERRUPT
+from mbed_flasher.main import FlasherCLI, EXIT_CODE_COULD_NOT_MAP_DEVICE
+from mbed_flasher.reset import Reset, EXIT_CODE_COULD_NOT_MAP_TO_DEVICE
+from mbed_flasher.results import ResultWriter, make_record, new_report
+from mbed_flasher.flashers.FlasherVirtual import VirtualFarm, FlasherVirtual
+
+IMAGE = os.path.join('test', 'helloworld.bin')
+TARGET = {'target_id': '0240000032044e4500257009997b00386781000097969900',
+          'platform_name': 'K64F', 'mount_point': '/media/DAPLINK',
+          'serial_port': '/dev/ttyACM0'}
+
+
+class ResultRecordTestCase(unittest.TestCase):
+    def test_make_record(self):
+        report = new_report()
+        report['phases']['copy'] = 0.25
+        report['fault'] = 'The transfer timed out.'
+        report['new_target'] = dict(TARGET, mount_point='/media/DAPLINK1',
+                                    serial_port='/dev/ttyACM1')
+        record = make_record('flash', TARGET, 'simple', EXIT_CODE_TRANSIENT_ERROR, 1.5, report)
+        self.assertEqual(record['target_id'], TARGET['target_id'])
+        self.assertEqual(record['platform'], 'K64F')
+        self.assertFalse(record['success'])
+        self.assertEqual(record['fault'], 'The transfer timed out.')
+        self.assertEqual(record['mount_point'], '/media/DAPLINK')
+        self.assertEqual(record['new_mount_point'], '/media/DAPLINK1')
+        self.assertEqual(record['new_serial_port'], '/dev/ttyACM1')
+        self.assertEqual(record['phases'], {'copy': 0.25})
+        self.assertEqual(record['duration'], 1.5)
+
+    def test_record_without_report(self):
+        record = make_record('reset', TARGET, 'simple', 0, 0.1)
+        self.assertTrue(record['success'])
+        self.assertIsNone(record['fault'])
+        self.assertIsNone(record['new_mount_point'])
+        self.assertEqual(record['phases'], {})
+
+    def test_writer_writes_json_lines(self):
+        stream = StringIO()
+        writer = ResultWriter(stream)
+        writer.write(make_record('reset', TARGET, 'simple', 0, 0.1))
+        writer.write(make_record('reset', TARGET, 'simple', 13, 0.1))
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(writer.count, 2)
+        self.assertEqual([json.loads(line)['retcode'] for line in lines], [0, 13])
+        writer.close()
+        self.assertFalse(stream.closed)
+
+    def test_open_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'results.jsonl')
+            with ResultWriter.open(path) as writer:
+                writer.write(make_record('reset', TARGET, 'simple', 0, 0.1))
+            self.assertTrue(writer.stream.closed)
+            with open(path) as result_file:
+                self.assertEqual(json.loads(result_file.read())['operation'], 'reset')
+        finally:
+            shutil.rmtree(directory)
+
+
+@unittest.skipIf(not hasattr(os, 'openpty'), "virtual devices need pty serial ports")
+class DeviceResultsTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.farm = VirtualFarm(count=3, remount_time=0.05).register()
+        self.device_cache = DeviceCache(ttl=0, flashers=[FlasherVirtual])
+        self.stream = StringIO()
+        self.writer = ResultWriter(self.stream)
+
+    def tearDown(self):
+        self.farm.close()
+
+    def _streamed(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_flash_records(self):
+        self.farm.devices[1].fail_next(EXIT_CODE_TRANSIENT_ERROR)
+        flasher = Flash(device_cache=self.device_cache, result_writer=self.writer)
+        flasher.flash_multiple(IMAGE, 'K64F', max_workers=3, no_reset=True)
+        self.assertEqual(list(flasher.records), list(flasher.results))
+        streamed = dict((record['target_id'], record) for record in self._streamed())
+        self.assertEqual(set(streamed), set(flasher.results))
+        failed = streamed[self.farm.devices[1].target_id]
+        self.assertEqual(failed['retcode'], EXIT_CODE_TRANSIENT_ERROR)
+        self.assertTrue(failed['fault'])
+        succeeded = streamed[self.farm.devices[0].target_id]
+        self.assertEqual(succeeded['retcode'], 0)
+        self.assertIsNone(succeeded['fault'])
+        self.assertFalse(succeeded['skipped'])
+        self.assertEqual(succeeded['new_mount_point'], self.farm.devices[0].mount_point)
+        self.assertEqual(list(succeeded['phases']),
+                         ['pre-reset', 'copy', 'detach', 'remount', 'verify', 'post-reset'])
+
+    def test_reset_records(self):
+        resetter = Reset(device_cache=self.device_cache, result_writer=self.writer)
+        self.assertEqual(resetter.reset(target_id='all', method='simple'), 0)
+        self.assertEqual(len(self._streamed()), 3)
+        self.assertEqual([record['operation'] for record in resetter.records.values()],
+                         ['reset'] * 3)
+
+    def test_faulted_erase_record(self):
+        failing = self.farm.devices[0]
+        failing.fail_next(EXIT_CODE_TRANSIENT_ERROR)
+        eraser = Erase(device_cache=self.device_cache, result_writer=self.writer)
+        ret = eraser.erase(target_id=[device.target_id for device in self.farm.devices[:2]],
+                           no_reset=True, method='simple')
+        self.assertEqual(ret, EXIT_CODE_TRANSIENT_ERROR)
+        streamed = dict((record['target_id'], record) for record in self._streamed())
+        failed = streamed[failing.target_id]
+        self.assertEqual(failed['operation'], 'erase')
+        self.assertEqual(failed['retcode'], EXIT_CODE_TRANSIENT_ERROR)
+        self.assertFalse(failed['success'])
+        self.assertTrue(failed['fault'])
+        self.assertTrue(streamed[self.farm.devices[1].target_id]['success'])
+
+    def test_unmapped_records(self):
+        resetter = Reset(device_cache=self.device_cache, result_writer=self.writer)
+        self.assertEqual(resetter.reset(target_id=['ffff'], method='simple'),
+                         EXIT_CODE_COULD_NOT_MAP_TO_DEVICE)
+        eraser = Erase(device_cache=self.device_cache, result_writer=self.writer)
+        target_id = self.farm.devices[0].target_id
+        self.assertEqual(eraser.erase(target_id=target_id, method='unknown'),
+                         EXIT_CODE_NONSUPPORTED_METHOD_FOR_ERASE)
+        flasher = Flash(device_cache=self.device_cache, result_writer=self.writer)
+        unknown = '0240' + 'f' * 44
+        self.assertEqual(flasher.flash(IMAGE, target_id=unknown),
+                         EXIT_CODE_TARGET_ID_COULD_NOT_BE_MAPPED_TO_DEVICE)
+        self.assertEqual(flasher.flash('missing.bin', target_id=target_id),
+                         EXIT_CODE_FILE_DOES_NOT_EXIST)
+        streamed = self._streamed()
+        self.assertEqual([(record['operation'], record['target_id'], record['retcode'])
+                          for record in streamed],
+                         [('reset', 'ffff', EXIT_CODE_COULD_NOT_MAP_TO_DEVICE),
+                          ('erase', target_id, EXIT_CODE_NONSUPPORTED_METHOD_FOR_ERASE),
+                          ('flash', unknown, EXIT_CODE_TARGET_ID_COULD_NOT_BE_MAPPED_TO_DEVICE),
+                          ('flash', target_id, EXIT_CODE_FILE_DOES_NOT_EXIST)])
+        self.assertFalse(any(record['success'] for record in streamed))
+        self.assertEqual(streamed[1]['mount_point'], self.farm.devices[0].mount_point)
+        self.assertEqual(list(resetter.records), ['ffff'])
+        self.assertEqual(list(flasher.records), [unknown, target_id])
+
+    def test_interrupted_flash_record(self):
+        flasher = Flash(device_cache=self.device_cache, result_writer=self.writer)
+        target_id = self.farm.devices[0].target_id
+        with mock.patch.object(FlasherVirtual, 'flash', side_effect=KeyboardInterrupt):
+            self.assertEqual(flasher.flash(IMAGE, target_id=target_id),
+                             EXIT_CODE_KEYBOARD_INTERRUPT)
+        record = self._streamed()[0]
+        self.assertEqual(record['target_id'], target_id)
+        self.assertEqual(record['retcode'], EXIT_CODE_KEYBOARD_INTERRUPT)
+        self.assertFalse(record['success'])
+
+    @mock.patch("mbed_flasher.main.logging")
+    def test_cli_result_file(self, _):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'results.jsonl')
+        get_device_cache().invalidate()
+        try:
+            cli = FlasherCLI(['flash', '-i', IMAGE, '--tid', '0240', '-t', 'K64F',
+                              '--no-reset', '--parallel', '3', '--result-file', path])
+            self.assertEqual(cli.execute(), 0)
+            with open(path) as result_file:
+                records = [json.loads(line) for line in result_file]
+        finally:
+            shutil.rmtree(directory)
+            get_device_cache().invalidate()
+        self.assertEqual(sorted(record['target_id'] for record in records),
+                         sorted(device.target_id for device in self.farm.devices))
+
+    @mock.patch("mbed_flasher.main.logging")
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_cli_json(self, mock_stdout, _):
+        get_device_cache().invalidate()
+        try:
+            cli = FlasherCLI(['reset', '--tid', 'all', '--json'])
+            self.assertEqual(cli.execute(), 0)
+        finally:
+            get_device_cache().invalidate()
+        records = [json.loads(line) for line in mock_stdout.getvalue().splitlines()]
+        self.assertEqual(len(records), 3)
+
+    @mock.patch("mbed_flasher.main.logging")
+    @mock.patch('sys.stderr', new_callable=StringIO)
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_cli_json_only_records(self, mock_stdout, mock_stderr, _):
+        get_device_cache().invalidate()
+        try:
+            cli = FlasherCLI(['reset', '--tid', 'ffff', '--json'])
+            self.assertEqual(cli.execute(), EXIT_CODE_COULD_NOT_MAP_DEVICE)
+        finally:
+            get_device_cache().invalidate()
+        records = [json.loads(line) for line in mock_stdout.getvalue().splitlines()]
+        self.assertEqual([(record['target_id'], record['retcode']) for record in records],
+                         [('ffff', EXIT_CODE_COULD_NOT_MAP_DEVICE)])
+        self.assertIn('Could not find given target_id', mock_stderr.getvalue())
+        self.assertIs(sys.stdout, mock_stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
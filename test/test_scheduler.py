@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import threading
+import time
+import unittest
+import mock
+from mbed_flasher.devices import DeviceCache
+from mbed_flasher.scheduler import Job, Scheduler
+
+
+class FakeFlasher(object):
+    @staticmethod
+    def get_available_devices():
+        return [{'target_id': 'A', 'platform_name': 'K64F', 'serial_port': '/dev/ttyACM0'}]
+
+
+class RecordingScheduler(Scheduler):
+    """
+    Scheduler which records jobs instead of running operations
+    """
+    def __init__(self, *args, **kwargs):
+        super(RecordingScheduler, self).__init__(*args, **kwargs)
+        self.order = []
+        self.active = {}
+        self.overlaps = []
+        self.max_active = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.lock = threading.Lock()
+
+    def _run(self, job):
+        self.gate.wait()
+        with self.lock:
+            if self.active.get(job.target_id):
+                self.overlaps.append(job)
+            self.active[job.target_id] = True
+            self.max_active = max(self.max_active, sum(self.active.values()))
+            self.order.append(job.options.get('name'))
+        time.sleep(0.05)
+        with self.lock:
+            self.active[job.target_id] = False
+        if job.options.get('fail'):
+            raise ValueError('failed')
+        return 0
+
+
+class JobTestCase(unittest.TestCase):
+    def test_unknown_operation(self):
+        with self.assertRaises(ValueError):
+            Job('format', 'A')
+
+    def test_flash_requires_build(self):
+        with self.assertRaises(ValueError):
+            Job('flash', 'A')
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def test_same_device_ordered_by_priority_and_arrival(self):
+        with RecordingScheduler() as scheduler:
+            scheduler.gate.clear()
+            first = scheduler.reset('A', name='first')
+            time.sleep(0.05)
+            jobs = [scheduler.reset('A', name='low1'),
+                    scheduler.reset('A', priority=5, name='high'),
+                    scheduler.reset('A', name='low2')]
+            scheduler.gate.set()
+            for job in [first] + jobs:
+                self.assertEqual(job.result(timeout=5), 0)
+        self.assertEqual(scheduler.order, ['first', 'high', 'low1', 'low2'])
+        self.assertEqual(scheduler.overlaps, [])
+
+    def test_devices_run_in_parallel(self):
+        with RecordingScheduler(max_workers=4) as scheduler:
+            jobs = [scheduler.reset(target_id) for target_id in 'ABCD']
+            for job in jobs:
+                job.result(timeout=5)
+        self.assertEqual(scheduler.max_active, 4)
+
+    def test_max_workers_bounds_concurrency(self):
+        with RecordingScheduler(max_workers=2) as scheduler:
+            jobs = [scheduler.reset(target_id) for target_id in 'ABCD']
+            for job in jobs:
+                job.result(timeout=5)
+        self.assertEqual(scheduler.max_active, 2)
+
+    def test_submit_all_bounds_running_jobs(self):
+        with RecordingScheduler(max_workers=4) as scheduler:
+            jobs = scheduler.submit_all([Job('reset', target_id) for target_id in 'ABCD'],
+                                        max_running=2)
+            for job in jobs:
+                self.assertEqual(job.result(timeout=5), 0)
+        self.assertEqual(scheduler.max_active, 2)
+
+    def test_submit_all_without_limit(self):
+        with RecordingScheduler(max_workers=4) as scheduler:
+            jobs = scheduler.submit_all([Job('reset', target_id) for target_id in 'ABCD'])
+            for job in jobs:
+                job.result(timeout=5)
+        self.assertEqual(scheduler.max_active, 4)
+
+    def test_exception_delivered_to_job(self):
+        with RecordingScheduler() as scheduler:
+            failing = scheduler.reset('A', fail=True)
+            following = scheduler.reset('A')
+            with self.assertRaises(ValueError):
+                failing.result(timeout=5)
+            self.assertEqual(following.result(timeout=5), 0)
+
+    def test_stats(self):
+        with RecordingScheduler() as scheduler:
+            scheduler.gate.clear()
+            # queue all jobs before a worker can take the first one
+            # pylint: disable=protected-access
+            with scheduler._condition:
+                jobs = [scheduler.reset('A') for _ in range(3)]
+            time.sleep(0.05)
+            stats = scheduler.stats()
+            self.assertEqual(stats['queued'], 2)
+            self.assertEqual(stats['queue_depth'], {'A': 2})
+            self.assertEqual(stats['running'], 1)
+            scheduler.gate.set()
+            for job in jobs:
+                job.result(timeout=5)
+        stats = scheduler.stats()
+        self.assertEqual(stats['completed'], 3)
+        self.assertEqual(stats['max_queue_depth'], 3)
+        self.assertGreater(stats['wait_time_max'], 0.05)
+        self.assertGreater(stats['wait_time_mean'], 0)
+        self.assertIsNotNone(jobs[-1].wait_time)
+
+    def test_shutdown_runs_queued_jobs(self):
+        scheduler = RecordingScheduler()
+        jobs = [scheduler.reset('A') for _ in range(3)]
+        scheduler.shutdown()
+        self.assertTrue(all(job.done() for job in jobs))
+        with self.assertRaises(RuntimeError):
+            scheduler.reset('A')
+
+    @mock.patch('mbed_flasher.reset.Reset.reset')
+    def test_reset_job_runs_reset(self, mock_reset):
+        mock_reset.return_value = 0
+        with Scheduler(device_cache=DeviceCache(ttl=60, flashers=[FakeFlasher])) as scheduler:
+            self.assertEqual(scheduler.reset('A', method='pyocd').result(timeout=5), 0)
+        mock_reset.assert_called_once_with(target_id='A', method='pyocd')
+
+    @mock.patch('mbed_flasher.flash.Flash.flash')
+    def test_flash_job_runs_flash(self, mock_flash):
+        mock_flash.return_value = 0
+        with Scheduler(device_cache=DeviceCache(ttl=60, flashers=[FakeFlasher])) as scheduler:
+            job = scheduler.flash('A', 'image.bin', no_reset=True, timing_profile='probe')
+            self.assertEqual(job.result(timeout=5), 0)
+        mock_flash.assert_called_once_with(build='image.bin', target_id='A',
+                                           method='simple', no_reset=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import logging
+import unittest
+import mock
+from serial.serialutil import SerialException
+from mbed_flasher.flashers.FlasherMbed import FlasherMbed, STATE_PRE_RESET, STATE_DETACH, \
+    STATE_REMOUNT, STATE_POST_RESET
+from mbed_flasher.serial_reset import SerialResetter, PORT_SETTINGS, \
+    EXIT_CODE_RESET_FAILED_PORT_OPEN, EXIT_CODE_SERIAL_RESET_FAILED
+
+
+@mock.patch('mbed_flasher.serial_reset.EnhancedSerial')
+class SerialResetterTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def test_port_opened_configured(self, mock_serial):
+        mock_serial.return_value.safe_send_break.return_value = True
+        self.assertEqual(SerialResetter().reset('/dev/ttyACM0'), 0)
+        mock_serial.assert_called_once_with('/dev/ttyACM0', **PORT_SETTINGS)
+        mock_serial.return_value.close.assert_called_once_with()
+
+    def test_kept_port_is_reused(self, mock_serial):
+        mock_serial.return_value.safe_send_break.return_value = True
+        with SerialResetter(keep_open=True) as resetter:
+            self.assertEqual(resetter.reset('/dev/ttyACM0'), 0)
+            self.assertEqual(resetter.reset('/dev/ttyACM0'), 0)
+            self.assertFalse(mock_serial.return_value.close.called)
+        self.assertEqual(resetter.opened, 1)
+        mock_serial.return_value.close.assert_called_once_with()
+
+    def test_changed_port_is_reopened(self, mock_serial):
+        mock_serial.return_value.safe_send_break.return_value = True
+        with SerialResetter(keep_open=True) as resetter:
+            resetter.reset('/dev/ttyACM0')
+            resetter.reset('/dev/ttyACM1')
+        self.assertEqual([call[0][0] for call in mock_serial.call_args_list],
+                         ['/dev/ttyACM0', '/dev/ttyACM1'])
+
+    def test_stale_port_is_reopened(self, mock_serial):
+        stale, fresh = mock.Mock(), mock.Mock()
+        stale.safe_send_break.return_value = True
+        fresh.safe_send_break.return_value = True
+        mock_serial.side_effect = [stale, fresh]
+        with SerialResetter(keep_open=True) as resetter:
+            self.assertEqual(resetter.reset('/dev/ttyACM0'), 0)
+            stale.flushInput.side_effect = SerialException('device reports readiness')
+            self.assertEqual(resetter.reset('/dev/ttyACM0'), 0)
+        self.assertEqual(resetter.opened, 2)
+        self.assertTrue(stale.close.called)
+        self.assertEqual(fresh.safe_send_break.call_count, 1)
+
+    def test_failures(self, mock_serial):
+        mock_serial.return_value.safe_send_break.return_value = False
+        self.assertEqual(SerialResetter().reset('/dev/ttyACM0'), EXIT_CODE_SERIAL_RESET_FAILED)
+        mock_serial.side_effect = SerialException('could not open port')
+        with mock.patch('sys.stdout'):
+            self.assertEqual(SerialResetter().reset('/dev/ttyACM0'),
+                             EXIT_CODE_RESET_FAILED_PORT_OPEN)
+
+    @mock.patch('mbed_flasher.common.MountVerifier.check_points_unchanged')
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.verify_flash_success')
+    @mock.patch('mbed_flasher.flashers.FlasherMbed.FlasherMbed.copy_file')
+    def test_flash_closes_port_during_remount(self, _, mock_verify, mock_verifier,
+                                              mock_serial):
+        target = {'target_id': '123', 'mount_point': '/mnt/DAPLINK',
+                  'serial_port': '/dev/ttyACM0'}
+        mock_verifier.return_value = target
+        mock_verify.return_value = 0
+        mock_serial.return_value.safe_send_break.return_value = True
+        flasher = FlasherMbed(timing_profile='probe')
+        flasher.timing = dict(flasher.timing)
+        for state in (STATE_PRE_RESET, STATE_DETACH, STATE_REMOUNT, STATE_POST_RESET):
+            flasher.timing[state] = 0
+        with mock.patch.object(flasher, 'runner'):
+            self.assertEqual(flasher.flash(source='image.bin', target=target,
+                                           method='simple', no_reset=False), 0)
+        # closed before detach, opened once again after the remount
+        self.assertEqual(mock_serial.call_args_list,
+                         [mock.call('/dev/ttyACM0', **PORT_SETTINGS)] * 2)
+        self.assertEqual(mock_serial.return_value.safe_send_break.call_count, 2)
+        self.assertEqual(mock_serial.return_value.close.call_count, 2)
+
+    def test_open_failure_left_to_reset(self, mock_serial):
+        mock_serial.side_effect = [SerialException('device not ready'), mock.Mock()]
+        with SerialResetter(keep_open=True) as resetter:
+            self.assertFalse(resetter.open('/dev/ttyACM0'))
+            self.assertEqual(resetter.reset('/dev/ttyACM0'), 0)
+        self.assertEqual(resetter.opened, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs one mbedflash command and reports modules imported on the way
+COMMAND_SCRIPT = """
+import json, sys, time
+start = time.time()
+from mbed_flasher.main import FlasherCLI
+import_time = time.time() - start
+sys.stdout = open('stdout.txt', 'w')
+retcode = FlasherCLI(sys.argv[1:]).execute()
+sys.stdout.close()
+sys.stdout = sys.__stdout__
+print(json.dumps({'retcode': retcode, 'import_time': import_time,
+                  'modules': sorted(sys.modules)}))
+"""
+
+
+class StartupTestCase(unittest.TestCase):
+    """
+    Guards import cost of short commands, heavy modules are only imported
+    by the subcommands which use them
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.env = dict(os.environ, MBED_FLASHER_CACHE_DIR=self.tmp_dir,
+                        PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _run(self, *args):
+        output = subprocess.check_output([sys.executable, '-c', COMMAND_SCRIPT] + list(args),
+                                         cwd=self.tmp_dir, env=self.env)
+        return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+    def _assert_not_imported(self, result, modules):
+        imported = [module for module in modules if module in result['modules']]
+        self.assertEqual(imported, [], "imported %s, cli import took %.3fs"
+                         % (imported, result['import_time']))
+
+    def test_cli_import(self):
+        result = self._run('version')
+        self._assert_not_imported(result, ['pkg_resources', 'mbed_lstools', 'serial',
+                                           'mbed_flasher.flash', 'mbed_flasher.erase',
+                                           'mbed_flasher.reset'])
+
+    def test_version(self):
+        result = self._run('version')
+        self.assertEqual(result['retcode'], 0)
+        with open(os.path.join(self.tmp_dir, 'stdout.txt')) as stdout:
+            from mbed_flasher import __version__
+            self.assertEqual(stdout.read().strip(), __version__)
+
+    def test_list_with_platform_database(self):
+        self._run('list')
+        result = self._run('list')
+        self.assertEqual(result['retcode'], 0)
+        self._assert_not_imported(result, ['pkg_resources', 'mbed_lstools', 'serial',
+                                           'mbed_flasher.flash'])
+        with open(os.path.join(self.tmp_dir, 'stdout.txt')) as stdout:
+            self.assertIn('K64F', json.loads(stdout.read()))
+
+    def test_reset(self):
+        result = self._run('reset')
+        self.assertEqual(result['retcode'], 15)
+        self._assert_not_imported(result, ['pkg_resources', 'mbed_flasher.flash',
+                                           'mbed_flasher.erase', 'mbed_flasher.image'])
+
+
+if __name__ == '__main__':
+    unittest.main()
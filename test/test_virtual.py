@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import logging
+import os
+import time
+import unittest
+import mock
+from mbed_flasher.common import MountVerifier
+from mbed_flasher.daplink_errors import EXIT_CODE_TRANSIENT_ERROR
+from mbed_flasher.devices import DeviceCache
+from mbed_flasher.erase import Erase
+from mbed_flasher.flash import Flash
+from mbed_flasher.flashers import AvailableFlashers
+from mbed_flasher.flashers.enhancedserial import EnhancedSerial
+from mbed_flasher.flashers.FlasherMbed import FlasherMbed
+from mbed_flasher.flashers.FlasherVirtual import VirtualFarm, FlasherVirtual, VirtualSerial
+from mbed_flasher.serial_reset import SerialResetter, PORT_SETTINGS
+
+SAFE_SEND_BREAK = EnhancedSerial.safe_send_break
+
+IMAGE = os.path.join('test', 'helloworld.bin')
+
+
+@unittest.skipIf(not hasattr(os, 'openpty'), "virtual devices need pty serial ports")
+class VirtualFarmTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.farm = VirtualFarm(count=4, remount_time=0.05).register()
+        self.device_cache = DeviceCache(ttl=0, flashers=[FlasherVirtual])
+
+    def tearDown(self):
+        self.farm.close()
+
+    def test_registered(self):
+        self.assertIn(FlasherVirtual, AvailableFlashers)
+        devices = FlasherVirtual.get_available_devices()
+        self.assertEqual(len(devices), 4)
+        self.assertEqual(len(devices[0]['target_id']), 48)
+        for name in ('DETAILS.TXT', 'MBED.HTM'):
+            self.assertTrue(os.path.isfile(os.path.join(devices[0]['mount_point'], name)))
+        self.farm.close()
+        self.assertNotIn(FlasherVirtual, AvailableFlashers)
+        self.assertEqual(FlasherVirtual.get_available_devices(), [])
+
+    def test_flash_consumes_image_and_remounts(self):
+        flasher = Flash(device_cache=self.device_cache)
+        self.assertEqual(AvailableFlashers[0], FlasherMbed)
+        with mock.patch('mbed_flasher.flashers.FlasherVirtual.MountVerifier',
+                        wraps=MountVerifier) as mock_verifier:
+            self.assertEqual(flasher.flash_multiple(IMAGE, 'K64F', max_workers=4), 0)
+        # devices of the farm are flashed by FlasherVirtual with the farm's root
+        self.assertEqual(mock_verifier.call_count, 4)
+        self.assertTrue(all(call[1]['root'] == self.farm.root
+                            for call in mock_verifier.call_args_list))
+        for device in self.farm.devices:
+            self.assertEqual(device.consumed, ['helloworld.bin'])
+            self.assertEqual(device.remount_count, 1)
+            # resets before and after copy
+            self.assertTrue(_wait(lambda: device.breaks == 2), device.breaks)
+            self.assertFalse(os.path.exists(os.path.join(device.mount_point,
+                                                         'helloworld.bin')))
+
+    def test_failure_on_demand(self):
+        failing = self.farm.devices[1]
+        failing.fail_next(EXIT_CODE_TRANSIENT_ERROR)
+        flasher = Flash(device_cache=self.device_cache)
+        flasher.flash_multiple(IMAGE, 'K64F', max_workers=4, no_reset=True)
+        self.assertEqual(list(flasher.results.values()), [0, EXIT_CODE_TRANSIENT_ERROR, 0, 0])
+        self.assertTrue(os.path.isfile(os.path.join(failing.mount_point, 'FAIL.TXT')))
+        self.assertRaises(ValueError, failing.fail_next, 99)
+
+    def test_erase(self):
+        eraser = Erase(device_cache=self.device_cache)
+        target_id = self.farm.devices[0].target_id
+        self.assertEqual(eraser.erase(target_id=target_id, no_reset=True, method='simple'), 0)
+        self.assertEqual(self.farm.devices[0].consumed, ['ERASE.ACT'])
+
+    def test_serial_break_recorded(self):
+        device = self.farm.devices[2]
+        self.assertEqual(FlasherVirtual().reset_board(device.serial_port), 0)
+        self.assertEqual(device.breaks, 1)
+        port = VirtualSerial(device.serial_port, **PORT_SETTINGS)
+        try:
+            port.flushOutput()
+            port.write(b'data')
+            time.sleep(0.1)
+        finally:
+            port.close()
+        self.assertEqual(device.breaks, 1)
+
+    def test_other_resetter_uncounted(self):
+        device = self.farm.devices[2]
+        self.assertIs(EnhancedSerial.safe_send_break, SAFE_SEND_BREAK)
+        self.assertEqual(SerialResetter().reset(device.serial_port), 0)
+        self.assertEqual(device.breaks, 0)
+        self.assertEqual(SerialResetter(serial_class=VirtualSerial).reset(device.serial_port), 0)
+        self.assertEqual(device.breaks, 1)
+
+    def test_mount_verifier_waits_for_remount(self):
+        device = self.farm.devices[3]
+        device.remount_time = 0.3
+        target = device.to_mbed()
+        with open(os.path.join(device.mount_point, 'image.bin'), 'wb') as image:
+            image.write(b'\0' * 1024)
+        self.assertTrue(_wait(lambda: not device.mounted))
+        verifier = MountVerifier(logging.getLogger('mbed-flasher'), root=self.farm.root)
+        new_target = verifier.check_points_unchanged(target)
+        self.assertTrue(device.mounted)
+        self.assertEqual(new_target['mount_point'], device.mount_point)
+        self.assertEqual(new_target['dev_point'], '/dev/vd3')
+        self.assertEqual(device.remount_count, 1)
+
+
+def _wait(predicate, timeout=2):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 ARM Limited
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint:disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from mbed_flasher.watcher import FileRemoved, MountVanished, MountReturned, \
+    InotifyWatcher, PollingWatcher, MountReactor, WATCH_DONE, WATCH_FAILED, create_watcher
+
+
+def touch(path):
+    with open(path, 'w'):
+        pass
+
+
+def delayed(delay, function, *args):
+    thread = threading.Timer(delay, function, args)
+    thread.start()
+    return thread
+
+
+class WatcherTestCase(unittest.TestCase):
+    watcher_class = PollingWatcher
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.mount_point = os.path.join(self.root, 'DAPLINK')
+        os.mkdir(self.mount_point)
+        touch(os.path.join(self.mount_point, 'MBED.HTM'))
+        self.watcher = self.watcher_class()
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.root)
+
+    def test_file_removed(self):
+        image = os.path.join(self.mount_point, 'image.bin')
+        touch(image)
+        timer = delayed(0.2, os.remove, image)
+        start = time.time()
+        result = self.watcher.wait(FileRemoved(self.mount_point, 'image.bin'), 5)
+        timer.join()
+        self.assertEqual(result, WATCH_DONE)
+        self.assertLess(time.time() - start, 1)
+
+    def test_fail_file_fails_fast(self):
+        touch(os.path.join(self.mount_point, 'FAIL.TXT'))
+        start = time.time()
+        result = self.watcher.wait(FileRemoved(self.mount_point, 'image.bin'), 5)
+        self.assertEqual(result, WATCH_FAILED)
+        self.assertLess(time.time() - start, 1)
+
+    def test_file_removed_timeout(self):
+        touch(os.path.join(self.mount_point, 'image.bin'))
+        result = self.watcher.wait(FileRemoved(self.mount_point, 'image.bin'), 0.3)
+        self.assertIsNone(result)
+
+    def test_mount_vanished_and_returned(self):
+        timer = delayed(0.2, shutil.rmtree, self.mount_point)
+        result = self.watcher.wait(MountVanished(self.mount_point), 5)
+        timer.join()
+        self.assertEqual(result, WATCH_DONE)
+
+        def remount():
+            os.mkdir(self.mount_point)
+            touch(os.path.join(self.mount_point, 'MBED.HTM'))
+        timer = delayed(0.2, remount)
+        start = time.time()
+        result = self.watcher.wait(MountReturned(self.mount_point), 5)
+        timer.join()
+        self.assertEqual(result, WATCH_DONE)
+        self.assertLess(time.time() - start, 1.5)
+
+
+@unittest.skipIf(not InotifyWatcher.is_available(), "inotify not available")
+class InotifyWatcherTestCase(WatcherTestCase):
+    watcher_class = InotifyWatcher
+
+
+class MountReactorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.reactor = MountReactor()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _mount_point(self, index):
+        mount_point = os.path.join(self.root, 'DAPLINK%i' % index)
+        os.mkdir(mount_point)
+        touch(os.path.join(mount_point, 'MBED.HTM'))
+        touch(os.path.join(mount_point, 'image.bin'))
+        return mount_point
+
+    def test_many_devices_one_thread(self):
+        mount_points = [self._mount_point(index) for index in range(20)]
+        futures = []
+        reactor_threads = set()
+        for mount_point in mount_points:
+            futures.append(self.reactor.watch_file_removed(mount_point, 'image.bin', 5))
+            # pylint: disable=protected-access
+            reactor_threads.add(self.reactor._thread)
+        self.assertEqual(len(reactor_threads), 1)
+
+        # fault file first, the device has failed once the image is gone
+        touch(os.path.join(mount_points[0], 'FAIL.TXT'))
+        for mount_point in mount_points:
+            os.remove(os.path.join(mount_point, 'image.bin'))
+
+        results = [future.result() for future in futures]
+        self.assertEqual(results[0], WATCH_FAILED)
+        self.assertEqual(results[1:], [WATCH_DONE] * 19)
+        self.assertEqual(self.reactor.pending_count(), 0)
+
+    def test_mixed_conditions_and_timeout(self):
+        vanishing = self._mount_point(0)
+        stuck = self._mount_point(1)
+        vanished = self.reactor.watch_mount_vanished(vanishing, 5)
+        returned = self.reactor.watch_mount_returned(vanishing + '_NEW', 5)
+        timed_out = self.reactor.watch_file_removed(stuck, 'image.bin', 0.3)
+
+        shutil.rmtree(vanishing)
+        os.mkdir(vanishing + '_NEW')
+        touch(os.path.join(vanishing + '_NEW', 'MBED.HTM'))
+
+        self.assertEqual(vanished.result(), WATCH_DONE)
+        self.assertEqual(returned.result(), WATCH_DONE)
+        self.assertIsNone(timed_out.result())
+
+    def test_condition_added_during_scan(self):
+        first = self._mount_point(0)
+        second = self._mount_point(1)
+        scan = self.reactor._scan  # pylint: disable=protected-access
+        added = []
+        watching = threading.Event()
+
+        def scan_and_watch():
+            pending = scan()
+            if not pending and not added:
+                # another thread starts waiting after the first condition resolved
+                added.append(self.reactor.watch_mount_returned(second, 5))
+                watching.set()
+            return pending
+
+        self.reactor._scan = scan_and_watch  # pylint: disable=protected-access
+        self.assertEqual(self.reactor.watch_mount_returned(first, 5).result(), WATCH_DONE)
+        self.assertTrue(watching.wait(5))
+        self.assertEqual(added[0].result(), WATCH_DONE)
+
+
+class CreateWatcherTestCase(unittest.TestCase):
+    def test_create_watcher(self):
+        watcher = create_watcher()
+        try:
+            if InotifyWatcher.is_available():
+                self.assertIsInstance(watcher, InotifyWatcher)
+            else:
+                self.assertIsInstance(watcher, PollingWatcher)
+        finally:
+            watcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()